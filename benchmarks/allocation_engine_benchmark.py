@@ -0,0 +1,211 @@
+"""
+Расчёт распределения регулярного задания (create_task_for_product): прежний по товарам в циклах ('python')
+против векторного движка ('numpy') на синтетическом каталоге. Проверяет, что тела заявок совпадают.
+
+Запуск:  python -m benchmarks.allocation_engine_benchmark --articles 20000 --sizes 4
+         python -m benchmarks.allocation_engine_benchmark --articles 3000 --profile python   (горячие функции расчёта)
+"""
+import argparse
+import copy
+import logging
+import random
+import time
+from decimal import Decimal
+from types import SimpleNamespace
+from typing import Any, Dict, List, Tuple
+
+REGION_IDS = list(range(1, 9))
+SIZE_NAMES = ["42", "44", "46", "48", "50", "52", "54", "56"]
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Векторный движок распределения против расчёта в циклах")
+    parser.add_argument("--articles", type=int, default=20000)
+    parser.add_argument("--sizes", type=int, default=4)
+    parser.add_argument("--warehouses", type=int, default=64)
+    parser.add_argument("--balanced-share", type=float, default=0.5, help="Доля артикулов, уже распределённых по долям задания")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--profile", choices=("python", "numpy"), help="Вывести профиль (cProfile) полного расчёта движком")
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+def build_inputs(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Каталог в формате create_product_collection_with_regions: остатки сосредоточены в паре регионов,
+    поэтому у части SKU есть регионы ниже минимума и доноры с излишком. Остальные (--balanced-share) уже лежат
+    по регионам примерно в долях задания, и перемещать по ним нечего.
+    """
+    rnd = random.Random(args.seed)
+    warehouses_by_region = {region_id: [] for region_id in REGION_IDS}
+    for wh_id in range(1, args.warehouses + 1):
+        warehouses_by_region[REGION_IDS[wh_id % len(REGION_IDS)]].append(wh_id)
+
+    region_priority_dict = {region_id: {"src_priority": rnd.randint(1, 20), "dst_priority": rnd.randint(1, 20)}
+                            for region_id in REGION_IDS}
+    warehouse_priority_dict = {wh_id: {"src_priority": rnd.choice([None, *range(1, 50)]), "dst_priority": rnd.randint(1, 50)}
+                               for wh_ids in warehouses_by_region.values() for wh_id in wh_ids}
+    quota_dict = {wh_id: {"src": rnd.choice([0, 50, 500, 5000]), "dst": rnd.choice([0, 100, 1000, 10000])}
+                  for wh_id in warehouse_priority_dict}
+
+    attributes = {1: "siberia", 2: "south", 3: "central", 4: "far_east", 5: "north_west", 6: "north_caucasus", 7: "urals", 8: "volga"}
+    task_row = {"task_id": 1}
+    for region_id, attribute in attributes.items():
+        target = Decimal(rnd.randint(3, 25)) / 100
+        task_row[f"target_{attribute}"] = target
+        task_row[f"min_{attribute}"] = (target * Decimal("0.6")).quantize(Decimal("0.001"))
+        task_row[f"min_qty_to_transfer_{attribute}"] = rnd.choice([None, 0, 2, 5])
+
+    size_map = {name: size_id for size_id, name in enumerate(SIZE_NAMES, start=1)}
+    products, chrtids, blocked = {}, {}, {}
+    for article_idx in range(args.articles):
+        nm_id = 100000 + article_idx
+        product = {"wb_article_id": nm_id, "total_qty": 0, "sizes": {}}
+        balanced = rnd.random() < args.balanced_share
+        donor_regions = REGION_IDS if balanced else rnd.sample(REGION_IDS, 2)
+        for size_id in range(1, args.sizes + 1):
+            size_name = SIZE_NAMES[size_id - 1]
+            chrtids.setdefault(nm_id, {})[size_name] = 500000000 + article_idx * 10 + size_id
+            if rnd.random() < 0.05:
+                blocked[f"{nm_id}_{size_id}"] = rnd.sample(list(warehouse_priority_dict), 3)
+            regions, availability = {}, {}
+            for region_id in REGION_IDS:
+                warehouses = {}
+                for wh_id in warehouses_by_region[region_id]:
+                    heavy = region_id in donor_regions
+                    if rnd.random() < (0.6 if heavy else 0.1):
+                        if balanced:
+                            share = task_row[f"target_{attributes[region_id]}"]
+                            warehouses[wh_id] = int(rnd.randint(200, 300) * share)
+                        else:
+                            warehouses[wh_id] = rnd.randint(20, 400) if heavy else rnd.randint(0, 5)
+                        availability[wh_id] = rnd.choice([0, 5, 30])
+                    else:
+                        warehouses[wh_id] = 0
+                regions[region_id] = {"region_id": region_id, "total_qty": sum(warehouses.values()), "warehouses": warehouses}
+            total = sum(region["total_qty"] for region in regions.values())
+            product["sizes"][size_id] = {"wb_article_id": nm_id, "size_id": size_id, "size_name": size_name, "total_qty": total,
+                                         "regions": regions, "availability_days_by_warehouse": availability,
+                                         "availability_days_by_region": {}, "orders_by_warehouse": {}, "orders_by_region": {}}
+            product["total_qty"] += total
+        products[nm_id] = product
+
+    return {"product_collection": products, "task_row": task_row, "region_priority_dict": region_priority_dict,
+            "warehouse_priority_dict": warehouse_priority_dict, "warehouses_available_to_stock_transfer": warehouses_by_region,
+            "quota_dict": quota_dict, "size_map": size_map, "blocked_warehouses_for_skus": blocked, "chrtids": chrtids}
+
+
+def build_factory(inputs: Dict[str, Any], engine: str, logger: logging.Logger):
+    from services.regular_task_factory import RegularTaskFactory
+
+    db_data_fetcher = SimpleNamespace(techsize_with_chrtid_dict=inputs["chrtids"], banned_warehouses_for_nmids={})
+    return RegularTaskFactory(db_controller=None, api_controller=None, db_data_fetcher=db_data_fetcher, cookie_jar=None,
+                              headers={}, logger=logger, size_map=inputs["size_map"], cookie_list=[], allocation_engine=engine)
+
+
+def plan(inputs: Dict[str, Any], engine: str, logger: logging.Logger) -> List[tuple]:
+    factory = build_factory(inputs, engine, logger)
+    factory.create_task_for_product(product_collection=copy.deepcopy(inputs["product_collection"]),
+                                    task_row=inputs["task_row"],
+                                    region_priority_dict=inputs["region_priority_dict"],
+                                    warehouse_priority_dict=inputs["warehouse_priority_dict"],
+                                    warehouses_available_to_stock_transfer=inputs["warehouses_available_to_stock_transfer"],
+                                    quota_dict=inputs["quota_dict"],
+                                    size_map=inputs["size_map"],
+                                    blocked_warehouses_for_skus=inputs["blocked_warehouses_for_skus"])
+    return [(req["src_warehouse_id"], req["dst_warehouse_id"], req["req_body"]) for req in factory.all_request_bodies_to_send]
+
+
+def allocate_only(inputs: Dict[str, Any], engine: str, logger: logging.Logger) -> Tuple[int, float]:
+    """
+    Только фаза распределения (цели, минимумы, жадный подбор доноров) без сборки заявок: (заданий по размерам, секунд).
+    """
+    from services.session_topology import SessionTopology
+
+    factory = build_factory(inputs, engine, logger)
+    products = list(copy.deepcopy(inputs["product_collection"]).values())
+    topology = SessionTopology(region_priority_dict=inputs["region_priority_dict"],
+                               warehouse_priority_dict=inputs["warehouse_priority_dict"],
+                               warehouses_available_to_stock_transfer=inputs["warehouses_available_to_stock_transfer"],
+                               quota_dict=inputs["quota_dict"],
+                               blocked_warehouses_for_skus=inputs["blocked_warehouses_for_skus"],
+                               size_map=inputs["size_map"])
+
+    start_time = time.perf_counter()
+    task_count = 0
+    allocation_plan = factory._prepare_allocation_plan(products, inputs["task_row"], topology)
+    for product_index, product in enumerate(products):
+        if allocation_plan is not None:
+            tasks, _ = allocation_plan.allocate(product_index)
+        else:
+            tasks, _ = factory._process_single_product(product, inputs["task_row"], topology)
+        task_count += len(tasks)
+    return task_count, time.perf_counter() - start_time
+
+
+def run(args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    import services.regular_task_factory # noqa: F401 - до настройки уровня логгера модуля
+
+    inputs = build_inputs(args)
+    logger = logging.getLogger("benchmarks.allocation_engine")
+    logger.setLevel(getattr(logging, args.log_level.upper(), logging.WARNING))
+    # simple_logger пишет DEBUG о каждом вызове в логгер модуля фабрики
+    logging.getLogger("services.regular_task_factory").setLevel(logger.level)
+
+    results, bodies = {}, {}
+    for engine in ("python", "numpy"):
+        timings = []
+        for _ in range(args.repeats):
+            start_time = time.perf_counter()
+            bodies[engine] = plan(inputs, engine, logger)
+            timings.append(time.perf_counter() - start_time)
+        allocation_timings = [allocate_only(inputs, engine, logger) for _ in range(args.repeats)]
+        results[engine] = {"seconds": sorted(timings)[len(timings) // 2],
+                           "allocation_seconds": sorted(timing for _, timing in allocation_timings)[len(allocation_timings) // 2],
+                           "tasks": allocation_timings[0][0],
+                           "requests": len(bodies[engine])}
+
+    results["numpy"]["same_bodies"] = bodies["numpy"] == bodies["python"]
+    results["python"]["same_bodies"] = True
+    return results
+
+
+def profile(args: argparse.Namespace, limit: int = 25):
+    """
+    cProfile одного полного расчёта (create_task_for_product) выбранным движком: горячие функции по собственному времени.
+    """
+    import cProfile
+    import pstats
+
+    import services.regular_task_factory # noqa: F401 - до настройки уровня логгера модуля
+
+    inputs = build_inputs(args)
+    logger = logging.getLogger("benchmarks.allocation_engine")
+    logger.setLevel(getattr(logging, args.log_level.upper(), logging.WARNING))
+    logging.getLogger("services.regular_task_factory").setLevel(logger.level)
+
+    profiler = cProfile.Profile()
+    profiler.runcall(plan, inputs, args.profile, logger)
+    pstats.Stats(profiler).sort_stats("tottime").print_stats(limit)
+
+
+def report(results: Dict[str, Dict[str, Any]], args: argparse.Namespace):
+    print(f"Артикулов: {args.articles}, размеров: {args.sizes}, SKU: {args.articles * args.sizes}")
+    print(f"{'движок':<8} {'распределение, с':>17} {'заданий':>8} {'всего, с':>9} {'заявок':>8} {'тела совпадают':>15}")
+    for name, row in results.items():
+        print(f"{name:<8} {row['allocation_seconds']:>17.3f} {row['tasks']:>8} {row['seconds']:>9.3f} "
+              f"{row['requests']:>8} {str(row['same_bodies']):>15}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.WARNING))
+    if args.profile:
+        profile(args)
+        return
+    report(run(args), args)
+
+
+if __name__ == "__main__":
+    main()
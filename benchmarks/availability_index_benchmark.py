@@ -0,0 +1,153 @@
+"""
+Индекс наличия: прежние множества дат по ключу (article, size, warehouse) против битовых масок AvailabilityIndex.
+Меряет память индекса, время сборки из потока интервалов и время подсчёта дней наличия по регионам
+(как в create_product_collection_with_regions), проверяет, что дни по складам и регионам совпадают.
+
+Запуск:  python -m benchmarks.availability_index_benchmark --keys 60000 --intervals 3
+"""
+import argparse
+import logging
+import random
+import time
+import tracemalloc
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Tuple
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Множества дат против битовых масок в индексе наличия")
+    parser.add_argument("--keys", type=int, default=60000, help="Ключей (артикул, размер, склад)")
+    parser.add_argument("--intervals", type=int, default=3, help="Интервалов наличия на ключ в среднем")
+    parser.add_argument("--warehouses", type=int, default=60)
+    parser.add_argument("--regions", type=int, default=8)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+class SetAvailabilityIndexBuilder:
+    """
+    Прежняя версия AvailabilityIndexBuilder: множество дат и days_count, пересчитываемый на каждой строке.
+    """
+
+    def __init__(self):
+        self.index: Dict[Tuple[int, int, int], Dict[str, Any]] = {}
+
+    def add_rows(self, rows):
+        for wb_article_id, size_id, warehouse_id, day_beg, day_end in rows:
+            key = (int(wb_article_id), int(size_id), int(warehouse_id))
+            node = self.index.get(key)
+            if node is None:
+                node = self.index[key] = {"days": set(), "days_count": 0}
+            days = node["days"]
+            for i in range((day_end - day_beg).days + 1):
+                days.add(day_beg + timedelta(days=i))
+            node["days_count"] = len(days)
+        return self
+
+
+def build_rows(args: argparse.Namespace) -> List[Tuple[int, int, int, date, date]]:
+    """
+    Интервалы наличия за последние --days дней; часть начинается раньше окна, как в выборке
+    (в запросе ограничен только time_end).
+    """
+    rnd = random.Random(args.seed)
+    today = date.today()
+    rows = []
+    for key_idx in range(args.keys):
+        article, size, warehouse = 100000 + key_idx // 40, key_idx // args.warehouses % 5, key_idx % args.warehouses
+        for _ in range(max(1, int(rnd.expovariate(1 / args.intervals)))):
+            day_end = today - timedelta(days=rnd.randrange(args.days))
+            length = rnd.choice([0, 1, 3, 7, 14, args.days + 10])
+            rows.append((article, size, warehouse, day_end - timedelta(days=length), day_end))
+    rnd.shuffle(rows)
+    return rows
+
+
+def region_keys(index, regions: int) -> List[List[Tuple[int, int, int]]]:
+    # Ключи одного артикула/размера и региона - склады региона
+    groups: Dict[Tuple[int, int, int], List[Tuple[int, int, int]]] = {}
+    for key in index:
+        groups.setdefault((key[0], key[1], key[2] % regions), []).append(key)
+    return list(groups.values())
+
+
+def set_region_days(index, groups) -> List[int]:
+    result = []
+    for keys in groups:
+        union_days = set()
+        for key in keys:
+            info = index.get(key)
+            if info:
+                union_days |= info["days"]
+        result.append(len(union_days))
+    return result
+
+
+def mask_region_days(index, groups) -> List[int]:
+    from services.availability_index import union_days_count
+
+    return [union_days_count(index.get(key) for key in keys) for keys in groups]
+
+
+def measure(build: Callable[[], Any], repeats: int) -> Tuple[Any, float, float]:
+    """
+    (результат, медианное время, МБ под результатом по tracemalloc).
+    """
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        build()
+        timings.append(time.perf_counter() - start_time)
+    tracemalloc.start()
+    try:
+        result = build()
+        memory, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, sorted(timings)[len(timings) // 2], memory / 1024 / 1024
+
+
+def run(args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    from services.availability_index import AvailabilityIndexBuilder, days_count
+
+    rows = build_rows(args)
+    set_index, set_seconds, set_memory = measure(lambda: SetAvailabilityIndexBuilder().add_rows(rows).index, args.repeats)
+    mask_index, mask_seconds, mask_memory = measure(lambda: AvailabilityIndexBuilder().add_rows(rows).index, args.repeats)
+
+    groups = region_keys(set_index, args.regions)
+    timings = {}
+    for name, func, index in (("sets", set_region_days, set_index), ("masks", mask_region_days, mask_index)):
+        start_time = time.perf_counter()
+        for _ in range(args.repeats):
+            region_days = func(index, groups)
+        timings[name] = ((time.perf_counter() - start_time) / args.repeats, region_days)
+
+    same = (set_index.keys() == mask_index.keys()
+            and all(node["days_count"] == days_count(mask_index[key]) for key, node in set_index.items())
+            and all(node["days"] == mask_index.days(key) for key, node in list(set_index.items())[:1000])
+            and timings["sets"][1] == timings["masks"][1])
+    return {"rows": len(rows), "keys": len(set_index), "groups": len(groups), "same": same,
+            "sets": {"build_seconds": set_seconds, "memory_mb": set_memory, "region_seconds": timings["sets"][0]},
+            "masks": {"build_seconds": mask_seconds, "memory_mb": mask_memory, "region_seconds": timings["masks"][0]}}
+
+
+def report(results: Dict[str, Any], args: argparse.Namespace):
+    print(f"Интервалов: {results['rows']}, ключей: {results['keys']}, групп (артикул, размер, регион): {results['groups']}")
+    print(f"{'индекс':<8} {'память, МБ':>11} {'сборка, с':>10} {'регионы, с':>11}")
+    for name in ("sets", "masks"):
+        row = results[name]
+        print(f"{name:<8} {row['memory_mb']:>11.1f} {row['build_seconds']:>10.3f} {row['region_seconds']:>11.3f}")
+    print(f"Дни по складам и регионам совпадают: {results['same']}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.WARNING))
+    report(run(args), args)
+
+
+if __name__ == "__main__":
+    main()
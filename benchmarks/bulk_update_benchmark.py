@@ -0,0 +1,103 @@
+"""
+Построчный UPDATE через executemany (один round-trip на строку) против SyncDatabase.bulk_update
+(пачки CASE-UPDATE в одной транзакции) на отдельной таблице с тем же ключом, что у товаров разовых заданий.
+
+Запуск:  python -m benchmarks.bulk_update_benchmark --rows 10000 --batch-size 500
+Таблица bench_bulk_update создаётся в базе --db и удаляется после прогона.
+"""
+import argparse
+import logging
+import random
+import time
+from typing import Dict, List, Tuple
+
+TABLE = "bench_bulk_update"
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="executemany UPDATE против bulk_update")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--db", default="dostup")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+def build_keys(row_count: int) -> List[Tuple[int, int, int]]:
+    # Как в заданиях: несколько заданий, в каждом сотни nmID по нескольку размеров
+    return [(task_id, 100000 + nm_idx, size_id)
+            for task_id in range(1, row_count // 1000 + 2)
+            for nm_idx in range(250)
+            for size_id in range(1, 5)][:row_count]
+
+
+def prepare_table(db, keys: List[Tuple[int, int, int]]):
+    db.execute_non_query(f"DROP TABLE IF EXISTS {TABLE}")
+    db.execute_non_query(f"""CREATE TABLE {TABLE} (
+                                task_id INT NOT NULL,
+                                product_wb_id BIGINT NOT NULL,
+                                size_id INT NOT NULL,
+                                transfer_qty_left INT NOT NULL,
+                                PRIMARY KEY (task_id, product_wb_id, size_id))""")
+    db.execute_many(f"INSERT INTO {TABLE} (task_id, product_wb_id, size_id, transfer_qty_left) VALUES (%s, %s, %s, %s)",
+                    [key + (0,) for key in keys])
+
+
+def check_table(db, expected: Dict[Tuple[int, int, int], int]) -> bool:
+    rows = db.execute_query(f"SELECT task_id, product_wb_id, size_id, transfer_qty_left FROM {TABLE}")
+    actual = {(row['task_id'], row['product_wb_id'], row['size_id']): row['transfer_qty_left'] for row in rows}
+    return actual == expected
+
+
+def run(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    from benchmarks.db_connection import connect_sync_database
+
+    db = connect_sync_database(args.db)
+    rnd = random.Random(args.seed)
+    keys = build_keys(args.rows)
+    results = {}
+
+    try:
+        prepare_table(db, keys)
+
+        expected = {key: rnd.randint(1, 500) for key in keys}
+        start_time = time.perf_counter()
+        db.execute_many(f"""UPDATE {TABLE} SET transfer_qty_left = %s
+                            WHERE task_id = %s AND product_wb_id = %s AND size_id = %s""",
+                        [(qty,) + key for key, qty in expected.items()])
+        elapsed = time.perf_counter() - start_time
+        results["executemany, построчно"] = {"seconds": elapsed, "rows_per_sec": len(keys) / elapsed,
+                                             "correct": check_table(db, expected)}
+
+        expected = {key: rnd.randint(1, 500) for key in keys}
+        start_time = time.perf_counter()
+        db.bulk_update(TABLE,
+                       key_columns=("task_id", "product_wb_id", "size_id"),
+                       set_columns=("transfer_qty_left",),
+                       rows=[key + (qty,) for key, qty in expected.items()],
+                       batch_size=args.batch_size)
+        elapsed = time.perf_counter() - start_time
+        results[f"bulk_update, пачки по {args.batch_size}"] = {"seconds": elapsed, "rows_per_sec": len(keys) / elapsed,
+                                                              "correct": check_table(db, expected)}
+    finally:
+        db.execute_non_query(f"DROP TABLE IF EXISTS {TABLE}")
+        db.pool.close_all()
+    return results
+
+
+def report(results: Dict[str, Dict[str, float]], row_count: int):
+    print(f"Строк: {row_count}")
+    print(f"{'способ':<32} {'сек':>9} {'строк/сек':>11} {'верно':>7}")
+    for name, row in results.items():
+        print(f"{name:<32} {row['seconds']:>9.3f} {row['rows_per_sec']:>11.0f} {str(row['correct']):>7}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.WARNING))
+    report(run(args), args.rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+from infrastructure.db.mysql.base import SyncDatabase
+from utils.access_data_loader import AccessDataLoader
+from utils.config import mysql_pool_settings
+from utils.logger import get_logger
+
+
+def connect_sync_database(db_name: str = "dostup", **pool_overrides) -> SyncDatabase:
+    """
+    SyncDatabase для бенчмарков: доступы берутся так же, как в dependencies (AccessDataLoader).
+    """
+    con_data = AccessDataLoader(logger=get_logger("benchmarks")).get_mysql_connect_params_dict()['no_db_fixed']
+    return SyncDatabase(host=con_data['host'],
+                        port=con_data['port'],
+                        user=con_data['user'],
+                        password=con_data['password'],
+                        db=db_name,
+                        **{**mysql_pool_settings, **pool_overrides})
@@ -0,0 +1,131 @@
+"""
+Повторный расчёт регулярного задания с кешем планов (PlanCache) против расчёта всех товаров заново
+на синтетическом каталоге из allocation_engine_benchmark: холодный кеш, те же входные данные,
+часть SKU изменилась, квоты уменьшились после отправки. Каждый прогон сверяется с расчётом без кеша.
+
+Запуск:  python -m benchmarks.plan_cache_benchmark --articles 20000 --changed-share 0.1
+Кеш пишется во временный каталог и удаляется после прогона.
+"""
+import argparse
+import copy
+import logging
+import os
+import random
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.allocation_engine_benchmark import build_inputs
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Кеш планов против расчёта всех товаров заново")
+    parser.add_argument("--articles", type=int, default=20000)
+    parser.add_argument("--sizes", type=int, default=4)
+    parser.add_argument("--warehouses", type=int, default=64)
+    parser.add_argument("--balanced-share", type=float, default=0.5)
+    parser.add_argument("--changed-share", type=float, default=0.1, help="Доля артикулов, у которых меняются остатки одного SKU")
+    parser.add_argument("--engine", choices=("python", "numpy"), default="numpy")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+def plan(inputs: Dict[str, Any], engine: str, plan_cache, logger: logging.Logger) -> Tuple[List[tuple], float]:
+    from services.regular_task_factory import RegularTaskFactory
+
+    db_data_fetcher = SimpleNamespace(techsize_with_chrtid_dict=inputs["chrtids"], banned_warehouses_for_nmids={})
+    factory = RegularTaskFactory(db_controller=None, api_controller=None, db_data_fetcher=db_data_fetcher, cookie_jar=None,
+                                 headers={}, logger=logger, size_map=inputs["size_map"], cookie_list=[],
+                                 allocation_engine=engine, planning_workers=0, plan_cache=plan_cache)
+    product_collection = copy.deepcopy(inputs["product_collection"])
+    start_time = time.perf_counter()
+    factory.create_task_for_product(product_collection=product_collection,
+                                    task_row=inputs["task_row"],
+                                    region_priority_dict=inputs["region_priority_dict"],
+                                    warehouse_priority_dict=inputs["warehouse_priority_dict"],
+                                    warehouses_available_to_stock_transfer=inputs["warehouses_available_to_stock_transfer"],
+                                    quota_dict=inputs["quota_dict"],
+                                    size_map=inputs["size_map"],
+                                    blocked_warehouses_for_skus=inputs["blocked_warehouses_for_skus"])
+    seconds = time.perf_counter() - start_time
+    return [(req["src_warehouse_id"], req["dst_warehouse_id"], req["req_body"]) for req in factory.all_request_bodies_to_send], seconds
+
+
+def change_stocks(inputs: Dict[str, Any], share: float, seed: int) -> Dict[str, Any]:
+    """
+    Как между почасовыми запусками: у доли артикулов меняется остаток одного SKU на одном складе.
+    """
+    rnd = random.Random(seed)
+    changed = dict(inputs, product_collection=copy.deepcopy(inputs["product_collection"]))
+    for product in changed["product_collection"].values():
+        if rnd.random() >= share:
+            continue
+        size = rnd.choice(list(product["sizes"].values()))
+        region = rnd.choice([region for region in size["regions"].values() if region["warehouses"]] or [None])
+        if region is None:
+            continue
+        wh_id = rnd.choice(list(region["warehouses"]))
+        delta = rnd.randint(1, 30)
+        region["warehouses"][wh_id] += delta
+        region["total_qty"] += delta
+        size["total_qty"] += delta
+        product["total_qty"] += delta
+    return changed
+
+
+def reduce_quotas(inputs: Dict[str, Any]) -> Dict[str, Any]:
+    # После отправки большие квоты уменьшаются на отправленное, нулевые остаются нулевыми
+    quota_dict = {wh_id: {"src": max(0, quota["src"] - 7) if quota["src"] > 1000 else quota["src"],
+                          "dst": max(0, quota["dst"] - 7) if quota["dst"] > 1000 else quota["dst"]}
+                  for wh_id, quota in inputs["quota_dict"].items()}
+    return dict(inputs, quota_dict=quota_dict)
+
+
+def run(args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    import services.regular_task_factory # noqa: F401 - до настройки уровня логгера модуля
+    from infrastructure.local_storage.plan_cache import PlanCache
+
+    inputs = build_inputs(args)
+    logger = logging.getLogger("benchmarks.plan_cache")
+    logger.setLevel(getattr(logging, args.log_level.upper(), logging.WARNING))
+    logging.getLogger("services.regular_task_factory").setLevel(logger.level)
+
+    scenarios = [("холодный кеш", inputs),
+                 ("без изменений", inputs),
+                 (f"изменено {args.changed_share:.0%}", change_stocks(inputs, args.changed_share, args.seed)),
+                 ("квоты -7 шт.", reduce_quotas(inputs))]
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        plan_cache = PlanCache(path=os.path.join(directory, "plan_cache.sqlite3"))
+        try:
+            for name, scenario_inputs in scenarios:
+                expected, full_seconds = plan(scenario_inputs, args.engine, None, logger)
+                stats_before = plan_cache.stats()
+                bodies, seconds = plan(scenario_inputs, args.engine, plan_cache, logger)
+                stats = plan_cache.stats()
+                results[name] = {"full_seconds": full_seconds, "seconds": seconds, "requests": len(bodies),
+                                 "hits": stats["hits"] - stats_before["hits"], "misses": stats["misses"] - stats_before["misses"],
+                                 "same": bodies == expected}
+        finally:
+            plan_cache.close()
+    return results
+
+
+def report(results: Dict[str, Dict[str, Any]], args: argparse.Namespace):
+    print(f"Артикулов: {args.articles}, размеров: {args.sizes}, движок: {args.engine}")
+    print(f"{'прогон':<16} {'без кеша, с':>12} {'с кешем, с':>11} {'из кеша':>8} {'пересчёт':>9} {'заявок':>7} {'совпадают':>10}")
+    for name, row in results.items():
+        print(f"{name:<16} {row['full_seconds']:>12.3f} {row['seconds']:>11.3f} {row['hits']:>8} {row['misses']:>9} "
+              f"{row['requests']:>7} {str(row['same']):>10}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.WARNING))
+    report(run(args), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Планирование регулярного задания в пуле процессов (товары шардами по nmId) на 1/2/4/8 воркерах против расчёта
+в одном процессе, на синтетическом каталоге из allocation_engine_benchmark. Проверяет детерминизм: при любом
+числе воркеров заявки совпадают с последовательным расчётом.
+
+Запуск:  python -m benchmarks.sharded_planning_benchmark --articles 20000 --workers 1 2 4 8
+"""
+import argparse
+import copy
+import logging
+import os
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+from benchmarks.allocation_engine_benchmark import build_inputs
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Планирование в пуле процессов на разном числе воркеров")
+    parser.add_argument("--articles", type=int, default=20000)
+    parser.add_argument("--sizes", type=int, default=4)
+    parser.add_argument("--warehouses", type=int, default=64)
+    parser.add_argument("--balanced-share", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--engine", choices=("python", "numpy"), default="numpy")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+def plan(inputs: Dict[str, Any], engine: str, workers: int, logger: logging.Logger):
+    from services.regular_task_factory import RegularTaskFactory
+
+    db_data_fetcher = SimpleNamespace(techsize_with_chrtid_dict=inputs["chrtids"], banned_warehouses_for_nmids={})
+    factory = RegularTaskFactory(db_controller=None, api_controller=None, db_data_fetcher=db_data_fetcher, cookie_jar=None,
+                                 headers={}, logger=logger, size_map=inputs["size_map"], cookie_list=[],
+                                 allocation_engine=engine, planning_workers=workers)
+    factory.create_task_for_product(product_collection=copy.deepcopy(inputs["product_collection"]),
+                                    task_row=inputs["task_row"],
+                                    region_priority_dict=inputs["region_priority_dict"],
+                                    warehouse_priority_dict=inputs["warehouse_priority_dict"],
+                                    warehouses_available_to_stock_transfer=inputs["warehouses_available_to_stock_transfer"],
+                                    quota_dict=inputs["quota_dict"],
+                                    size_map=inputs["size_map"],
+                                    blocked_warehouses_for_skus=inputs["blocked_warehouses_for_skus"])
+    return factory
+
+
+def as_tuples(request_bodies: List[Dict[str, Any]]) -> List[tuple]:
+    return [(req["src_warehouse_id"], req["dst_warehouse_id"], req["req_body"]) for req in request_bodies]
+
+
+def run(args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    import services.regular_task_factory # noqa: F401 - до настройки уровня логгера модуля
+
+    inputs = build_inputs(args)
+    logger = logging.getLogger("benchmarks.sharded_planning")
+    logger.setLevel(getattr(logging, args.log_level.upper(), logging.WARNING))
+    logging.getLogger("services.regular_task_factory").setLevel(logger.level)
+
+    def measure(workers: int):
+        timings, factory = [], None
+        for _ in range(args.repeats):
+            start_time = time.perf_counter()
+            factory = plan(inputs, args.engine, workers, logger)
+            timings.append(time.perf_counter() - start_time)
+        return factory, sorted(timings)[len(timings) // 2]
+
+    serial, serial_seconds = measure(0)
+    expected = as_tuples(serial.all_request_bodies_to_send)
+    results = {"в процессе": {"seconds": serial_seconds, "requests": len(expected), "same": None}}
+    for workers in args.workers:
+        factory, seconds = measure(workers)
+        bodies = as_tuples(factory.all_request_bodies_to_send)
+        results[f"{workers} проц."] = {"seconds": seconds, "requests": len(bodies), "same": bodies == expected}
+    return results
+
+
+def report(results: Dict[str, Dict[str, Any]], args: argparse.Namespace):
+    print(f"Артикулов: {args.articles}, размеров: {args.sizes}, движок: {args.engine}, CPU: {os.cpu_count()}")
+    print(f"{'режим':<12} {'всего, с':>9} {'ускорение':>10} {'заявок':>8} {'совпадают':>10}")
+    base = results["в процессе"]["seconds"]
+    for name, row in results.items():
+        same = "-" if row["same"] is None else str(row["same"])
+        print(f"{name:<12} {row['seconds']:>9.3f} {base / row['seconds']:>10.2f} {row['requests']:>8} {same:>10}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.WARNING))
+    report(run(args), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Сравнение чтения текущих остатков: прямые запросы к a_wb_stocks (MAX(time_end) + карта складов + перекладка
+warehouse_id в Python) против снимка a_wb_stock_transfer_current_stocks.
+
+Запуск:  python -m benchmarks.stock_snapshot_benchmark --repeats 5
+Доступы к MySQL берутся так же, как в dependencies (AccessDataLoader). Нужна применённая миграция
+infrastructure/db/mysql/migrations/001_current_stocks_snapshot.sql. Пересборка снимка (процедура миграции,
+раз на новую выгрузку остатков, вне прогона) замеряется отдельно; итоговые строки сравнивают стоимость прогона
+до и после, а также вариант с пересборкой внутри прогона.
+"""
+import argparse
+import logging
+import statistics
+import time
+from typing import Callable, Dict, List
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Остатки: a_wb_stocks против снимка текущих остатков")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--db", default="dostup")
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+def measure(func: Callable[[], object], repeats: int) -> Dict[str, float]:
+    timings: List[float] = []
+    rows = 0
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start_time)
+        rows = len(result) if hasattr(result, "__len__") else 0
+    return {"median": statistics.median(timings), "min": min(timings), "max": max(timings), "rows": rows}
+
+
+def build_controller(db_name: str):
+    from benchmarks.db_connection import connect_sync_database
+    from infrastructure.db.mysql.mysql_controller import MySQLController
+
+    return MySQLController(db=connect_sync_database(db_name))
+
+
+def run(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    controller = build_controller(args.db)
+    db = controller.db
+
+    def legacy_products():
+        warehouse_map = controller._build_warehouse_name_id_to_wb_office_id_map(
+            db.execute_query(controller._SQL_WAREHOUSE_NAME_ID_TO_WB_OFFICE_ID))
+        return controller._map_stock_warehouses_to_offices(db.execute_query_rows(controller._SQL_STOCKS_WITH_REGION), warehouse_map)
+
+    results = {"до: остатки с регионами (2 запроса + перекладка)": measure(legacy_products, args.repeats),
+               "до: артикул с макс. остатком": measure(lambda: db.execute_query(controller._SQL_MAX_STOCK_ARTICLE), args.repeats)}
+
+    results["вне прогона: пересборка снимка (процедура)"] = measure(
+        lambda: db.execute_non_query(controller._SQL_REFRESH_CURRENT_STOCKS, (1,)), args.repeats)
+    if not controller.current_stock_snapshot_available(recheck=True):
+        raise RuntimeError("Снимок остатков недоступен - см. предупреждение в логе")
+
+    results["после: проверка свежести снимка"] = measure(lambda: controller.current_stock_snapshot_available(recheck=True), args.repeats)
+    results["после: остатки с регионами (снимок)"] = measure(lambda: db.execute_query_rows(controller._SQL_CURRENT_STOCKS_WITH_REGION), args.repeats)
+    results["после: артикул с макс. остатком"] = measure(lambda: db.execute_query(controller._SQL_CURRENT_MAX_STOCK_ARTICLE), args.repeats)
+
+    def total(*names):
+        return {"median": sum(results[name]["median"] for name in names), "min": None, "max": None, "rows": None}
+
+    before = ("до: остатки с регионами (2 запроса + перекладка)", "до: артикул с макс. остатком")
+    after = ("после: проверка свежести снимка", "после: остатки с регионами (снимок)", "после: артикул с макс. остатком")
+    results["итого прогон: до"] = total(*before)
+    results["итого прогон: после"] = total(*after)
+    results["итого прогон: пересборка внутри прогона"] = total("вне прогона: пересборка снимка (процедура)", *after)
+
+    db.pool.close_all()
+    return results
+
+
+def report(results: Dict[str, Dict[str, float]]):
+    print(f"{'запрос':<52} {'медиана, с':>11} {'мин, с':>9} {'макс, с':>9} {'строк':>9}")
+    for name, row in results.items():
+        if row["rows"] is None:
+            print(f"{name:<52} {row['median']:>11.4f} {'-':>9} {'-':>9} {'-':>9}")
+            continue
+        print(f"{name:<52} {row['median']:>11.4f} {row['min']:>9.4f} {row['max']:>9.4f} {row['rows']:>9}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.WARNING))
+    report(run(args))
+
+
+if __name__ == "__main__":
+    main()
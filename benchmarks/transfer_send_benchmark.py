@@ -0,0 +1,239 @@
+"""
+Прогон конвейера трансфера против локального стенда ВБ: проверка cookies -> квоты -> дозапрос chrtID ->
+предзагрузка стоков разовых заданий -> отправка заявок -> отчёт о поставках (goods-return).
+
+Запуск:  python -m benchmarks.transfer_send_benchmark --orders 500 --identities 4 --throttle-rate 0.05
+Печатает заявок/сек, число принятых заявок и использование квот по данным стенда.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+from benchmarks.wb_stand_in_server import StandInThread, WBStandInServer, config_from_args
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон отправки заявок против стенда ВБ")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--identities", type=int, default=4)
+    parser.add_argument("--max-units-per-order", type=int, default=5)
+    parser.add_argument("--offices", type=int, default=60)
+    parser.add_argument("--quota", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--latency-jitter", type=float, default=0.02)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--server-error-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--per-identity-rps", type=float, default=None)
+    parser.add_argument("--nm-count", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+def point_services_to(base_url: str):
+    """
+    Адреса читаются в utils/config.py при импорте, поэтому переменные окружения
+    выставляются до импорта сервисов.
+    """
+    os.environ["WB_SELLER_WEEKLY_REPORT_URL"] = base_url
+    os.environ["WB_CONTENT_API_URL"] = base_url
+    os.environ["WB_SELLER_ANALYTICS_API_URL"] = base_url
+
+
+def build_requests(factory, server: WBStandInServer, office_id_list: List[int], order_count: int,
+                   max_units_per_order: int, rnd: random.Random) -> Dict[str, str]:
+    from models.tasks import ProductSizeInfo, ProductToTask
+
+    size_map = {str(size_idx): size for size_idx, size in enumerate(server.config.sizes)}
+    for _ in range(order_count):
+        nm_id = rnd.choice(server.nm_ids)
+        src_id, dst_id = rnd.sample(office_id_list, 2)
+        size_idx = rnd.randrange(len(server.config.sizes))
+        size_id = str(size_idx)
+        qty = rnd.randint(1, max_units_per_order)
+
+        product = ProductToTask(product_wb_id=nm_id,
+                                sizes=[ProductSizeInfo(size_id=size_id,
+                                                       tech_size_id=size_idx,
+                                                       transfer_qty=qty,
+                                                       transfer_qty_left_virtual=qty,
+                                                       transfer_qty_left_real=qty)])
+        warehouse_entries = {size_id: {"chrtID": server.chrt_id(nm_id, size_idx), "count": qty}}
+        req_body = factory.create_transfer_request_body(src_warehouse_id=src_id,
+                                                        dst_wrh_id=dst_id,
+                                                        product=product,
+                                                        warehouse_entries=warehouse_entries)
+        factory.all_request_bodies_to_send.append({"src_warehouse_id": src_id,
+                                                   "dst_warehouse_id": dst_id,
+                                                   "product": product,
+                                                   "req_body": req_body,
+                                                   "warehouse_entries": warehouse_entries})
+    return size_map
+
+
+def build_one_time_tasks(server: WBStandInServer) -> Dict[int, Any]:
+    """
+    Разовые задания по всему каталогу стенда - для prefetch_stocks нужны только nmID товаров.
+    """
+    from models.tasks import ProductToTask
+
+    products = [ProductToTask(product_wb_id=nm_id, sizes=[]) for nm_id in server.nm_ids]
+    return {task_id: SimpleNamespace(products=products[task_id::4]) for task_id in range(4)}
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    server = WBStandInServer(config_from_args(args))
+
+    with StandInThread(server, host=args.host, port=args.port) as stand_in:
+        point_services_to(stand_in.base_url)
+
+        import utils.logger
+        utils.logger.LOG_LEVEL = args.log_level.upper()
+
+        from infrastructure.api.rate_limiter import RateLimiter
+        from infrastructure.api.sync_controller import SyncAPIController
+        from services.chrtid_resolver import ChrtIdResolver
+        from services.delivered_supply_process import DeliveredSupplyProcessor
+        from services.regular_task_factory import RegularTaskFactory
+        from services.warehouse_processor import OneTimeTaskProcessor
+        from services.wb_api_data_fetcher import WBAPIDataFetcher
+        from utils.config import chrtid_resolver_settings, default_headers, http_pool_connections, http_pool_maxsize, rate_limits
+
+        logger = utils.logger.get_logger("transfer_send_benchmark")
+        logger.setLevel(getattr(logging, args.log_level.upper(), logging.WARNING))
+
+        api_controller = SyncAPIController(pool_connections=http_pool_connections, pool_maxsize=http_pool_maxsize)
+        rate_limiter = RateLimiter(endpoint_limits=rate_limits)
+        cookie_list = [{"name": f"bench_{i}", "cookies": {}, "tokenV3": f"bench-token-{i}"}
+                       for i in range(args.identities)]
+        headers = default_headers.copy()
+
+        fetcher = WBAPIDataFetcher(api_controller=api_controller,
+                                   mysql_controller=None,
+                                   cookie_list=cookie_list,
+                                   wb_content_api_key=None,
+                                   headers=headers,
+                                   logger=logger,
+                                   rate_limiter=rate_limiter)
+
+        timings = {}
+        start_time = time.perf_counter()
+        check_result = fetcher.check_cookie_list(cookie_list_original=cookie_list, random_present_nmid=server.nm_ids[0])
+        timings["check_cookie_list"] = time.perf_counter() - start_time
+
+        office_id_list = check_result["office_id_list"]
+        start_time = time.perf_counter()
+        quota_dict = asyncio.run(fetcher.fetch_quota(office_id_list=office_id_list))
+        timings["fetch_quota"] = time.perf_counter() - start_time
+        known_quota_offices = [office_id for office_id in office_id_list
+                               if quota_dict[office_id]["src"] >= 0 and quota_dict[office_id]["dst"] >= 0] # -1 - квоту получить не удалось
+
+        resolver = ChrtIdResolver(api_controller=api_controller, wb_content_api_key={"API key": "bench-key"},
+                                  rate_limiter=rate_limiter, **chrtid_resolver_settings)
+        chrtid_dict = {}
+        start_time = time.perf_counter()
+        chrtids_resolved = resolver.resolve_missing({nm_id: set(server.config.sizes) for nm_id in server.nm_ids}, chrtid_dict)
+        timings["resolve_chrtids"] = time.perf_counter() - start_time
+
+        one_time_task_processor = OneTimeTaskProcessor(api_controller=api_controller,
+                                                       db_controller=None,
+                                                       db_data_fetcher=None,
+                                                       cookie_jar=None,
+                                                       headers=headers,
+                                                       logger=logger,
+                                                       cookie_list=check_result["cookies"],
+                                                       rate_limiter=rate_limiter)
+        start_time = time.perf_counter()
+        stocks_prefetched = one_time_task_processor.prefetch_stocks(build_one_time_tasks(server))
+        stocks_served = sum(1 for nm_id in server.nm_ids
+                            if one_time_task_processor.fetch_stocks_by_nmid(nm_id, office_id_list) is not None)
+        timings["prefetch_stocks"] = time.perf_counter() - start_time
+
+        factory = RegularTaskFactory(db_controller=None,
+                                     api_controller=api_controller,
+                                     db_data_fetcher=None,
+                                     cookie_jar=None,
+                                     headers=headers,
+                                     logger=logger,
+                                     size_map={},
+                                     cookie_list=check_result["cookies"],
+                                     rate_limiter=rate_limiter)
+        size_map = build_requests(factory, server, office_id_list, args.orders, args.max_units_per_order, random.Random(args.seed))
+        units_requested = sum(entry["warehouse_entries"][size_id]["count"]
+                              for entry in factory.all_request_bodies_to_send
+                              for size_id in entry["warehouse_entries"])
+
+        start_time = time.perf_counter()
+        factory.send_all_requests(quota_dict=quota_dict, size_map=size_map)
+        timings["send_all_requests"] = time.perf_counter() - start_time
+
+        supply_processor = DeliveredSupplyProcessor(db_controller=None,
+                                                    api_controller=api_controller,
+                                                    wb_analytics_api_key={"API key": "bench-key"},
+                                                    logger=logger,
+                                                    size_map=size_map)
+        start_time = time.perf_counter()
+        supply_data = supply_processor.fetch_wb_supply_data()
+        supply_entries = len(supply_processor.remove_unwanted_entries(supply_data)) if supply_data else 0
+        timings["fetch_supply"] = time.perf_counter() - start_time
+
+        server_stats = server.stats()
+        api_controller.close()
+
+    order_statuses = server_stats["requests"].get("POST /ns/shifts/analytics-back/api/v1/order", {})
+    stock_requests = sum(server_stats["requests"].get("GET /ns/shifts/analytics-back/api/v1/stocks", {}).values())
+    accepted = server_stats["accepted_orders"]
+    dst_consumed = sum(modes["dst"] for modes in server_stats["quota_consumed"].values())
+    dst_available = args.quota * len(office_id_list)
+
+    return {"identities": args.identities,
+            "orders": args.orders,
+            "accepted_orders": accepted,
+            "order_attempts": sum(order_statuses.values()),
+            "order_statuses": order_statuses,
+            "orders_per_sec": accepted / timings["send_all_requests"] if timings["send_all_requests"] else 0.0,
+            "units_requested": units_requested,
+            "units_moved": server_stats["units_moved"],
+            "dst_quota_utilisation": dst_consumed / dst_available if dst_available else 0.0,
+            "quota_consistent": all(quota_dict[office_id]["dst"] == args.quota - server_stats["quota_consumed"][office_id]["dst"]
+                                    for office_id in known_quota_offices),
+            "quota_fetch_failed": len(office_id_list) - len(known_quota_offices),
+            "nm_count": len(server.nm_ids),
+            "chrtids_resolved": chrtids_resolved,
+            "stocks_prefetched": stocks_prefetched,
+            "stocks_served": stocks_served,
+            "stock_requests": stock_requests,
+            "supply_entries": supply_entries,
+            "timings": timings}
+
+
+def print_report(result: Dict[str, Any]):
+    print(f"Учёток: {result['identities']}, заявок: {result['orders']}")
+    print(f"  check_cookie_list: {result['timings']['check_cookie_list']:.2f} сек")
+    print(f"  fetch_quota:       {result['timings']['fetch_quota']:.2f} сек (не получено квот по складам: {result['quota_fetch_failed']})")
+    print(f"  resolve_chrtids:   {result['timings']['resolve_chrtids']:.2f} сек (chrtID получено: {result['chrtids_resolved']})")
+    print(f"  prefetch_stocks:   {result['timings']['prefetch_stocks']:.2f} сек (nmID загружено: {result['stocks_prefetched']} из {result['nm_count']}, "
+          f"отдано из кеша: {result['stocks_served']}, GET /stocks: {result['stock_requests']})")
+    print(f"  send_all_requests: {result['timings']['send_all_requests']:.2f} сек")
+    print(f"  fetch_supply:      {result['timings']['fetch_supply']:.2f} сек (записей о перемещениях: {result['supply_entries']})")
+    print(f"  принято заявок:    {result['accepted_orders']} из {result['orders']} (попыток: {result['order_attempts']}, статусы: {result['order_statuses']})")
+    print(f"  заявок/сек:        {result['orders_per_sec']:.1f}")
+    print(f"  единиц перемещено: {result['units_moved']} из {result['units_requested']}")
+    print(f"  использование dst-квот: {result['dst_quota_utilisation']:.1%}")
+    print(f"  локальные квоты совпадают со стендом: {result['quota_consistent']}")
+
+
+def main(argv=None):
+    print_report(run_benchmark(parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Строки-словари (DictCursor) против TupleRows (кортежи + карта колонок) на тяжёлых выборках регулярного задания:
+память под результат и время сборки коллекции товаров (prepare_indices + create_product_collection_with_regions).
+
+Запуск:  python -m benchmarks.tuple_rows_benchmark --stock-rows 300000 --sales-rows 400000
+         python -m benchmarks.tuple_rows_benchmark --from-db --db dostup   (реальные запросы контроллера)
+По умолчанию строки синтетические: словари собираются так же, как в DictCursor (dict(zip(колонки, строка))).
+"""
+import argparse
+import logging
+import random
+import time
+import tracemalloc
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Tuple
+
+STOCK_COLUMNS = ("stock_id", "wb_article_id", "warehouse_id", "size_id", "time_end", "qty", "size", "region_id")
+SALES_COLUMNS = ("nmId", "techSize_id", "office_id", "order_count")
+CHRTID_COLUMNS = ("nmId", "techsize", "chrt_id")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="DictCursor против TupleRows")
+    parser.add_argument("--stock-rows", type=int, default=300000)
+    parser.add_argument("--sales-rows", type=int, default=400000)
+    parser.add_argument("--chrtid-rows", type=int, default=500000)
+    parser.add_argument("--regions", type=int, default=8)
+    parser.add_argument("--warehouses", type=int, default=60)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--from-db", action="store_true", help="Сравнить выборки реальных запросов контроллера")
+    parser.add_argument("--db", default="dostup")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+def synthetic_rows(args: argparse.Namespace) -> Dict[str, Tuple[Tuple[str, ...], List[list]]]:
+    from datetime import datetime
+
+    rnd = random.Random(args.seed)
+    now = datetime.now().replace(microsecond=0)
+    sizes = ["42", "44", "46", "48", "50", "52", "S", "M", "L", "XL"]
+    article_count = max(1, args.stock_rows // 20)
+    # Строки - списки: и словарь, и кортеж в замере собираются заново, как при разборе ответа сервера
+    stock = [[row_number, 100000 + rnd.randrange(article_count), rnd.randrange(args.warehouses), rnd.randrange(len(sizes)),
+              now, rnd.randint(0, 300), sizes[rnd.randrange(len(sizes))], 1 + rnd.randrange(args.regions)]
+             for row_number in range(args.stock_rows)]
+    sales = [[100000 + rnd.randrange(article_count), rnd.randrange(len(sizes)), rnd.randrange(args.warehouses), rnd.randint(1, 50)]
+             for _ in range(args.sales_rows)]
+    chrtid = [[100000 + row_number // len(sizes), sizes[row_number % len(sizes)], 500000000 + row_number]
+              for row_number in range(args.chrtid_rows)]
+    return {"stock": (STOCK_COLUMNS, stock), "sales": (SALES_COLUMNS, sales), "chrtid": (CHRTID_COLUMNS, chrtid)}
+
+
+def as_dict_rows(columns: Tuple[str, ...], rows: List[list]) -> List[Dict[str, Any]]:
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def as_tuple_rows(columns: Tuple[str, ...], rows: List[list]):
+    from infrastructure.db.mysql.rows import TupleRows
+
+    return TupleRows(columns, [tuple(row) for row in rows])
+
+
+def measure_memory(build: Callable[[], Any]) -> Tuple[Any, int]:
+    tracemalloc.start()
+    try:
+        result = build()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, current
+
+
+def measure_time(func: Callable[[], Any], repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start_time)
+    return sorted(timings)[len(timings) // 2]
+
+
+def build_factory(regions: int, warehouses: int):
+    from services.regular_task_factory import RegularTaskFactory
+
+    # Коллекция товаров строится только по входным строкам и справочнику регионов - остальное не нужно
+    factory = object.__new__(RegularTaskFactory)
+    factory.logger = logging.getLogger("benchmarks.tuple_rows")
+    region_offices = {region_id: [wh for wh in range(warehouses) if wh % regions == region_id - 1]
+                      for region_id in range(1, regions + 1)}
+    factory.db_data_fetcher = SimpleNamespace(all_wb_regions_with_office_list_dict=region_offices)
+    return factory, region_offices
+
+
+def run_synthetic(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    from infrastructure.db.mysql.mysql_controller import MySQLController
+
+    data = synthetic_rows(args)
+    factory, region_offices = build_factory(args.regions, args.warehouses)
+    sort_order = {region_id: region_id for region_id in region_offices}
+    results = {}
+
+    for mode, convert in (("DictCursor", as_dict_rows), ("TupleRows", as_tuple_rows)):
+        converted, memory = {}, 0
+        for name, (columns, rows) in data.items():
+            converted[name], size = measure_memory(lambda: convert(columns, rows))
+            memory += size
+
+        def build_collection():
+            indices = factory.prepare_indices(sales_data=converted["sales"], stock_availability_data=[],
+                                              stock_availability_index={})
+            return factory.create_product_collection_with_regions(all_product_entries=converted["stock"],
+                                                                  warehouses_available_to_stock_transfer=region_offices,
+                                                                  region_src_sort_order=sort_order,
+                                                                  availability_index={},
+                                                                  orders_index=indices["orders_index"])
+
+        results[mode] = {"memory_mb": memory / 1024 / 1024,
+                         "collection_seconds": measure_time(build_collection, args.repeats),
+                         "chrtid_seconds": measure_time(lambda: MySQLController._build_techsizes_with_chrtid(converted["chrtid"]), args.repeats),
+                         "products": len(build_collection())}
+    return results
+
+
+def run_from_db(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    from benchmarks.db_connection import connect_sync_database
+    from infrastructure.db.mysql.mysql_controller import MySQLController
+
+    db = connect_sync_database(args.db)
+    queries = {"остатки": MySQLController._SQL_STOCKS_WITH_REGION,
+               "продажи": MySQLController._SQL_SIZE_SALES_FOR_WAREHOUSE,
+               "chrtID": MySQLController._SQL_TECHSIZES_WITH_CHRTID}
+    results = {}
+    try:
+        for name, sql in queries.items():
+            for mode, fetch in (("DictCursor", db.execute_query), ("TupleRows", db.execute_query_rows)):
+                rows, memory = measure_memory(lambda: fetch(sql))
+                results[f"{name}, {mode}"] = {"memory_mb": memory / 1024 / 1024,
+                                              "fetch_seconds": measure_time(lambda: fetch(sql), args.repeats),
+                                              "rows": len(rows)}
+                del rows
+    finally:
+        db.pool.close_all()
+    return results
+
+
+def run(args: argparse.Namespace) -> Dict[str, Dict[str, float]]:
+    return run_from_db(args) if args.from_db else run_synthetic(args)
+
+
+def report(results: Dict[str, Dict[str, float]], args: argparse.Namespace):
+    if args.from_db:
+        print(f"{'выборка':<24} {'память, МБ':>11} {'выборка, с':>11} {'строк':>9}")
+        for name, row in results.items():
+            print(f"{name:<24} {row['memory_mb']:>11.1f} {row['fetch_seconds']:>11.3f} {row['rows']:>9}")
+        return
+
+    print(f"Строк: остатки {args.stock_rows}, продажи {args.sales_rows}, chrtID {args.chrtid_rows}")
+    print(f"{'режим':<12} {'память, МБ':>11} {'коллекция, с':>13} {'chrtID, с':>10} {'товаров':>8}")
+    for name, row in results.items():
+        print(f"{name:<12} {row['memory_mb']:>11.1f} {row['collection_seconds']:>13.3f} "
+              f"{row['chrtid_seconds']:>10.3f} {row['products']:>8}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level.upper(), logging.WARNING))
+    report(run(args), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+"""
+Локальный стенд эндпоинтов ВБ для нагрузочных прогонов без боевых cookies.
+
+Запуск:  python -m benchmarks.wb_stand_in_server --port 8081 --latency 0.05 --throttle-rate 0.05
+Сервисы направляются на стенд переменными окружения WB_SELLER_WEEKLY_REPORT_URL,
+WB_CONTENT_API_URL и WB_SELLER_ANALYTICS_API_URL (см. utils/config.py).
+"""
+import argparse
+import asyncio
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+
+QUOTA_PATH = "/ns/shifts/analytics-back/api/v1/quota"
+STOCKS_PATH = "/ns/shifts/analytics-back/api/v1/stocks"
+ORDER_PATH = "/ns/shifts/analytics-back/api/v1/order"
+GOODS_RETURN_PATH = "/api/v1/analytics/goods-return"
+CARDS_LIST_PATH = "/content/v2/get/cards/list"
+
+
+@dataclass
+class StandInConfig:
+    office_ids: List[int] = field(default_factory=lambda: [100 + i for i in range(60)])
+    initial_quota: int = 5000 # Квота src и dst на каждом складе
+    latency: float = 0.05 # Средняя задержка ответа, секунды
+    latency_jitter: float = 0.02
+    throttle_rate: float = 0.0 # Доля ответов 429
+    server_error_rate: float = 0.0 # Доля ответов 5xx
+    retry_after: Optional[float] = 1.0 # Значение Retry-After для 429 (None - без заголовка)
+    per_identity_rps: Optional[float] = None # Лимит запросов в секунду на учётку, сверх него - 429
+    nm_count: int = 200 # Размер каталога
+    sizes: List[str] = field(default_factory=lambda: ["S", "M", "L", "XL"])
+    max_stock_per_size: int = 50
+    seed: int = 42
+
+
+class WBStandInServer:
+    def __init__(self, config: Optional[StandInConfig] = None):
+        self.config = config or StandInConfig()
+        self._random = random.Random(self.config.seed)
+        self.nm_ids = [100000 + i for i in range(self.config.nm_count)]
+        self.quota = {office_id: {"src": self.config.initial_quota, "dst": self.config.initial_quota}
+                      for office_id in self.config.office_ids}
+        self.stocks = self._build_stocks()
+        self.accepted_orders: List[Dict[str, Any]] = []
+        self.request_stats: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+        self._identity_requests: Dict[str, deque] = defaultdict(deque)
+        self._runner: Optional[web.AppRunner] = None
+
+    @staticmethod
+    def chrt_id(nm_id: int, size_idx: int) -> int:
+        return nm_id * 10 + size_idx
+
+    def _build_stocks(self) -> Dict[int, Dict[int, List[Dict[str, Any]]]]:
+        stocks = {}
+        for nm_id in self.nm_ids:
+            stocks[nm_id] = {}
+            for office_id in self.config.office_ids:
+                in_stock = [{"techSize": size,
+                             "chrtID": self.chrt_id(nm_id, size_idx),
+                             "count": self._random.randint(0, self.config.max_stock_per_size)}
+                            for size_idx, size in enumerate(self.config.sizes)]
+                stocks[nm_id][office_id] = in_stock
+        return stocks
+
+    def build_app(self) -> web.Application:
+        app = web.Application(middlewares=[self._fault_middleware])
+        app.router.add_route("OPTIONS", QUOTA_PATH, self.handle_options)
+        app.router.add_get(QUOTA_PATH, self.handle_quota)
+        app.router.add_route("OPTIONS", STOCKS_PATH, self.handle_options)
+        app.router.add_get(STOCKS_PATH, self.handle_stocks)
+        app.router.add_route("OPTIONS", ORDER_PATH, self.handle_options)
+        app.router.add_post(ORDER_PATH, self.handle_order)
+        app.router.add_get(GOODS_RETURN_PATH, self.handle_goods_return)
+        app.router.add_post(CARDS_LIST_PATH, self.handle_cards_list)
+        app.router.add_get("/__stats", self.handle_stats)
+        return app
+
+    @web.middleware
+    async def _fault_middleware(self, request: web.Request, handler):
+        if request.path == "/__stats":
+            return await handler(request)
+
+        delay = max(0.0, self._random.gauss(self.config.latency, self.config.latency_jitter))
+        await asyncio.sleep(delay)
+
+        identity = request.headers.get("AuthorizeV3") or request.headers.get("Authorization") or "anonymous"
+        if self._is_over_identity_limit(identity) or self._random.random() < self.config.throttle_rate:
+            response = self._throttled_response()
+        elif self._random.random() < self.config.server_error_rate:
+            response = web.json_response({"error": "injected server error"}, status=self._random.choice([500, 502, 503, 504]))
+        else:
+            response = await handler(request)
+
+        self.request_stats[f"{request.method} {request.path}"][response.status] += 1
+        return response
+
+    def _is_over_identity_limit(self, identity: str) -> bool:
+        if not self.config.per_identity_rps:
+            return False
+        now = time.monotonic()
+        window = self._identity_requests[identity]
+        while window and now - window[0] > 1.0:
+            window.popleft()
+        if len(window) >= self.config.per_identity_rps:
+            return True
+        window.append(now)
+        return False
+
+    def _throttled_response(self) -> web.Response:
+        headers = {}
+        if self.config.retry_after is not None:
+            headers["Retry-After"] = str(self.config.retry_after)
+        return web.json_response({"error": "too many requests"}, status=429, headers=headers)
+
+    async def handle_options(self, request: web.Request) -> web.Response:
+        return web.Response(status=204, headers={"Access-Control-Max-Age": "600"})
+
+    async def handle_quota(self, request: web.Request) -> web.Response:
+        try:
+            office_id = int(request.query["officeID"])
+            mode = request.query["type"]
+        except (KeyError, ValueError):
+            return web.json_response({"error": "bad params"}, status=400)
+        quota = self.quota.get(office_id, {}).get(mode, 0)
+        return web.json_response({"data": {"quota": quota}})
+
+    async def handle_stocks(self, request: web.Request) -> web.Response:
+        try:
+            nm_id = int(request.query["nmID"])
+        except (KeyError, ValueError):
+            return web.json_response({"error": "bad params"}, status=400)
+        nm_stocks = self.stocks.get(nm_id, {})
+        src = [{"officeID": office_id, "inStock": in_stock} for office_id, in_stock in nm_stocks.items()]
+        dst = [{"officeID": office_id} for office_id in self.config.office_ids]
+        return web.json_response({"data": {"src": src, "dst": dst}})
+
+    async def handle_order(self, request: web.Request) -> web.Response:
+        try:
+            order = (await request.json())["order"]
+            src, dst = int(order["src"]), int(order["dst"])
+            qty = sum(int(entry["count"]) for entry in order["count"])
+        except (KeyError, ValueError, TypeError):
+            return web.json_response({"error": "bad body"}, status=400)
+
+        if src not in self.quota or dst not in self.quota:
+            return web.json_response({"error": "unknown office"}, status=400)
+        if self.quota[src]["src"] < qty or self.quota[dst]["dst"] < qty:
+            return web.json_response({"error": "quota exceeded"}, status=400)
+
+        self.quota[src]["src"] -= qty
+        self.quota[dst]["dst"] -= qty
+        self.accepted_orders.append({"nmID": order.get("nmID"), "src": src, "dst": dst,
+                                     "count": order["count"], "qty": qty,
+                                     "created_at": datetime.now().strftime("%Y-%m-%d")})
+        return web.json_response({"data": {"id": len(self.accepted_orders)}})
+
+    async def handle_goods_return(self, request: web.Request) -> web.Response:
+        chrt_to_size = {self.chrt_id(nm_id, size_idx): size
+                        for nm_id in self.nm_ids for size_idx, size in enumerate(self.config.sizes)}
+        report = []
+        for order in self.accepted_orders:
+            for entry in order["count"]:
+                for _ in range(int(entry["count"])):
+                    report.append({"nmId": order["nmID"],
+                                   "techSize": chrt_to_size.get(entry["chrtID"]),
+                                   "orderDt": order["created_at"],
+                                   "dstOfficeId": order["dst"],
+                                   "dstOfficeAddress": f"Склад {order['dst']}",
+                                   "status": "Готово",
+                                   "returnType": "Перемещение остатков"})
+        return web.json_response({"report": report})
+
+    async def handle_cards_list(self, request: web.Request) -> web.Response:
+        try:
+            settings = (await request.json())["settings"]
+        except (KeyError, ValueError, TypeError):
+            return web.json_response({"error": "bad body"}, status=400)
+
+        nm_filter = settings.get("filter", {}).get("nmID")
+        text_search = settings.get("filter", {}).get("textSearch")
+        cursor = settings.get("cursor", {})
+        limit = int(cursor.get("limit", 100))
+        after_nm_id = cursor.get("nmID")
+
+        if nm_filter is not None or text_search:
+            wanted = int(nm_filter if nm_filter is not None else text_search)
+            nm_ids = [wanted] if wanted in self.stocks else []
+        else:
+            nm_ids = [nm_id for nm_id in self.nm_ids if after_nm_id is None or nm_id > int(after_nm_id)][:limit]
+
+        cards = [{"nmID": nm_id,
+                  "sizes": [{"techSize": size, "chrtID": self.chrt_id(nm_id, size_idx)}
+                            for size_idx, size in enumerate(self.config.sizes)]}
+                 for nm_id in nm_ids]
+        response_cursor = {"total": len(cards), "nmID": cards[-1]["nmID"] if cards else None}
+        return web.json_response({"cards": cards, "cursor": response_cursor})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    def stats(self) -> Dict[str, Any]:
+        consumed = {office_id: {mode: self.config.initial_quota - left for mode, left in modes.items()}
+                    for office_id, modes in self.quota.items()}
+        return {"requests": {endpoint: dict(statuses) for endpoint, statuses in self.request_stats.items()},
+                "accepted_orders": len(self.accepted_orders),
+                "units_moved": sum(order["qty"] for order in self.accepted_orders),
+                "quota_consumed": consumed}
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081):
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class StandInThread:
+    """
+    Запускает стенд в отдельном потоке со своим event loop - для синхронных драйверов нагрузки.
+    """
+
+    def __init__(self, server: WBStandInServer, host: str = "127.0.0.1", port: int = 8081):
+        self.server = server
+        self.host = host
+        self.port = port
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="wb_stand_in", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def __enter__(self) -> "StandInThread":
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.server.start(self.host, self.port), self._loop).result()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        asyncio.run_coroutine_threadsafe(self.server.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Локальный стенд эндпоинтов ВБ")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--offices", type=int, default=60)
+    parser.add_argument("--quota", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--latency-jitter", type=float, default=0.02)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--server-error-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--per-identity-rps", type=float, default=None)
+    parser.add_argument("--nm-count", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
+
+def config_from_args(args: argparse.Namespace) -> StandInConfig:
+    return StandInConfig(office_ids=[100 + i for i in range(args.offices)],
+                         initial_quota=args.quota,
+                         latency=args.latency,
+                         latency_jitter=args.latency_jitter,
+                         throttle_rate=args.throttle_rate,
+                         server_error_rate=args.server_error_rate,
+                         retry_after=args.retry_after,
+                         per_identity_rps=args.per_identity_rps,
+                         nm_count=args.nm_count,
+                         seed=args.seed)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = WBStandInServer(config_from_args(args))
+    web.run_app(server.build_app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,22 @@
-from utils.config import cookies_decrypt_key, default_headers, cookie_access_name_array
+from utils.config import cookies_decrypt_key, default_headers, cookie_access_name_array, http_pool_connections, http_pool_maxsize, rate_limits, mysql_pool_settings, async_mysql_pool_settings, mysql_instrumentation_settings, reference_cache_path, reference_cache_settings
 from utils.cookies_parser import CookieDecryptor
 from infrastructure.api.sync_controller import SyncAPIController
+from infrastructure.api.rate_limiter import RateLimiter
 from utils.logger import get_logger
 from utils.access_data_loader import AccessDataLoader
-from infrastructure.db.mysql.base import SyncDatabase
+from infrastructure.db.mysql.base import SyncDatabase, AsyncDatabase
+from infrastructure.db.mysql.instrumentation import QueryInstrumentation
 from infrastructure.db.mysql.mysql_controller import MySQLController
+from infrastructure.local_storage.reference_cache import ReferenceDataCache
 from functools import cached_property
 
 class Dependencies:
     def __init__(self):
         self._logger = get_logger("stock_transfer")
         self.cookie_utils = CookieDecryptor(key_base64=cookies_decrypt_key)
-        self.api_controller = SyncAPIController()
+        self.api_controller = SyncAPIController(pool_connections=http_pool_connections,
+                                                pool_maxsize=http_pool_maxsize)
+        self.rate_limiter = RateLimiter(endpoint_limits=rate_limits) # Общий для отправки заявок и получения квот
         self.access_data_loader = AccessDataLoader(logger=self.logger)
         self._mysql_controller = None
         self._cookie_jar = None
@@ -30,12 +35,25 @@ class Dependencies:
         if self._mysql_controller is None:
             mysql_connect_params_dict = self.access_data_loader.get_mysql_connect_params_dict()
             con_data = mysql_connect_params_dict['no_db_fixed']
+            instrumentation = QueryInstrumentation(logger=self.logger, **mysql_instrumentation_settings) # Общая для обоих пулов
             db = SyncDatabase(host=con_data['host'],
                                 port=con_data['port'],
                                 user=con_data['user'],
                                 password=con_data['password'],
-                                db='dostup')
-            self._mysql_controller = MySQLController(db=db)
+                                db='dostup',
+                                instrumentation=instrumentation,
+                                **mysql_pool_settings)
+            async_db = AsyncDatabase(host=con_data['host'],
+                                     port=con_data['port'],
+                                     user=con_data['user'],
+                                     password=con_data['password'],
+                                     db='dostup',
+                                     instrumentation=instrumentation,
+                                     **async_mysql_pool_settings)
+            reference_cache = None
+            if reference_cache_settings['enabled']:
+                reference_cache = ReferenceDataCache(path=reference_cache_path, max_age_hours=reference_cache_settings['max_age_hours'])
+            self._mysql_controller = MySQLController(db=db, async_db=async_db, reference_cache=reference_cache)
         return self._mysql_controller
 
     @cached_property
@@ -80,20 +98,10 @@ class Dependencies:
                     headers_copy['AuthorizeV3'] = tokenV3
                     self._authorized_headers = headers_copy
 
-                cookies_data = {'cookies': cookie_parsed_data, 'tokenV3': tokenV3}
+                cookies_data = {'name': name, 'cookies': cookie_parsed_data, 'tokenV3': tokenV3}
+                self.api_controller.register_cookie_identity(cookies_data, default_headers) # Cookies и токен привязываются к сессии учётки один раз
                 cookie_list.append(cookies_data)
                 
             except Exception as e:
                 self.logger.exception(f"Ошибка при получение cookies по имени {name}: {e}")
         return cookie_list
-
-
-deps = Dependencies()
-
-logger = deps.logger
-cookie_jar = deps.cookie_jar
-authorized_headers = deps.authorized_headers
-mysql_controller = deps.mysql_controller
-api_controller = SyncAPIController()
-wb_analytics_api_key = deps.wb_analytics_api_key
-cookie_list = deps.cookie_list
\ No newline at end of file
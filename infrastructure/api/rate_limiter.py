@@ -0,0 +1,188 @@
+import asyncio
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from utils.logger import get_logger
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Разбирает заголовок Retry-After: число секунд или HTTP-дата. Возвращает секунды ожидания.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class TokenBucket:
+    """
+    Токен-бакет с AIMD-подстройкой скорости:
+    после success_threshold успешных ответов подряд скорость растёт на increase_step,
+    на 429/5xx скорость умножается на decrease_factor и бакет замирает на throttle_cooldown (или Retry-After).
+    """
+
+    def __init__(self,
+                 rate: float,
+                 capacity: float = 1.0,
+                 min_rate: float = 0.1,
+                 max_rate: float = 20.0,
+                 increase_step: float = 0.5,
+                 decrease_factor: float = 0.5,
+                 success_threshold: int = 10,
+                 throttle_cooldown: float = 5.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.success_threshold = success_threshold
+        self.throttle_cooldown = throttle_cooldown
+
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._success_streak = 0
+        self._lock = threading.Lock()
+
+        self.acquired_count = 0
+        self.throttled_count = 0
+        self.total_wait = 0.0
+
+    def reserve(self) -> float:
+        """
+        Забирает токен и возвращает, сколько секунд нужно подождать перед запросом.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate)
+            self._last_refill = now
+            self._tokens -= 1
+            wait = 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+            wait = max(wait, self._blocked_until - now)
+            self.acquired_count += 1
+            self.total_wait += wait
+            return wait
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self._success_streak += 1
+            if self._success_streak >= self.success_threshold:
+                self.rate = min(self.max_rate, self.rate + self.increase_step)
+                self._success_streak = 0
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        with self._lock:
+            self._success_streak = 0
+            self.throttled_count += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            pause = retry_after if retry_after is not None else self.throttle_cooldown
+            self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+            # Сгоревшие токены: после паузы бакет стартует пустым
+            self._tokens = min(self._tokens, 0.0)
+
+    def on_error(self):
+        with self._lock:
+            self._success_streak = 0
+
+    def rescale(self, factor: float):
+        """
+        Масштабирует текущую и максимальную скорость (вес учётки), не опускаясь ниже min_rate.
+        """
+        with self._lock:
+            self.max_rate = max(self.min_rate, self.max_rate * factor)
+            self.rate = min(self.max_rate, max(self.min_rate, self.rate * factor))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"rate": round(self.rate, 3),
+                    "acquired": self.acquired_count,
+                    "throttled": self.throttled_count,
+                    "total_wait": round(self.total_wait, 3)}
+
+
+class RateLimiter:
+    """
+    Набор токен-бакетов по ключу (cookie-учётка, эндпоинт).
+    Общий для синхронной отправки заявок и асинхронного получения квот.
+    Вес учётки (0..1, по результатам проверки cookies) масштабирует скорость всех её бакетов.
+    """
+    THROTTLE_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, endpoint_limits: Dict[str, Dict[str, Any]], default_limits: Optional[Dict[str, Any]] = None):
+        self.endpoint_limits = endpoint_limits
+        self.default_limits = default_limits or {"rate": 1.0}
+        self.logger = get_logger("RateLimiter")
+        self._buckets: Dict[Tuple[Hashable, str], TokenBucket] = {}
+        self._weights: Dict[Hashable, float] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, identity: Hashable, endpoint: str) -> TokenBucket:
+        key = (identity, endpoint)
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            return bucket
+
+        with self._lock:
+            if key not in self._buckets:
+                limits = self.endpoint_limits.get(endpoint, self.default_limits)
+                bucket = TokenBucket(**limits)
+                weight = self._weights.get(identity, 1.0)
+                if weight != 1.0:
+                    bucket.rescale(weight)
+                self._buckets[key] = bucket
+            return self._buckets[key]
+
+    def set_identity_weight(self, identity: Hashable, weight: float):
+        with self._lock:
+            old_weight = self._weights.get(identity, 1.0)
+            self._weights[identity] = weight
+            buckets = [bucket for (bucket_identity, _), bucket in self._buckets.items() if bucket_identity == identity]
+        for bucket in buckets:
+            bucket.rescale(weight / old_weight)
+        self.logger.debug("Вес учётки %s: %.2f", identity, weight)
+
+    def identity_weight(self, identity: Hashable) -> float:
+        return self._weights.get(identity, 1.0)
+
+    def acquire(self, identity: Hashable, endpoint: str):
+        self.bucket(identity, endpoint).acquire()
+
+    async def acquire_async(self, identity: Hashable, endpoint: str):
+        await self.bucket(identity, endpoint).acquire_async()
+
+    def on_response(self, identity: Hashable, endpoint: str, status_code: Optional[int], retry_after: Optional[float] = None):
+        bucket = self.bucket(identity, endpoint)
+        if status_code is not None and 200 <= status_code < 300:
+            bucket.on_success()
+        elif status_code in self.THROTTLE_STATUSES:
+            bucket.on_throttle(retry_after=retry_after)
+            self.logger.warning("Статус %s для учётки %s на %s: скорость снижена до %.2f rps", status_code, identity, endpoint, bucket.rate)
+        else:
+            bucket.on_error()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {f"{identity}|{endpoint}": bucket.snapshot() for (identity, endpoint), bucket in list(self._buckets.items())}
@@ -0,0 +1,148 @@
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from typing import Any, Dict, Hashable, Iterable, Optional
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.logger import get_logger
+
+
+DEFAULT_IDENTITY = "__default__"
+
+
+def get_identity_key(cookie_data: Dict[str, Any]) -> str:
+    """
+    Ключ cookie-учётки: имя доступа, а если его нет - tokenV3.
+    """
+    return cookie_data.get("name") or cookie_data["tokenV3"]
+
+
+class SessionRegistry:
+    """
+    Реестр keep-alive сессий requests по cookie-учёткам.
+    Cookies и заголовки привязываются к сессии один раз при регистрации.
+    Сессия без учётки (DEFAULT_IDENTITY и незарегистрированные ключи) общая для всех вызывающих, поэтому
+    cookies из ответов в ней не сохраняются: cookies, переданные в вызов, уходят только с этим запросом.
+    """
+
+    def __init__(self, pool_connections: int = 4, pool_maxsize: int = 16):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.logger = get_logger("SessionRegistry")
+        self._sessions: Dict[Hashable, requests.Session] = {}
+        self._identity_data: Dict[Hashable, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def register(self, identity: Hashable, cookies=None, headers: Optional[Dict[str, str]] = None) -> requests.Session:
+        with self._lock:
+            old_session = self._sessions.pop(identity, None)
+            self._identity_data[identity] = {"cookies": cookies, "headers": dict(headers or {})}
+            session = self._create_session(cookies=cookies, headers=headers)
+            self._sessions[identity] = session
+
+        if old_session is not None:
+            old_session.close()
+        self.logger.debug("Зарегистрирована сессия для учётки %s", identity)
+        return session
+
+    def is_registered(self, identity: Hashable) -> bool:
+        # Сессии без cookies, созданные get() для незарегистрированных ключей, регистрацией не считаются
+        return identity in self._identity_data
+
+    def get(self, identity: Optional[Hashable] = None) -> requests.Session:
+        identity = DEFAULT_IDENTITY if identity is None else identity
+        session = self._sessions.get(identity)
+        if session is not None:
+            return session
+
+        with self._lock:
+            if identity not in self._sessions:
+                if identity != DEFAULT_IDENTITY:
+                    self.logger.warning("Учётка %s не зарегистрирована, используется сессия без cookies", identity)
+                self._sessions[identity] = self._create_session(persist_cookies=False)
+            return self._sessions[identity]
+
+    def identity_data(self, identity: Hashable) -> Dict[str, Any]:
+        return self._identity_data.get(identity, {"cookies": None, "headers": {}})
+
+    def close_all(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._identity_data.clear()
+        for session in sessions:
+            try:
+                session.close()
+            except Exception:
+                pass
+
+    def _create_session(self, cookies=None, headers: Optional[Dict[str, str]] = None,
+                        persist_cookies: bool = True) -> requests.Session:
+        session = requests.Session()
+        if not persist_cookies:
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[])) # Set-Cookie ответов не попадает в общий jar
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        if headers:
+            session.headers.update(headers)
+        if cookies:
+            session.cookies.update(cookies)
+        return session
+
+
+class AsyncSessionRegistry:
+    """
+    aiohttp-сессии по cookie-учёткам. aiohttp-сессия привязана к event loop,
+    поэтому реестр живёт в рамках async with и закрывает все сессии на выходе.
+    """
+
+    def __init__(self,
+                 session_registry: SessionRegistry,
+                 identities: Iterable[Hashable],
+                 limit_per_host: int = 16,
+                 keepalive_timeout: float = 30.0,
+                 timeout: float = 10.0):
+        self.session_registry = session_registry
+        self.identities = list(identities)
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self._sessions: Dict[Hashable, aiohttp.ClientSession] = {}
+
+    async def __aenter__(self) -> "AsyncSessionRegistry":
+        for identity in self.identities:
+            self._sessions[identity] = self._create_session(identity)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close_all()
+
+    def get(self, identity: Optional[Hashable] = None) -> aiohttp.ClientSession:
+        identity = DEFAULT_IDENTITY if identity is None else identity
+        if identity not in self._sessions:
+            self._sessions[identity] = self._create_session(identity)
+        return self._sessions[identity]
+
+    async def close_all(self):
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            await session.close()
+
+    def _create_session(self, identity: Hashable) -> aiohttp.ClientSession:
+        identity_data = self.session_registry.identity_data(identity)
+        connector = aiohttp.TCPConnector(limit_per_host=self.limit_per_host,
+                                         keepalive_timeout=self.keepalive_timeout)
+        # Без зарегистрированной учётки - общий jar не копит cookies ответов (как и у requests-сессии)
+        cookie_jar = aiohttp.CookieJar() if self.session_registry.is_registered(identity) else aiohttp.DummyCookieJar()
+        session = aiohttp.ClientSession(connector=connector,
+                                        cookie_jar=cookie_jar,
+                                        headers=identity_data["headers"] or None,
+                                        timeout=aiohttp.ClientTimeout(total=self.timeout))
+        if identity_data["cookies"]:
+            session.cookie_jar.update_cookies(identity_data["cookies"])
+        return session
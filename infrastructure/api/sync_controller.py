@@ -1,8 +1,10 @@
 import requests
 import ijson
-from typing import Any, Dict, Optional, Union
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+from typing import Any, Dict, Hashable, Iterable, Optional, Union
 from http import HTTPStatus
 from utils.logger import get_logger
+from infrastructure.api.session_registry import SessionRegistry, AsyncSessionRegistry, get_identity_key
 
 class APIRequestError(Exception):
     def __init__(self, message: str, status_code: Optional[int] = None):
@@ -13,9 +15,39 @@ class APIRequestError(Exception):
 class SyncAPIController:
     _ALLOWED_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
 
-    def __init__(self, timeout: int = 10):
+    def __init__(self, timeout: int = 10, pool_connections: int = 4, pool_maxsize: int = 16):
         self.timeout = timeout
         self.logger = get_logger("SyncAPIController")
+        self.sessions = SessionRegistry(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+
+    def register_identity(self, identity: Hashable, cookies=None, headers: Optional[Dict[str, str]] = None):
+        """
+        Привязывает cookies и заголовки к keep-alive сессии учётки.
+        """
+        return self.sessions.register(identity, cookies=cookies, headers=headers)
+
+    def register_cookie_identity(self, cookie_data: Dict[str, Any], base_headers: Dict[str, str]) -> str:
+        """
+        Регистрирует учётку из cookie_list (если ещё не зарегистрирована) и возвращает её ключ.
+        """
+        identity = get_identity_key(cookie_data)
+        if not self.sessions.is_registered(identity):
+            headers = base_headers.copy()
+            headers['AuthorizeV3'] = cookie_data['tokenV3']
+            self.register_identity(identity, cookies=cookie_data['cookies'], headers=headers)
+        return identity
+
+    def async_sessions(self, identities: Iterable[Hashable], limit_per_host: int = 16) -> AsyncSessionRegistry:
+        """
+        aiohttp-сессии для тех же учёток (использовать через async with).
+        """
+        return AsyncSessionRegistry(session_registry=self.sessions,
+                                    identities=identities,
+                                    limit_per_host=limit_per_host,
+                                    timeout=self.timeout)
+
+    def close(self):
+        self.sessions.close_all()
 
     def request(self,
                 base_url: str,
@@ -31,6 +63,7 @@ class SyncAPIController:
                 auth: Optional[Any] = None,
                 stream: bool = False,
                 stream_path: Optional[str] = None,
+                identity: Optional[Hashable] = None,
                 **kwargs) -> Any:
     
         base_url = base_url.rstrip("/")
@@ -60,7 +93,8 @@ class SyncAPIController:
 
         try:
             self.logger.debug(f"{method} Request to {url} | args={request_args_for_logs}")
-            response = requests.request(method=method, url=url, **request_args)
+            session = self.sessions.get(identity)
+            response = session.request(method=method, url=url, **request_args)
             return response
 
         except requests.exceptions.HTTPError as http_err:
@@ -70,6 +104,7 @@ class SyncAPIController:
             self.logger.error(f"Request failed: {req_err}")
             return {"status_code": 503,
                     "error": "Service Unavailable",
+                    "connect_failed": self._is_connect_error(req_err),
                     "details": {"message": str(req_err)}}
 
         except Exception as e:
@@ -78,6 +113,19 @@ class SyncAPIController:
                     "error": "Internal Server Error",
                     "details": {"message": str(e)}}
         
+    @staticmethod
+    def _is_connect_error(error: requests.exceptions.RequestException) -> bool:
+        """
+        True, если соединение не было установлено и запрос заведомо не дошёл до сервера
+        (таймаут подключения, отказ в соединении, DNS). Таймаут чтения и обрыв после отправки сюда не относятся.
+        """
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        if not isinstance(error, requests.exceptions.ConnectionError) or isinstance(error, requests.exceptions.ReadTimeout):
+            return False
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
     def _parse_response(self, response: requests.Response, stream: bool, stream_path: Optional[str]) -> Any:
         content_type = response.headers.get("Content-Type", "")
         if "application/json" not in content_type:
@@ -5,103 +5,516 @@ import asyncio
 import aiomysql
 import pymysql
 from dotenv import load_dotenv
-import queue
 import threading
+from collections import deque
+from contextlib import contextmanager
+from infrastructure.db.mysql.instrumentation import QueryInstrumentation
+from infrastructure.db.mysql.rows import TupleRows
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 
 
 class ConnectionPool:
-    def __init__(self, maxsize=10, **db_params):
-        self._pool = queue.Queue(maxsize)
+    """
+    Ленивый пул pymysql-соединений: стартует с minsize, растёт по требованию до maxsize.
+    Соединение, пролежавшее без дела дольше idle_ping_after, перед выдачей пингуется
+    (с переподключением), а лишние сверх minsize закрываются после max_idle_time простоя.
+    """
+
+    def __init__(self, maxsize=10, minsize=1, idle_ping_after=30.0, max_idle_time=300.0, **db_params):
+        self.maxsize = maxsize
+        self.minsize = min(minsize, maxsize)
+        self.idle_ping_after = idle_ping_after
+        self.max_idle_time = max_idle_time
         self._db_params = db_params
-        self._lock = threading.Lock()
+        self._idle = deque() # (соединение, момент возврата в пул); выдаём последнее вернувшееся
+        self._open_count = 0 # Открытые соединения: в пуле + выданные
+        self._cond = threading.Condition()
+        self._stats = {"checkouts": 0, "creations": 0, "waits": 0, "total_wait": 0.0, "max_wait": 0.0,
+                       "pings": 0, "reconnects": 0, "reaped": 0, "discarded": 0}
 
-        for _ in range(maxsize):
-            self._pool.put(self._create_connection())
+        for _ in range(self.minsize):
+            self._idle.append((self._create_connection(), time.monotonic()))
+            self._open_count += 1
 
     def _create_connection(self):
-        return pymysql.connect(
+        conn = pymysql.connect(
             cursorclass=pymysql.cursors.DictCursor,
             autocommit=True,
             **self._db_params)
+        self._count("creations")
+        return conn
 
     def get_connection(self, timeout=5):
+        start_time = time.monotonic()
+        conn = None
+        idle_for = 0.0
+        with self._cond:
+            to_close = self._collect_expired()
+            while True:
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    idle_for = start_time - returned_at
+                    break
+                if self._open_count < self.maxsize:
+                    self._open_count += 1
+                    break
+                remaining = timeout - (time.monotonic() - start_time)
+                if remaining <= 0:
+                    raise ConnectionError(f"Нет свободных соединений в пуле (maxsize={self.maxsize})")
+                self._stats["waits"] += 1
+                self._cond.wait(remaining)
+
+            waited = time.monotonic() - start_time
+            self._stats["checkouts"] += 1
+            self._stats["total_wait"] += waited
+            self._stats["max_wait"] = max(self._stats["max_wait"], waited)
+
+        self._close_quietly(to_close)
+
         try:
-            conn = self._pool.get(timeout=timeout)
-            if not conn.open:
-                conn = self._create_connection()
+            if conn is None:
+                return self._create_connection()
+            if not conn.open or idle_for >= self.idle_ping_after:
+                return self._ensure_alive(conn)
             return conn
-        except queue.Empty:
-            raise ConnectionError(f"Нет свободных соединений в пуле (maxsize={self._pool.maxsize})")
+        except Exception:
+            with self._cond:
+                self._open_count -= 1
+                self._cond.notify()
+            raise
 
+    def _ensure_alive(self, conn):
+        """
+        Пингует соединение; если сервер его уже закрыл - переподключается.
+        """
+        self._count("pings")
+        try:
+            conn.ping(reconnect=True)
+            return conn
+        except Exception as e:
+            logging.warning(f"Соединение с MySQL не отвечает, открываем новое: {e}")
+            self._close_quietly([conn])
+            self._count("reconnects")
+            return self._create_connection()
 
     def return_connection(self, conn):
-        try:
-            if conn.open:
-                self._pool.put(conn)
+        with self._cond:
+            if getattr(conn, "open", False):
+                self._idle.append((conn, time.monotonic()))
             else:
-                self._pool.put(self._create_connection())
-        except Exception:
-            self._pool.put(self._create_connection())
+                # Закрытое соединение не пересоздаём: при нужде пул вырастет сам
+                self._open_count -= 1
+                self._stats["discarded"] += 1
+            to_close = self._collect_expired()
+            self._cond.notify()
+        self._close_quietly(to_close)
 
-    def close_all(self):
-        while not self._pool.empty():
-            conn = self._pool.get()
+    def reap_idle(self):
+        with self._cond:
+            to_close = self._collect_expired()
+        self._close_quietly(to_close)
+        return len(to_close)
+
+    def _collect_expired(self):
+        """
+        Снимает с пула соединения сверх minsize, простаивающие дольше max_idle_time. Вызывается под self._cond.
+        """
+        to_close = []
+        now = time.monotonic()
+        while self._idle and self._open_count > self.minsize and now - self._idle[0][1] >= self.max_idle_time:
+            conn, _ = self._idle.popleft()
+            to_close.append(conn)
+            self._open_count -= 1
+            self._stats["reaped"] += 1
+        return to_close
+
+    def _count(self, key):
+        with self._cond:
+            self._stats[key] += 1
+
+    @staticmethod
+    def _close_quietly(connections):
+        for conn in connections:
             try:
                 conn.close()
             except Exception:
                 pass
 
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats["open"] = self._open_count
+            stats["idle"] = len(self._idle)
+            stats["in_use"] = self._open_count - len(self._idle)
+        stats["total_wait"] = round(stats["total_wait"], 3)
+        stats["max_wait"] = round(stats["max_wait"], 3)
+        return stats
+
+    def close_all(self):
+        with self._cond:
+            connections = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._open_count -= len(connections)
+        self._close_quietly(connections)
+
 
 
 class SyncDatabase:
-    def __init__(self, host, port, user, password, db, maxsize=10):
+    def __init__(self, host, port, user, password, db, maxsize=10, minsize=1, idle_ping_after=30.0, max_idle_time=300.0,
+                 instrumentation: QueryInstrumentation | None = None):
         self.pool = ConnectionPool(
             host=host,
             port=int(port),
             user=user,
             password=password,
             db=db,
-            maxsize=maxsize)
+            maxsize=maxsize,
+            minsize=minsize,
+            idle_ping_after=idle_ping_after,
+            max_idle_time=max_idle_time)
+        self.instrumentation = instrumentation or QueryInstrumentation()
 
-    def execute_query(self, query, params=None):
+    def _checkout(self):
+        start_time = time.perf_counter()
+        conn = self.pool.get_connection()
+        return conn, time.perf_counter() - start_time
+
+    def _record(self, label, kind, start_time, pool_wait, rows=0, approx_bytes=0, error=False, query="", params=None):
+        self.instrumentation.record(label=label, kind=kind, duration=time.perf_counter() - start_time, pool_wait=pool_wait,
+                                    rows=rows, approx_bytes=approx_bytes, error=error, sql=query, params=params,
+                                    explain=self._explain)
+
+    def _explain(self, query, params=None):
         conn = self.pool.get_connection()
         try:
             with conn.cursor() as cursor:
-                cursor.execute(query, params)
+                cursor.execute("EXPLAIN " + query.strip().rstrip(";"), params)
                 return cursor.fetchall()
+        finally:
+            self.pool.return_connection(conn)
+
+    def execute_query(self, query, params=None):
+        label = self.instrumentation.caller_label()
+        start_time = time.perf_counter()
+        conn, pool_wait = self._checkout()
+        result, error = None, False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                result = cursor.fetchall()
+                return result
         except Exception as e:
+            error = True
             logging.error(f"Sync execute_query error: {e}")
             raise
         finally:
             self.pool.return_connection(conn)
+            self._record(label, "query", start_time, pool_wait, rows=len(result) if result else 0,
+                         approx_bytes=self.instrumentation.result_size(result), error=error, query=query, params=params)
+
+    def execute_query_rows(self, query, params=None) -> TupleRows:
+        """
+        Как execute_query, но строки - кортежи (обычный Cursor вместо DictCursor) с картой колонок.
+        """
+        label = self.instrumentation.caller_label()
+        start_time = time.perf_counter()
+        conn, pool_wait = self._checkout()
+        result, error = None, False
+        try:
+            with conn.cursor(pymysql.cursors.Cursor) as cursor:
+                cursor.execute(query, params)
+                result = TupleRows.from_cursor(cursor, cursor.fetchall())
+                return result
+        except Exception as e:
+            error = True
+            logging.error(f"Sync execute_query_rows error: {e}")
+            raise
+        finally:
+            self.pool.return_connection(conn)
+            rows = result.rows if result is not None else None
+            self._record(label, "query_rows", start_time, pool_wait, rows=len(rows) if rows else 0,
+                         approx_bytes=self.instrumentation.result_size(rows), error=error, query=query, params=params)
+
+    def stream_query(self, query, params=None, batch_size=5000):
+        """
+        Построчное чтение через серверный курсор (SSCursor): строки - кортежи, на клиенте
+        одновременно не больше batch_size. Соединение занято, пока генератор не дочитан или не закрыт.
+        """
+        return self._stream(query, params, batch_size, self.instrumentation.caller_label())
+
+    def _stream(self, query, params, batch_size, label):
+        start_time = time.perf_counter()
+        conn, pool_wait = self._checkout()
+        cursor = None
+        rows_read, approx_bytes, error = 0, 0, False
+        try:
+            cursor = conn.cursor(pymysql.cursors.SSCursor)
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                rows_read += len(rows)
+                approx_bytes += self.instrumentation.result_size(rows)
+                yield from rows
+        except Exception as e:
+            error = True
+            logging.error(f"Sync stream_query error: {e}")
+            raise
+        finally:
+            try:
+                if cursor is not None:
+                    cursor.close() # Дочитывает остаток результата, иначе соединение нельзя переиспользовать
+            except Exception:
+                ConnectionPool._close_quietly([conn]) # Пул выбросит закрытое соединение
+            self.pool.return_connection(conn)
+            self._record(label, "stream", start_time, pool_wait, rows=rows_read, approx_bytes=approx_bytes,
+                         error=error, query=query, params=params)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Явная транзакция на одном соединении: отдаёт DictCursor, при выходе commit, при исключении rollback.
+        """
+        label = self.instrumentation.caller_label()
+        start_time = time.perf_counter()
+        conn, pool_wait = self._checkout()
+        error = False
+        try:
+            conn.begin()
+            with conn.cursor() as cursor:
+                yield cursor
+            conn.commit()
+        except Exception as e:
+            error = True
+            logging.error(f"Sync transaction error: {e}")
+            try:
+                conn.rollback()
+            except Exception:
+                ConnectionPool._close_quietly([conn])
+            raise
+        finally:
+            self.pool.return_connection(conn)
+            self._record(label, "transaction", start_time, pool_wait, error=error)
+
+    def bulk_update(self, table, key_columns, set_columns, rows, batch_size=500, cursor=None):
+        """
+        Множественный UPDATE пачками: по одному запросу на batch_size строк вида
+        SET col = CASE WHEN (ключ) = (...) THEN ... ELSE col END WHERE (ключ) IN (...).
+        rows - кортежи (значения key_columns..., значения set_columns...); при повторе ключа побеждает последняя строка.
+        С cursor выполняется внутри чужой транзакции, без него - в своей. Возвращает число затронутых строк.
+        """
+        key_count = len(key_columns)
+        latest = {}
+        for row in rows:
+            latest[tuple(row[:key_count])] = tuple(row[key_count:])
+        if not latest:
+            return 0
+
+        if cursor is None:
+            with self.transaction() as own_cursor:
+                return self._bulk_update_batches(own_cursor, table, key_columns, set_columns, list(latest.items()), batch_size)
+        return self._bulk_update_batches(cursor, table, key_columns, set_columns, list(latest.items()), batch_size)
+
+    @staticmethod
+    def _bulk_update_batches(cursor, table, key_columns, set_columns, items, batch_size):
+        key_count = len(key_columns)
+        key_expr = "(" + ", ".join(key_columns) + ")"
+        key_placeholder = "(" + ", ".join(["%s"] * key_count) + ")"
+        affected = 0
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            params = []
+            set_parts = []
+            for col_idx, column in enumerate(set_columns):
+                whens = []
+                for key, values in batch:
+                    whens.append(f"WHEN {key_expr} = {key_placeholder} THEN %s")
+                    params.extend(key)
+                    params.append(values[col_idx])
+                set_parts.append(f"{column} = CASE {' '.join(whens)} ELSE {column} END")
+            in_list = ", ".join([key_placeholder] * len(batch))
+            for key, _ in batch:
+                params.extend(key)
+            cursor.execute(f"UPDATE {table} SET {', '.join(set_parts)} WHERE {key_expr} IN ({in_list})", params)
+            affected += cursor.rowcount
+        return affected
 
     def execute_scalar(self, query, params=None):
         result = self.execute_query(query, params)
         return list(result[0].values())[0] if result else None
 
     def execute_non_query(self, query, params=None):
-        conn = self.pool.get_connection()
+        label = self.instrumentation.caller_label()
+        start_time = time.perf_counter()
+        conn, pool_wait = self._checkout()
+        rows, error = 0, False
         try:
             with conn.cursor() as cursor:
                 cursor.execute(query, params)
+                rows = cursor.rowcount
         except Exception as e:
+            error = True
             logging.error(f"Sync execute_non_query error: {e}")
             conn.rollback()
             raise
         finally:
             self.pool.return_connection(conn)
+            self._record(label, "non_query", start_time, pool_wait, rows=max(rows, 0), error=error, query=query, params=params)
 
     def execute_many(self, query, param_list):
-        conn = self.pool.get_connection()
+        label = self.instrumentation.caller_label()
+        start_time = time.perf_counter()
+        conn, pool_wait = self._checkout()
+        rows, error = 0, False
         try:
             with conn.cursor() as cursor:
                 cursor.executemany(query, param_list)
+                rows = cursor.rowcount
         except Exception as e:
+            error = True
             logging.error(f"Sync execute_many error: {e}")
             conn.rollback()
             raise
         finally:
-            self.pool.return_connection(conn)
\ No newline at end of file
+            self.pool.return_connection(conn)
+            self._record(label, "many", start_time, pool_wait, rows=max(rows, 0), error=error, query=query)
+
+
+
+class AsyncDatabase:
+    """
+    Асинхронный доступ к MySQL на aiomysql. Пул создаётся при первом запросе и привязан к текущему
+    event loop, поэтому использовать внутри одного asyncio.run и закрывать через close() / async with.
+    """
+
+    def __init__(self, host, port, user, password, db, minsize=1, maxsize=10,
+                 instrumentation: QueryInstrumentation | None = None):
+        self._db_params = {"host": host,
+                           "port": int(port),
+                           "user": user,
+                           "password": password,
+                           "db": db}
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self._pool = None
+        self._pool_lock = None
+        self.instrumentation = instrumentation or QueryInstrumentation() # Можно передать общий с SyncDatabase
+
+    def _record(self, label, kind, start_time, pool_wait, rows=0, approx_bytes=0, error=False, query="", params=None):
+        # Без EXPLAIN: синхронный EXPLAIN заблокировал бы event loop
+        self.instrumentation.record(label=label, kind=kind, duration=time.perf_counter() - start_time, pool_wait=pool_wait,
+                                    rows=rows, approx_bytes=approx_bytes, error=error, sql=query, params=params)
+
+    async def __aenter__(self):
+        await self._get_pool()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _get_pool(self):
+        if self._pool is not None:
+            return self._pool
+        if self._pool_lock is None:
+            self._pool_lock = asyncio.Lock()
+        async with self._pool_lock:
+            if self._pool is None:
+                self._pool = await aiomysql.create_pool(minsize=self.minsize,
+                                                        maxsize=self.maxsize,
+                                                        autocommit=True,
+                                                        cursorclass=aiomysql.DictCursor,
+                                                        **self._db_params)
+        return self._pool
+
+    async def execute_query(self, query, params=None):
+        label = self.instrumentation.caller_label()
+        start_time = time.perf_counter()
+        pool = await self._get_pool()
+        result, error, pool_wait = None, False, 0.0
+        async with pool.acquire() as conn:
+            pool_wait = time.perf_counter() - start_time
+            try:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(query, params)
+                    result = await cursor.fetchall()
+                    return result
+            except Exception as e:
+                error = True
+                logging.error(f"Async execute_query error: {e}")
+                raise
+            finally:
+                self._record(label, "async_query", start_time, pool_wait, rows=len(result) if result else 0,
+                             approx_bytes=self.instrumentation.result_size(result), error=error, query=query, params=params)
+
+    async def execute_query_rows(self, query, params=None) -> TupleRows:
+        label = self.instrumentation.caller_label()
+        start_time = time.perf_counter()
+        pool = await self._get_pool()
+        result, error, pool_wait = None, False, 0.0
+        async with pool.acquire() as conn:
+            pool_wait = time.perf_counter() - start_time
+            try:
+                async with conn.cursor(aiomysql.Cursor) as cursor:
+                    await cursor.execute(query, params)
+                    result = TupleRows.from_cursor(cursor, await cursor.fetchall())
+                    return result
+            except Exception as e:
+                error = True
+                logging.error(f"Async execute_query_rows error: {e}")
+                raise
+            finally:
+                rows = result.rows if result is not None else None
+                self._record(label, "async_query_rows", start_time, pool_wait, rows=len(rows) if rows else 0,
+                             approx_bytes=self.instrumentation.result_size(rows), error=error, query=query, params=params)
+
+    async def execute_scalar(self, query, params=None):
+        result = await self.execute_query(query, params)
+        return list(result[0].values())[0] if result else None
+
+    async def execute_non_query(self, query, params=None):
+        label = self.instrumentation.caller_label()
+        start_time = time.perf_counter()
+        pool = await self._get_pool()
+        rows, error, pool_wait = 0, False, 0.0
+        async with pool.acquire() as conn:
+            pool_wait = time.perf_counter() - start_time
+            try:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(query, params)
+                    rows = cursor.rowcount
+            except Exception as e:
+                error = True
+                logging.error(f"Async execute_non_query error: {e}")
+                await conn.rollback()
+                raise
+            finally:
+                self._record(label, "async_non_query", start_time, pool_wait, rows=max(rows, 0), error=error, query=query, params=params)
+
+    async def execute_many(self, query, param_list):
+        label = self.instrumentation.caller_label()
+        start_time = time.perf_counter()
+        pool = await self._get_pool()
+        rows, error, pool_wait = 0, False, 0.0
+        async with pool.acquire() as conn:
+            pool_wait = time.perf_counter() - start_time
+            try:
+                async with conn.cursor() as cursor:
+                    await cursor.executemany(query, param_list)
+                    rows = cursor.rowcount
+            except Exception as e:
+                error = True
+                logging.error(f"Async execute_many error: {e}")
+                await conn.rollback()
+                raise
+            finally:
+                self._record(label, "async_many", start_time, pool_wait, rows=max(rows or 0, 0), error=error, query=query)
+
+    async def close(self):
+        pool, self._pool = self._pool, None
+        self._pool_lock = None
+        if pool is not None:
+            pool.close()
+            await pool.wait_closed()
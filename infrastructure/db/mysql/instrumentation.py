@@ -0,0 +1,191 @@
+import logging
+import os
+import sys
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+
+_SKIP_FILES = {os.path.normcase(os.path.abspath(path)) for path in (
+    __file__,
+    os.path.join(os.path.dirname(__file__), "base.py"),
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))), "utils", "logger.py"))}
+
+# Метка, заданная вызывающим (QueryInstrumentation.labelled): переживает await и asyncio.to_thread,
+# где цепочка кадров до метода контроллера уже не видна
+_current_label: ContextVar[Optional[str]] = ContextVar("query_label", default=None)
+
+
+@dataclass
+class QueryLabelStats:
+    label: str
+    calls: int = 0
+    errors: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+    rows: int = 0
+    approx_bytes: int = 0
+    pool_wait: float = 0.0
+    slow: int = 0
+
+
+@dataclass
+class SlowQuery:
+    label: str
+    kind: str
+    duration: float
+    pool_wait: float
+    rows: int
+    sql: str
+    params: Any = field(repr=False)
+    explain: Optional[List[Dict[str, Any]]] = None
+
+
+class QueryInstrumentation:
+    """
+    Учёт запросов SyncDatabase и AsyncDatabase: время, строки, примерный объём, ожидание соединения из пула.
+    Метка запроса - имя вызвавшего метода (обычно MySQLController.<метод>). Запросы дольше
+    slow_query_threshold попадают в журнал медленных (последние slow_log_size), для SELECT - с EXPLAIN,
+    если он включён (EXPLAIN снимается один раз на метку, только для SyncDatabase).
+    """
+
+    SIZE_SAMPLE_ROWS = 200 # Объём больших результатов оценивается по выборке строк, а не по каждой ячейке
+
+    def __init__(self, enabled: bool = True, slow_query_threshold: float = 1.0, explain_slow_queries: bool = False,
+                 slow_log_size: int = 50, logger=None):
+        self.enabled = enabled
+        self.slow_query_threshold = slow_query_threshold
+        self.explain_slow_queries = explain_slow_queries
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._by_label: Dict[str, QueryLabelStats] = {}
+        self._slow_log: Deque[SlowQuery] = deque(maxlen=slow_log_size)
+        self._explained: set = set()
+
+    @staticmethod
+    def caller_label(skip: int = 0) -> str:
+        """
+        Метка из labelled(), а без неё - первый кадр вне модулей БД и логгера; skip - сколько ещё кадров пропустить
+        (для вспомогательных методов, которые размечают запросы именем вызвавшего их метода).
+        """
+        label = _current_label.get()
+        if label is not None:
+            return label
+        frame = sys._getframe(1 + skip)
+        while frame is not None:
+            filename = os.path.normcase(os.path.abspath(frame.f_code.co_filename))
+            if filename not in _SKIP_FILES and "contextlib" not in filename:
+                return frame.f_code.co_qualname
+            frame = frame.f_back
+        return "unknown"
+
+    @staticmethod
+    @contextmanager
+    def labelled(label: str):
+        token = _current_label.set(label)
+        try:
+            yield
+        finally:
+            _current_label.reset(token)
+
+    def record(self, label: str, kind: str, duration: float, pool_wait: float = 0.0, rows: int = 0,
+               approx_bytes: int = 0, error: bool = False, sql: str = "", params: Any = None,
+               explain: Optional[Callable[[str, Any], List[Dict[str, Any]]]] = None):
+        if not self.enabled:
+            return
+        is_slow = duration >= self.slow_query_threshold
+        with self._lock:
+            stats = self._by_label.get(label)
+            if stats is None:
+                stats = self._by_label[label] = QueryLabelStats(label=label)
+            stats.calls += 1
+            stats.errors += int(error)
+            stats.total_time += duration
+            stats.max_time = max(stats.max_time, duration)
+            stats.rows += rows
+            stats.approx_bytes += approx_bytes
+            stats.pool_wait += pool_wait
+            stats.slow += int(is_slow)
+            need_explain = (is_slow and explain is not None and self.explain_slow_queries
+                            and label not in self._explained and self._is_explainable(sql))
+            if need_explain:
+                self._explained.add(label)
+
+        if not is_slow:
+            return
+        entry = SlowQuery(label=label, kind=kind, duration=duration, pool_wait=pool_wait, rows=rows, sql=sql, params=params)
+        if need_explain:
+            try:
+                entry.explain = explain(sql, params)
+            except Exception as e:
+                self.logger.warning("EXPLAIN для %s не снят: %s", label, e)
+        with self._lock:
+            self._slow_log.append(entry)
+        self.logger.warning("Медленный запрос %s (%s): %.3f сек, ожидание пула %.3f сек, строк %s%s",
+                            label, kind, duration, pool_wait, rows,
+                            f", EXPLAIN: {entry.explain}" if entry.explain else "")
+
+    @staticmethod
+    def _is_explainable(sql: str) -> bool:
+        head = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+        return head in ("SELECT", "WITH")
+
+    @classmethod
+    def approx_size(cls, rows) -> int:
+        """
+        Примерный объём результата: длина строк/байтов плюс 8 байт на прочие значения.
+        У результатов больше SIZE_SAMPLE_ROWS строк считается по равномерной выборке и масштабируется.
+        """
+        if not rows:
+            return 0
+        count = len(rows)
+        sample = rows[::max(1, count // cls.SIZE_SAMPLE_ROWS)]
+        total = 0
+        for row in sample:
+            values = row.values() if isinstance(row, dict) else row
+            for value in values:
+                if isinstance(value, (str, bytes, bytearray)):
+                    total += len(value)
+                else:
+                    total += 8
+        return total * count // len(sample)
+
+    def result_size(self, rows) -> int:
+        # При выключенном учёте объём не считается вовсе
+        return self.approx_size(rows) if self.enabled else 0
+
+    def stats(self) -> Dict[str, QueryLabelStats]:
+        with self._lock:
+            return {label: QueryLabelStats(**vars(stats)) for label, stats in self._by_label.items()}
+
+    def slow_queries(self) -> List[SlowQuery]:
+        with self._lock:
+            return list(self._slow_log)
+
+    def reset(self):
+        with self._lock:
+            self._by_label.clear()
+            self._slow_log.clear()
+            self._explained.clear()
+
+    def summary_table(self) -> str:
+        rows = sorted(self.stats().values(), key=lambda stats: stats.total_time, reverse=True)
+        lines = [f"{'запрос':<58} {'вызовов':>7} {'всего, с':>9} {'сред, мс':>9} {'макс, мс':>9} "
+                 f"{'строк':>9} {'~КБ':>9} {'пул, с':>7} {'медл.':>5} {'ошиб.':>5}"]
+        for stats in rows:
+            lines.append(f"{stats.label[:58]:<58} {stats.calls:>7} {stats.total_time:>9.3f} "
+                         f"{stats.total_time / stats.calls * 1000:>9.1f} {stats.max_time * 1000:>9.1f} "
+                         f"{stats.rows:>9} {stats.approx_bytes / 1024:>9.1f} {stats.pool_wait:>7.3f} "
+                         f"{stats.slow:>5} {stats.errors:>5}")
+        total_time = sum(stats.total_time for stats in rows)
+        lines.append(f"Итого: {sum(stats.calls for stats in rows)} запросов, {total_time:.3f} сек в БД, "
+                     f"медленных (>= {self.slow_query_threshold} сек): {sum(stats.slow for stats in rows)}")
+        return "\n".join(lines)
+
+    def log_summary(self, logger=None):
+        if not self.enabled:
+            return
+        (logger or self.logger).info("Статистика запросов MySQL за прогон:\n%s", self.summary_table())
@@ -0,0 +1,93 @@
+-- Снимок текущих остатков для регулярного задания: последняя выгрузка a_wb_stocks, уже с WB office id и регионом.
+-- Приложение DDL не выполняет и снимок не пересобирает - только проверяет, что он соответствует MAX(time_end)
+-- в a_wb_stocks, и читает его (MySQLController.current_stock_snapshot_available). Пересборка - процедура ниже:
+-- её вызывает событие раз в 5 минут, а загрузчик a_wb_stocks может вызвать её сразу после выгрузки.
+--
+-- Применение:  mysql mp_data < infrastructure/db/mysql/migrations/001_current_stocks_snapshot.sql
+-- Для события нужен включённый планировщик: SET GLOBAL event_scheduler = ON.
+
+CREATE TABLE IF NOT EXISTS mp_data.a_wb_stock_transfer_current_stocks (
+    id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    stock_id BIGINT NULL,
+    wb_article_id BIGINT NOT NULL,
+    warehouse_name_id INT NULL,
+    warehouse_id BIGINT NULL,
+    size_id INT NULL,
+    time_end DATETIME NULL,
+    qty INT NULL,
+    `size` VARCHAR(64) NULL,
+    region_id INT NULL,
+    KEY idx_region_article (region_id, wb_article_id),
+    KEY idx_qty (qty)
+);
+
+CREATE TABLE IF NOT EXISTS mp_data.a_wb_stock_transfer_current_stocks_state (
+    id TINYINT NOT NULL PRIMARY KEY,
+    source_time_end DATETIME NULL,
+    row_count INT NOT NULL DEFAULT 0,
+    refreshed_at DATETIME NULL
+);
+
+INSERT IGNORE INTO mp_data.a_wb_stock_transfer_current_stocks_state (id) VALUES (1);
+
+DROP PROCEDURE IF EXISTS mp_data.a_wb_stock_transfer_refresh_current_stocks;
+
+DELIMITER $$
+
+-- Пересобирает снимок, если в a_wb_stocks новый MAX(time_end) (или p_force = 1), в одной транзакции:
+-- читатели до COMMIT видят прежний снимок. Строка состояния блокируется FOR UPDATE - параллельные вызовы
+-- не пересобирают снимок дважды.
+CREATE PROCEDURE mp_data.a_wb_stock_transfer_refresh_current_stocks(IN p_force TINYINT)
+BEGIN
+    DECLARE v_snapshot_time_end DATETIME;
+    DECLARE v_source_time_end DATETIME;
+    DECLARE v_row_count INT DEFAULT 0;
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        ROLLBACK;
+        RESIGNAL;
+    END;
+
+    START TRANSACTION;
+
+    SELECT source_time_end INTO v_snapshot_time_end
+    FROM mp_data.a_wb_stock_transfer_current_stocks_state
+    WHERE id = 1
+    FOR UPDATE;
+
+    SELECT MAX(time_end) INTO v_source_time_end FROM mp_data.a_wb_stocks;
+
+    IF v_source_time_end IS NOT NULL AND (p_force = 1 OR NOT (v_snapshot_time_end <=> v_source_time_end)) THEN
+        DELETE FROM mp_data.a_wb_stock_transfer_current_stocks;
+
+        INSERT INTO mp_data.a_wb_stock_transfer_current_stocks
+            (stock_id, wb_article_id, warehouse_name_id, warehouse_id, size_id, time_end, qty, `size`, region_id)
+        SELECT s.stock_id,
+            s.nmId,
+            s.warehouseName_id,
+            COALESCE(NULLIF(wh.warehouse_wb_id, 0), s.warehouseName_id),
+            s.techSize_id,
+            s.time_end,
+            s.quantity,
+            awis.`size`,
+            wh.region_id
+        FROM mp_data.a_wb_stocks s
+        LEFT JOIN mp_data.a_wb_warehouseName wh ON s.warehouseName_id = wh.warehouse_id
+        LEFT JOIN mp_data.a_wb_izd_size awis ON awis.size_id = s.techSize_id
+        WHERE s.time_end >= v_source_time_end - INTERVAL 10 SECOND;
+
+        SET v_row_count = ROW_COUNT();
+
+        UPDATE mp_data.a_wb_stock_transfer_current_stocks_state
+        SET source_time_end = v_source_time_end, row_count = v_row_count, refreshed_at = NOW()
+        WHERE id = 1;
+    END IF;
+
+    COMMIT;
+END$$
+
+DELIMITER ;
+
+CREATE EVENT IF NOT EXISTS mp_data.a_wb_stock_transfer_refresh_current_stocks_event
+    ON SCHEDULE EVERY 5 MINUTE
+    DO CALL mp_data.a_wb_stock_transfer_refresh_current_stocks(0);
@@ -0,0 +1,26 @@
+-- Дневная свёртка продаж для регулярного задания: число не сторнированных продаж по дню DATE(last_update_time),
+-- nmId, размеру и WB office id за последние 30 дней. Приложение DDL не выполняет: оно проверяет, что таблицы
+-- есть, и досчитывает свёртку (MySQLController.refresh_sales_daily_rollup). Без таблиц продажи агрегируются
+-- прямо по a_wb_sales, как раньше.
+--
+-- Применение:  mysql mp_data < infrastructure/db/mysql/migrations/002_sales_daily_rollup.sql
+
+CREATE TABLE IF NOT EXISTS mp_data.a_wb_stock_transfer_sales_daily (
+    id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    sale_date DATE NOT NULL,
+    nmId BIGINT NULL,
+    techSize_id INT NULL,
+    office_id BIGINT NOT NULL,
+    order_count INT NOT NULL,
+    KEY idx_sale_date (sale_date)
+);
+
+-- Водяной знак свёртки (MAX(last_update_time) a_wb_sales на момент досчёта) и время последнего полного пересчёта
+CREATE TABLE IF NOT EXISTS mp_data.a_wb_stock_transfer_sales_daily_state (
+    id TINYINT NOT NULL PRIMARY KEY,
+    source_last_update_time DATETIME NULL,
+    full_rebuilt_at DATETIME NULL,
+    refreshed_at DATETIME NULL
+);
+
+INSERT IGNORE INTO mp_data.a_wb_stock_transfer_sales_daily_state (id) VALUES (1);
@@ -1,14 +1,212 @@
+import asyncio
+import threading
 from collections import defaultdict
-from infrastructure.db.mysql.base import SyncDatabase
+from datetime import timedelta
+from infrastructure.db.mysql.base import SyncDatabase, AsyncDatabase
+from infrastructure.db.mysql.instrumentation import QueryInstrumentation
+from infrastructure.db.mysql.rows import TupleRows, iter_row_fields
+from infrastructure.local_storage.reference_cache import ReferenceDataCache
 from models.tasks import TaskWithProducts, ProductToTask, ProductSizeInfo
 import json
 from utils.logger import simple_logger, get_logger
 
 class MySQLController():
 
-    def __init__(self, db:SyncDatabase):
+    # Запросы тяжёлых читателей: общие для синхронных методов и их *_async-вариантов
+    _SQL_STOCKS_WITH_REGION = """SELECT s.stock_id,
+                        s.nmId as wb_article_id, 
+                        s.warehouseName_id as warehouse_id,
+                        s.techSize_id as size_id,
+                        s.time_end,
+                        s.quantity as qty,
+                        awis.`size`,
+                        wh.region_id  FROM mp_data.a_wb_stocks s
+                LEFT JOIN mp_data.a_wb_warehouseName wh ON s.warehouseName_id = wh.warehouse_id
+                LEFT JOIN mp_data.a_wb_izd_size awis ON awis.size_id = s.techSize_id
+                WHERE s.time_end >= (SELECT MAX(time_end) - INTERVAL 10 SECOND FROM mp_data.a_wb_stocks)
+                AND wh.region_id IS NOT NULL;"""
+
+    _SQL_MAX_STOCK_ARTICLE = """SELECT nmid as wb_article_id, MAX(s.quantity) AS max_qty
+                    FROM mp_data.a_wb_stocks s
+                        WHERE s.time_end >= (SELECT MAX(time_end) - INTERVAL 10 SECOND FROM mp_data.a_wb_stocks)
+                        GROUP BY wb_article_id
+                        ORDER BY max_qty DESC
+                        LIMIT 1;"""
+
+    # Снимок текущих остатков: последняя выгрузка a_wb_stocks, уже с WB office id и регионом.
+    # Таблицы, процедура пересборки и событие - infrastructure/db/mysql/migrations/001_current_stocks_snapshot.sql;
+    # приложение снимок только читает, если он построен по текущему MAX(time_end).
+    _SQL_CURRENT_STOCKS_STATE = """SELECT source_time_end, row_count, refreshed_at
+                FROM mp_data.a_wb_stock_transfer_current_stocks_state
+                WHERE id = 1;"""
+
+    _SQL_STOCKS_WATERMARK = """SELECT MAX(time_end) AS max_time_end FROM mp_data.a_wb_stocks;"""
+
+    _SQL_REFRESH_CURRENT_STOCKS = """CALL mp_data.a_wb_stock_transfer_refresh_current_stocks(%s);"""
+
+    _SQL_CURRENT_STOCKS_WITH_REGION = """SELECT stock_id, wb_article_id, warehouse_id, size_id, time_end, qty, `size`, region_id
+                FROM mp_data.a_wb_stock_transfer_current_stocks
+                WHERE region_id IS NOT NULL;"""
+
+    _SQL_CURRENT_MAX_STOCK_ARTICLE = """SELECT wb_article_id, qty AS max_qty
+                FROM mp_data.a_wb_stock_transfer_current_stocks
+                ORDER BY qty DESC
+                LIMIT 1;"""
+
+    _SQL_WAREHOUSE_NAME_ID_TO_WB_OFFICE_ID = """SELECT warehouse_id, warehouse_wb_id 
+                FROM mp_data.a_wb_warehouseName
+                WHERE warehouse_wb_id IS NOT NULL
+                AND warehouse_wb_id != 0;"""
+
+    _SQL_TRANSFERS_ON_THE_WAY_WITH_REGION = """
+            SELECT
+                nmId AS wb_article_id,
+                warehouse_from_id,
+                warehouse_to_id,
+                size_id,
+                qty_left_to_deliver AS qty,
+                whto.region_id AS to_region_id,
+                whfrom.region_id AS from_region_id,
+                created_at
+            FROM mp_data.a_wb_stock_transfer_products_on_the_way
+            LEFT JOIN mp_data.a_wb_warehouseName whto
+                ON whto.warehouse_wb_id = mp_data.a_wb_stock_transfer_products_on_the_way.warehouse_to_id
+            LEFT JOIN mp_data.a_wb_warehouseName whfrom
+                ON whfrom.warehouse_wb_id = mp_data.a_wb_stock_transfer_products_on_the_way.warehouse_from_id
+            WHERE is_finished != 1
+            AND qty_left_to_deliver > 0
+            AND created_at >= NOW() - INTERVAL 14 DAY;"""
+
+    # Интервалы наличия за 30 дней для потокового чтения: сразу даты, без времени и лишних колонок
+    _SQL_STOCK_AVAILABILITY_DAYS = """
+            SELECT wb_article_id, size_id, warehouse_id, DATE(time_beg), DATE(time_end)
+            FROM mp_data.a_wb_catalog_stocks
+            WHERE time_end > NOW() - INTERVAL 30 DAY
+                AND time_beg IS NOT NULL;"""
+
+    _SQL_SIZE_SALES_FOR_WAREHOUSE = """
+            SELECT
+                s.nmId,
+                s.techSize_id,
+                w.warehouse_wb_id AS office_id,
+                COUNT(*) AS order_count
+            FROM mp_data.a_wb_sales AS s
+            LEFT JOIN mp_data.a_wb_warehouseName AS w
+                ON s.warehouseName_id = w.warehouse_id
+            WHERE s.last_update_time > NOW() - INTERVAL 30 DAY
+                AND COALESCE(s.IsStorno, 0) = 0
+                AND COALESCE(w.warehouse_wb_id, 0) <> 0
+            GROUP BY s.nmId, s.techSize_id, w.warehouse_wb_id;"""
+
+    # Дневные агрегаты продаж по DATE(last_update_time) - тот же ключ, по которому окно режет _SQL_SIZE_SALES_FOR_WAREHOUSE.
+    # Каждый запуск пересчитывает целиком SALES_ROLLUP_LOOKBACK_DAYS дней до дня водяного знака (MAX(last_update_time)
+    # прошлой свёртки) и дни после него - узкий диапазон по last_update_time, а не всё окно. Правки строк, которые
+    # уводят их из более старых дней, исправляет полный пересчёт окна раз в SALES_ROLLUP_FULL_REBUILD_HOURS.
+    # Таблицы свёртки создаёт миграция 002_sales_daily_rollup.sql; без них продажи агрегируются по a_wb_sales
+    _SALES_DAILY_TABLES = {'a_wb_stock_transfer_sales_daily', 'a_wb_stock_transfer_sales_daily_state'}
+
+    _SQL_SALES_DAILY_TABLES = """SELECT table_name AS table_name FROM information_schema.tables
+                WHERE table_schema = 'mp_data'
+                    AND table_name IN ('a_wb_stock_transfer_sales_daily', 'a_wb_stock_transfer_sales_daily_state');"""
+
+    _SQL_LOCK_SALES_DAILY_STATE = """SELECT source_last_update_time,
+                    DATE(source_last_update_time) AS watermark_date,
+                    (full_rebuilt_at IS NULL OR full_rebuilt_at < NOW() - INTERVAL %s HOUR) AS full_rebuild_due,
+                    DATE(NOW() - INTERVAL 30 DAY) AS window_start_date,
+                    DATE(NOW() + INTERVAL 1 DAY) AS window_end_date
+                FROM mp_data.a_wb_stock_transfer_sales_daily_state
+                WHERE id = 1 FOR UPDATE;"""
+
+    _SQL_SALES_WATERMARK = """SELECT MAX(last_update_time) AS max_last_update_time FROM mp_data.a_wb_sales;"""
+
+    _SQL_CLEAR_SALES_DAILY_RANGE = """DELETE FROM mp_data.a_wb_stock_transfer_sales_daily WHERE sale_date >= %s AND sale_date < %s;"""
+
+    _SQL_PRUNE_SALES_DAILY = """DELETE FROM mp_data.a_wb_stock_transfer_sales_daily WHERE sale_date < %s;"""
+
+    _SQL_FILL_SALES_DAILY_RANGE = """
+            INSERT INTO mp_data.a_wb_stock_transfer_sales_daily (sale_date, nmId, techSize_id, office_id, order_count)
+            SELECT
+                DATE(s.last_update_time),
+                s.nmId,
+                s.techSize_id,
+                w.warehouse_wb_id,
+                COUNT(*)
+            FROM mp_data.a_wb_sales AS s
+            JOIN mp_data.a_wb_warehouseName AS w
+                ON s.warehouseName_id = w.warehouse_id
+            WHERE s.last_update_time >= %s AND s.last_update_time < %s
+                AND COALESCE(s.IsStorno, 0) = 0
+                AND COALESCE(w.warehouse_wb_id, 0) <> 0
+            GROUP BY DATE(s.last_update_time), s.nmId, s.techSize_id, w.warehouse_wb_id;"""
+
+    _SQL_UPDATE_SALES_DAILY_STATE = """UPDATE mp_data.a_wb_stock_transfer_sales_daily_state
+                SET source_last_update_time = %s,
+                    full_rebuilt_at = IF(%s, NOW(), full_rebuilt_at),
+                    refreshed_at = NOW()
+                WHERE id = 1;"""
+
+    # Те же 30 дней, что и _SQL_SIZE_SALES_FOR_WAREHOUSE: целые дни из свёртки
+    # плюс неполный первый день окна прямо из a_wb_sales (узкий диапазон по last_update_time)
+    _SQL_SIZE_SALES_FROM_DAILY = """
+            SELECT nmId, techSize_id, office_id, CAST(SUM(order_count) AS SIGNED) AS order_count
+            FROM (
+                SELECT nmId, techSize_id, office_id, order_count
+                FROM mp_data.a_wb_stock_transfer_sales_daily
+                WHERE sale_date > DATE(NOW() - INTERVAL 30 DAY)
+                UNION ALL
+                SELECT s.nmId, s.techSize_id, w.warehouse_wb_id, COUNT(*)
+                FROM mp_data.a_wb_sales AS s
+                JOIN mp_data.a_wb_warehouseName AS w
+                    ON s.warehouseName_id = w.warehouse_id
+                WHERE s.last_update_time > NOW() - INTERVAL 30 DAY
+                    AND s.last_update_time < DATE(NOW() - INTERVAL 30 DAY) + INTERVAL 1 DAY
+                    AND COALESCE(s.IsStorno, 0) = 0
+                    AND COALESCE(w.warehouse_wb_id, 0) <> 0
+                GROUP BY s.nmId, s.techSize_id, w.warehouse_wb_id
+            ) AS sales_window
+            GROUP BY nmId, techSize_id, office_id;"""
+
+    _SQL_INSERT_PRODUCTS_ON_THE_WAY = """INSERT INTO mp_data.a_wb_stock_transfer_products_on_the_way(nmId, 
+                                                                            qty,
+                                                                            qty_left_to_deliver,
+                                                                            size_id,
+                                                                            warehouse_from_id, 
+                                                                            warehouse_to_id)
+                VALUES (%s, %s, %s, %s, %s, %s)"""
+
+    _SQL_BLOCKED_WAREHOUSES_FOR_SKUS = """SELECT * FROM mp_data.a_wb_stock_transfer_products_on_the_way 
+                WHERE created_at > NOW() - INTERVAL 1 day;"""
+
+    _SQL_TECHSIZES_WITH_CHRTID = """SELECT nmID as nmId, 
+                        techsize, 
+                        chrtID as chrt_id 
+                FROM mp_data.a_wb_product_info_product_sizes WHERE is_archived = 0"""
+
+    SALES_ROLLUP_FULL_REBUILD_HOURS = 24 # Как часто свёртка продаж пересчитывается за всё окно
+    SALES_ROLLUP_LOOKBACK_DAYS = 3 # Сколько дней до дня водяного знака пересчитывается при каждом запуске
+
+    # Пробы версий справочников для локального кеша: результат меняется, когда меняются данные таблицы.
+    # Малые таблицы - CHECKSUM TABLE. У таблицы chrtID - контрольная сумма ровно тех столбцов, из которых строится
+    # карта (nmID, techsize, chrtID, is_archived): архивация одной карточки и разархивация другой её меняют.
+    # Это проход по таблице, но на сервере и без передачи строк - дешевле, чем читать саму карту
+    _SQL_REFERENCE_VERSION_PROBES = {
+        'size_map': "CHECKSUM TABLE mp_data.a_wb_izd_size",
+        'wb_offices_with_regions': "CHECKSUM TABLE mp_data.a_wb_stock_transfer_wb_offices",
+        'office_with_regions_map': "CHECKSUM TABLE mp_data.a_wb_stock_transfer_wb_offices",
+        'wb_supply_destinations': "CHECKSUM TABLE mp_data.a_wb_stock_transfer_wb_supply_destination_kl",
+        'techsizes_with_chrtid': """SELECT COUNT(*) AS row_count,
+                        BIT_XOR(CRC32(CONCAT_WS('#', nmID, techsize, chrtID, is_archived))) AS rows_checksum
+                FROM mp_data.a_wb_product_info_product_sizes"""}
+
+    def __init__(self, db:SyncDatabase, async_db: AsyncDatabase | None = None, reference_cache: ReferenceDataCache | None = None):
         self.db = db
+        self.async_db = async_db # Для *_async-читателей; без него они выполняются в потоке через self.db
+        self.reference_cache = reference_cache # Локальный кеш справочников; без него они читаются из БД каждый раз
         self.logger = get_logger(__name__)
+        self._stock_snapshot_lock = threading.Lock()
+        self._stock_snapshot_ready = None # None - ещё не проверяли, False - снимок недоступен, читаем a_wb_stocks
+        self._sales_rollup_lock = threading.Lock()
+        self._sales_rollup_ready = None # То же для дневной свёртки продаж
 
 
     @staticmethod
@@ -123,57 +321,57 @@ class MySQLController():
         if not task or not task.products:
             return False
 
-        try:
-            # 1. Обновляем transfer_qty_left по каждой записи
-            sql = f"""UPDATE mp_data.a_wb_stock_transfer_products_to_one_time_tasks
-                        SET transfer_qty_left = %s
-                        WHERE task_id = %s
-                        AND product_wb_id = %s
-                        AND size_id = %s;"""
+        return self.save_one_time_task_progress(tasks=[task])
 
-            params: list[tuple[int, int, int, int]] = []
+    @simple_logger(logger_name=__name__)
+    def save_one_time_task_progress(self, tasks: list[TaskWithProducts], products_on_the_way_items=None) -> bool:
+        """
+        Одной транзакцией: вставка отправленных позиций в пути, transfer_qty_left по товарам заданий
+        (пачками CASE-UPDATE вместо построчного executemany) и статусы заданий.
+        """
+        tasks = [task for task in tasks or [] if task and task.products]
+        if not tasks and not products_on_the_way_items:
+            return False
+
+        qty_rows = []
+        status_rows = []
+        for task in tasks:
             for p in task.products:
                 for s in p.sizes:
-                    params.append((
-                        int(s.transfer_qty_left_real),
-                        int(task.task_id),
-                        int(p.product_wb_id),
-                        int(s.size_id),
-                    ))
-
-            self.db.execute_many(sql, params)
+                    qty_rows.append((int(task.task_id), int(p.product_wb_id), int(s.size_id), int(s.transfer_qty_left_real)))
 
             # Проверяем завершено ли задание
             all_zero = all(int(s.transfer_qty_left_real) == 0 for p in task.products for s in p.sizes)
-
-            # Завершаем
             if all_zero:
-                sql_update_status = """UPDATE mp_data.a_wb_stock_transfer_one_time_tasks
-                                    SET task_status = 2
-                                    WHERE task_id = %s;"""
-                self.db.execute_non_query(sql_update_status, (int(task.task_id),))
-            else:
-                if task.task_status == 0:
-                    sql_update_status = """UPDATE mp_data.a_wb_stock_transfer_one_time_tasks
-                                        SET task_status = 1
-                                        WHERE task_id = %s;"""
-                    self.db.execute_non_query(sql_update_status, (int(task.task_id),))
+                status_rows.append((int(task.task_id), 2))
+            elif task.task_status == 0:
+                status_rows.append((int(task.task_id), 1))
 
+        try:
+            with self.db.transaction() as cursor:
+                if products_on_the_way_items:
+                    cursor.executemany(self._SQL_INSERT_PRODUCTS_ON_THE_WAY,
+                                       self._build_products_on_the_way_params(products_on_the_way_items))
+                self.db.bulk_update("mp_data.a_wb_stock_transfer_products_to_one_time_tasks",
+                                    key_columns=("task_id", "product_wb_id", "size_id"),
+                                    set_columns=("transfer_qty_left",),
+                                    rows=qty_rows,
+                                    cursor=cursor)
+                self.db.bulk_update("mp_data.a_wb_stock_transfer_one_time_tasks",
+                                    key_columns=("task_id",),
+                                    set_columns=("task_status",),
+                                    rows=status_rows,
+                                    cursor=cursor)
             return True
 
         except Exception as e:
-            
+            self.logger.error(f"Ошибка при записи прогресса разовых заданий: {e}")
             return False
 
     @simple_logger(logger_name=__name__)
     def get_max_stock_article(self) -> tuple[int, int] | None:
         try:
-            sql = """SELECT nmid as wb_article_id, MAX(s.quantity) AS max_qty
-                    FROM mp_data.a_wb_stocks s
-                        WHERE s.time_end >= (SELECT MAX(time_end) - INTERVAL 10 SECOND FROM mp_data.a_wb_stocks)
-                        GROUP BY wb_article_id
-                        ORDER BY max_qty DESC
-                        LIMIT 1;"""
+            sql = self._SQL_CURRENT_MAX_STOCK_ARTICLE if self.current_stock_snapshot_available() else self._SQL_MAX_STOCK_ARTICLE
             
             result = self.db.execute_query(sql)
 
@@ -217,23 +415,17 @@ class MySQLController():
         if not items:
             return False
 
-        sql = """INSERT INTO mp_data.a_wb_stock_transfer_products_on_the_way(nmId, 
-                                                                            qty,
-                                                                            qty_left_to_deliver,
-                                                                            size_id,
-                                                                            warehouse_from_id, 
-                                                                            warehouse_to_id)
-                VALUES (%s, %s, %s, %s, %s, %s)"""
-
-        params = [(int(nm), int(qty), int(qty),  int(size_id), int(w_from), int(w_to)) for nm, qty, size_id, w_from, w_to in items]
-
         try:
-            self.db.execute_many(sql, params)
+            self.db.execute_many(self._SQL_INSERT_PRODUCTS_ON_THE_WAY, self._build_products_on_the_way_params(items))
             return True
         except Exception as e:
             self.logger.error(f"Ошибка при вставке товаров в пути: {e}")
             return False
         
+    @staticmethod
+    def _build_products_on_the_way_params(items):
+        return [(int(nm), int(qty), int(qty),  int(size_id), int(w_from), int(w_to)) for nm, qty, size_id, w_from, w_to in items]
+
     @simple_logger(logger_name=__name__)
     def get_all_products_with_stocks(self):
 
@@ -322,85 +514,117 @@ class MySQLController():
         
 
     @simple_logger(logger_name=__name__)
-    def get_all_products_with_stocks_with_region(self):
+    def get_all_products_with_stocks_with_region(self, warehouse_name_id_to_wb_office_id_map=None):
 
-        warehouse_name_id_to_wb_office_id_map = self.get_warehouse_name_id_to_wb_office_id_map()
+        if self.current_stock_snapshot_available():
+            try:
+                return self.db.execute_query_rows(self._SQL_CURRENT_STOCKS_WITH_REGION)
+            except Exception:
+                return False
 
-        sql = """SELECT s.stock_id,
-                        s.nmId as wb_article_id, 
-                        s.warehouseName_id as warehouse_id,
-                        s.techSize_id as size_id,
-                        s.time_end,
-                        s.quantity as qty,
-                        awis.`size`,
-                        wh.region_id  FROM mp_data.a_wb_stocks s
-                LEFT JOIN mp_data.a_wb_warehouseName wh ON s.warehouseName_id = wh.warehouse_id
-                LEFT JOIN mp_data.a_wb_izd_size awis ON awis.size_id = s.techSize_id
-                WHERE s.time_end >= (SELECT MAX(time_end) - INTERVAL 10 SECOND FROM mp_data.a_wb_stocks)
-                AND wh.region_id IS NOT NULL;"""
+        if warehouse_name_id_to_wb_office_id_map is None:
+            warehouse_name_id_to_wb_office_id_map = self.get_warehouse_name_id_to_wb_office_id_map()
 
         try:
-            sql_result = self.db.execute_query(sql)
-
-            result_to_return = []
-
-            for entry in sql_result:
+            sql_result = self.db.execute_query_rows(self._SQL_STOCKS_WITH_REGION)
+            return self._map_stock_warehouses_to_offices(sql_result, warehouse_name_id_to_wb_office_id_map)
+        except Exception:
+            return False
 
-                wh_id = entry['warehouse_id']
-                if wh_id in warehouse_name_id_to_wb_office_id_map:
-                    entry['warehouse_id'] = warehouse_name_id_to_wb_office_id_map[wh_id]
+    @simple_logger(logger_name=__name__)
+    async def get_all_products_with_stocks_with_region_async(self, warehouse_name_id_to_wb_office_id_map=None):
+        try:
+            if await asyncio.to_thread(self.current_stock_snapshot_available):
+                return await self._execute_query_rows_async(self._SQL_CURRENT_STOCKS_WITH_REGION)
 
-                result_to_return.append(entry)
-                    
-            return result_to_return
+            if warehouse_name_id_to_wb_office_id_map is None:
+                warehouse_name_id_to_wb_office_id_map, sql_result = await asyncio.gather(
+                    self.get_warehouse_name_id_to_wb_office_id_map_async(),
+                    self._execute_query_rows_async(self._SQL_STOCKS_WITH_REGION))
+            else:
+                sql_result = await self._execute_query_rows_async(self._SQL_STOCKS_WITH_REGION)
+            return self._map_stock_warehouses_to_offices(sql_result, warehouse_name_id_to_wb_office_id_map)
         except Exception:
             return False
+
+    def current_stock_snapshot_available(self, recheck: bool = False) -> bool:
+        """
+        Проверяет снимок текущих остатков один раз за жизнь контроллера: снимок годится, если он построен
+        по текущему MAX(time_end) в a_wb_stocks. Снимок пересобирается вне прогона (процедура и событие из миграции
+        001_current_stocks_snapshot.sql), поэтому здесь только два коротких чтения.
+        Возвращает False, если снимок отстал от выгрузки или его нет - тогда читаем a_wb_stocks как раньше.
+        """
+        with self._stock_snapshot_lock:
+            if self._stock_snapshot_ready is not None and not recheck:
+                return self._stock_snapshot_ready
+            try:
+                state = (self.db.execute_query(self._SQL_CURRENT_STOCKS_STATE) or [{}])[0]
+                source_time_end = (self.db.execute_query(self._SQL_STOCKS_WATERMARK) or [{}])[0].get('max_time_end')
+                snapshot_time_end = state.get('source_time_end')
+
+                self._stock_snapshot_ready = source_time_end is not None and snapshot_time_end == source_time_end
+                if self._stock_snapshot_ready:
+                    self.logger.info("Снимок остатков актуален: %s строк, time_end=%s, собран %s",
+                                     state.get('row_count'), source_time_end, state.get('refreshed_at'))
+                else:
+                    self.logger.warning("Снимок остатков отстаёт от выгрузки (снимок %s, a_wb_stocks %s), читаем a_wb_stocks напрямую",
+                                        snapshot_time_end, source_time_end)
+            except Exception as e:
+                self.logger.warning(f"Снимок остатков недоступен, читаем a_wb_stocks напрямую: {e}")
+                self._stock_snapshot_ready = False
+            return self._stock_snapshot_ready
+
+    @staticmethod
+    def _map_stock_warehouses_to_offices(sql_result: TupleRows, warehouse_name_id_to_wb_office_id_map) -> TupleRows:
+        position = sql_result.index['warehouse_id']
+        office_map = warehouse_name_id_to_wb_office_id_map or {}
+
+        for row_number, entry in enumerate(sql_result.rows):
+
+            wh_id = entry[position]
+            if wh_id in office_map:
+                sql_result.rows[row_number] = entry[:position] + (office_map[wh_id],) + entry[position + 1:]
+
+        return sql_result
         
 
     @simple_logger(logger_name=__name__)
     def get_warehouse_name_id_to_wb_office_id_map(self):
-        sql = """SELECT warehouse_id, warehouse_wb_id 
-                FROM mp_data.a_wb_warehouseName
-                WHERE warehouse_wb_id IS NOT NULL
-                AND warehouse_wb_id != 0;"""
         try:
-            result = self.db.execute_query(sql)
-            result_dict = {}
-            for entry in result:
-                result_dict[entry['warehouse_id']] = entry['warehouse_wb_id']
-            return result_dict
+            result = self.db.execute_query(self._SQL_WAREHOUSE_NAME_ID_TO_WB_OFFICE_ID)
+            return self._build_warehouse_name_id_to_wb_office_id_map(result)
+        except Exception:
+            return False
+
+    @simple_logger(logger_name=__name__)
+    async def get_warehouse_name_id_to_wb_office_id_map_async(self):
+        try:
+            result = await self._execute_query_async(self._SQL_WAREHOUSE_NAME_ID_TO_WB_OFFICE_ID)
+            return self._build_warehouse_name_id_to_wb_office_id_map(result)
         except Exception:
             return False
+
+    @staticmethod
+    def _build_warehouse_name_id_to_wb_office_id_map(result):
+        result_dict = {}
+        for entry in result:
+            result_dict[entry['warehouse_id']] = entry['warehouse_wb_id']
+        return result_dict
     
     # Для обработки заданий по регионам основного процесса
     @simple_logger(logger_name=__name__)
     def get_products_transfers_on_the_way_with_region(self):
-        sql = """
-            SELECT
-                nmId AS wb_article_id,
-                warehouse_from_id,
-                warehouse_to_id,
-                size_id,
-                qty_left_to_deliver AS qty,
-                whto.region_id AS to_region_id,
-                whfrom.region_id AS from_region_id,
-                created_at
-            FROM mp_data.a_wb_stock_transfer_products_on_the_way
-            LEFT JOIN mp_data.a_wb_warehouseName whto
-                ON whto.warehouse_wb_id = mp_data.a_wb_stock_transfer_products_on_the_way.warehouse_to_id
-            LEFT JOIN mp_data.a_wb_warehouseName whfrom
-                ON whfrom.warehouse_wb_id = mp_data.a_wb_stock_transfer_products_on_the_way.warehouse_from_id
-            WHERE is_finished != 1
-            AND qty_left_to_deliver > 0
-            AND created_at >= NOW() - INTERVAL 14 DAY;"""
-        
         try:
-            sql_result = self.db.execute_query(sql)
-            result_to_return = []
-            for entry in sql_result:
-                result_to_return.append(entry)
+            sql_result = self.db.execute_query(self._SQL_TRANSFERS_ON_THE_WAY_WITH_REGION)
+            return list(sql_result)
+        except Exception:
+            return False
 
-            return result_to_return
+    @simple_logger(logger_name=__name__)
+    async def get_products_transfers_on_the_way_with_region_async(self):
+        try:
+            sql_result = await self._execute_query_async(self._SQL_TRANSFERS_ON_THE_WAY_WITH_REGION)
+            return list(sql_result)
         except Exception:
             return False
         
@@ -625,6 +849,9 @@ class MySQLController():
 
     @simple_logger(logger_name=__name__)
     def get_office_with_regions_map(self):
+        return self._cached_reference('office_with_regions_map', self._load_office_with_regions_map)
+
+    def _load_office_with_regions_map(self):
         sql = """
             SELECT office_id, region_id
             FROM mp_data.a_wb_stock_transfer_wb_offices
@@ -641,21 +868,18 @@ class MySQLController():
             return False
         
 
-    @simple_logger(logger_name=__name__)
-    def get_stock_availability_data(self):
-        sql = """
-            SELECT wb_article_id, size_id, warehouse_id, time_beg, time_end
-            FROM mp_data.a_wb_catalog_stocks
-            WHERE time_end > NOW() - INTERVAL 30 DAY;"""
-        try:
-            result = self.db.execute_query(sql)
-            
-            return result
-        except Exception:
-            return False
-        
+    def iter_stock_availability_days(self, batch_size=5000):
+        """
+        Генератор кортежей (wb_article_id, size_id, warehouse_id, date_beg, date_end) за 30 дней
+        через серверный курсор - история целиком в память не загружается.
+        """
+        return self.db.stream_query(self._SQL_STOCK_AVAILABILITY_DAYS, batch_size=batch_size)
+
     @simple_logger(logger_name=__name__)
     def get_size_map(self):
+        return self._cached_reference('size_map', self._load_size_map)
+
+    def _load_size_map(self):
         sql = """
             SELECT size, size_id
             FROM mp_data.a_wb_izd_size;"""
@@ -672,43 +896,97 @@ class MySQLController():
 
     @simple_logger(logger_name=__name__)
     def get_size_sales_for_warehouse(self):
-        sql = """
-            SELECT
-                s.nmId,
-                s.techSize_id,
-                w.warehouse_wb_id AS office_id,
-                COUNT(*) AS order_count
-            FROM mp_data.a_wb_sales AS s
-            LEFT JOIN mp_data.a_wb_warehouseName AS w
-                ON s.warehouseName_id = w.warehouse_id
-            WHERE s.last_update_time > NOW() - INTERVAL 30 DAY
-                AND COALESCE(s.IsStorno, 0) = 0
-                AND COALESCE(w.warehouse_wb_id, 0) <> 0
-            GROUP BY s.nmId, s.techSize_id, w.warehouse_wb_id;"""
         try:
-            result = self.db.execute_query(sql)
+            sql = self._SQL_SIZE_SALES_FROM_DAILY if self.refresh_sales_daily_rollup() else self._SQL_SIZE_SALES_FOR_WAREHOUSE
+            result = self.db.execute_query_rows(sql)
             
             return result
         except Exception:
             return False
-        
+
+    @simple_logger(logger_name=__name__)
+    async def get_size_sales_for_warehouse_async(self):
+        try:
+            rollup_ready = await asyncio.to_thread(self.refresh_sales_daily_rollup)
+            return await self._execute_query_rows_async(self._SQL_SIZE_SALES_FROM_DAILY if rollup_ready else self._SQL_SIZE_SALES_FOR_WAREHOUSE)
+        except Exception:
+            return False
+
+    def refresh_sales_daily_rollup(self, force_full: bool = False) -> bool:
+        """
+        Досчитывает дневную свёртку продаж один раз за жизнь контроллера в одной транзакции: дни, начиная
+        за SALES_ROLLUP_LOOKBACK_DAYS до дня прошлого водяного знака (или всё окно, если пора полный пересчёт).
+        Возвращает False, если свёртка недоступна (миграция 002_sales_daily_rollup.sql не применена) - тогда
+        продажи агрегируются по a_wb_sales, как раньше.
+        """
+        with self._sales_rollup_lock:
+            if self._sales_rollup_ready is not None and not force_full:
+                return self._sales_rollup_ready
+            try:
+                tables = {entry['table_name'] for entry in self.db.execute_query(self._SQL_SALES_DAILY_TABLES) or ()}
+                missing = self._SALES_DAILY_TABLES - tables
+                if missing:
+                    raise LookupError(f"нет таблиц {sorted(missing)}, примените миграцию 002_sales_daily_rollup.sql")
+
+                with self.db.transaction() as cursor:
+                    cursor.execute(self._SQL_LOCK_SALES_DAILY_STATE, (self.SALES_ROLLUP_FULL_REBUILD_HOURS,))
+                    state = cursor.fetchone()
+                    if not state:
+                        raise LookupError("нет строки состояния свёртки, примените миграцию 002_sales_daily_rollup.sql")
+                    cursor.execute(self._SQL_SALES_WATERMARK)
+                    source_last_update_time = (cursor.fetchone() or {}).get('max_last_update_time')
+
+                    window_start_date = state.get('window_start_date')
+                    full_rebuild = bool(force_full or state.get('full_rebuild_due') or state.get('watermark_date') is None)
+
+                    if source_last_update_time is None:
+                        raise ValueError("a_wb_sales пуста")
+                    window_end_date = max(state['window_end_date'], source_last_update_time.date() + timedelta(days=1))
+
+                    if not full_rebuild and state.get('source_last_update_time') == source_last_update_time:
+                        self.logger.info("Свёртка продаж актуальна (last_update_time=%s)", source_last_update_time)
+                    else:
+                        from_date = window_start_date if full_rebuild else max(
+                            state['watermark_date'] - timedelta(days=self.SALES_ROLLUP_LOOKBACK_DAYS), window_start_date)
+                        cursor.execute(self._SQL_CLEAR_SALES_DAILY_RANGE, (from_date, window_end_date))
+                        cursor.execute(self._SQL_FILL_SALES_DAILY_RANGE, (from_date, window_end_date))
+                        row_count = cursor.rowcount
+                        cursor.execute(self._SQL_PRUNE_SALES_DAILY, (window_start_date,))
+                        cursor.execute(self._SQL_UPDATE_SALES_DAILY_STATE, (source_last_update_time, full_rebuild))
+                        self.logger.info("Свёртка продаж: пересчитаны дни с %s по %s (%s), агрегатов %s, last_update_time=%s",
+                                         from_date, window_end_date, "полностью" if full_rebuild else "инкрементально",
+                                         row_count, source_last_update_time)
+                self._sales_rollup_ready = True
+            except Exception as e:
+                self.logger.warning(f"Свёртка продаж недоступна, агрегируем a_wb_sales напрямую: {e}")
+                self._sales_rollup_ready = False
+            return self._sales_rollup_ready
 
     @simple_logger(logger_name=__name__)
     def get_blocked_warehouses_for_skus(self):
-        sql = """SELECT * FROM mp_data.a_wb_stock_transfer_products_on_the_way 
-                WHERE created_at > NOW() - INTERVAL 1 day;"""
         try:
-            result = self.db.execute_query(sql)
-            result_dict = defaultdict(list)
-            for entry in result:
-                index = f"{entry['nmId']}_{entry['size_id']}" # Индекс по SKU и размеру
-                result_dict[index].append(entry['warehouse_from_id'])
-            
-            return result_dict
+            result = self.db.execute_query(self._SQL_BLOCKED_WAREHOUSES_FOR_SKUS)
+            return self._build_blocked_warehouses_for_skus(result)
         except Exception:
             return False
-        
 
+    @simple_logger(logger_name=__name__)
+    async def get_blocked_warehouses_for_skus_async(self):
+        try:
+            result = await self._execute_query_async(self._SQL_BLOCKED_WAREHOUSES_FOR_SKUS)
+            return self._build_blocked_warehouses_for_skus(result)
+        except Exception:
+            return False
+
+    @staticmethod
+    def _build_blocked_warehouses_for_skus(result):
+        result_dict = defaultdict(list)
+        for entry in result:
+            index = f"{entry['nmId']}_{entry['size_id']}" # Индекс по SKU и размеру
+            result_dict[index].append(entry['warehouse_from_id'])
+        
+        return result_dict
+        
 
     @simple_logger(logger_name=__name__)
     def update_product_transfer_entries(self, entries):
@@ -717,20 +995,18 @@ class MySQLController():
             return False
 
         try:
-            sql = """UPDATE mp_data.a_wb_stock_transfer_products_on_the_way
-                        SET qty_left_to_deliver = %s,
-                            is_finished = %s,
-                            finished_at = %s
-                        WHERE entry_id = %s;"""
-
-            params: list[tuple[int, int, str, int]] = []
+            rows: list[tuple[int, int, int, str]] = []
             for entry in entries:
-                params.append((int(entry['qty_left_to_deliver']),
-                               int(entry.get('is_finished', 0)),
-                               entry.get('finished_at', None),
-                               int(entry['entry_id'])))
+                rows.append((int(entry['entry_id']),
+                             int(entry['qty_left_to_deliver']),
+                             int(entry.get('is_finished', 0)),
+                             entry.get('finished_at', None)))
 
-            self.db.execute_many(sql, params)
+            # Все записи - одной транзакцией, пачками CASE-UPDATE
+            self.db.bulk_update("mp_data.a_wb_stock_transfer_products_on_the_way",
+                                key_columns=("entry_id",),
+                                set_columns=("qty_left_to_deliver", "is_finished", "finished_at"),
+                                rows=rows)
 
             return True
 
@@ -741,6 +1017,9 @@ class MySQLController():
 
     @simple_logger(logger_name=__name__)
     def get_wb_supply_destinations(self):
+        return self._cached_reference('wb_supply_destinations', self._load_wb_supply_destinations)
+
+    def _load_wb_supply_destinations(self):
         sql = """SELECT * FROM mp_data.a_wb_stock_transfer_wb_supply_destination_kl"""
         try:
             result = self.db.execute_query(sql)
@@ -775,6 +1054,9 @@ class MySQLController():
 
     @simple_logger(logger_name=__name__)
     def get_all_wb_offices_with_regions(self):
+        return self._cached_reference('wb_offices_with_regions', self._load_all_wb_offices_with_regions)
+
+    def _load_all_wb_offices_with_regions(self):
         sql = """SELECT * FROM mp_data.a_wb_stock_transfer_wb_offices"""
         try:
             result = self.db.execute_query(sql)
@@ -790,29 +1072,90 @@ class MySQLController():
 
     @simple_logger(logger_name=__name__)
     def get_all_techsizes_with_chrtid(self):
-        sql = """SELECT nmID as nmId, 
-                        techsize, 
-                        chrtID as chrt_id 
-                FROM mp_data.a_wb_product_info_product_sizes WHERE is_archived = 0"""
+        return self._cached_reference('techsizes_with_chrtid', self._load_all_techsizes_with_chrtid)
+
+    def _load_all_techsizes_with_chrtid(self):
         try:
-            result = self.db.execute_query(sql)
-            result_dict = {}
-            for entry in result:
+            result = self.db.execute_query_rows(self._SQL_TECHSIZES_WITH_CHRTID)
+            return self._build_techsizes_with_chrtid(result)
+        except Exception:
+            return False
 
-                nm_id = entry.get('nmId')
-                tech_size = entry.get('techsize')
-                chrt_id = entry.get('chrt_id')
+    @simple_logger(logger_name=__name__)
+    async def get_all_techsizes_with_chrtid_async(self):
+        version, hit, cached = await asyncio.to_thread(self._lookup_reference, 'techsizes_with_chrtid')
+        if hit:
+            return cached
+        try:
+            result = await self._execute_query_rows_async(self._SQL_TECHSIZES_WITH_CHRTID)
+            result_dict = self._build_techsizes_with_chrtid(result)
+        except Exception:
+            return False
+        await asyncio.to_thread(self._store_reference, 'techsizes_with_chrtid', version, result_dict)
+        return result_dict
 
-                if nm_id is None or tech_size is None or chrt_id is None:
-                    continue
+    @staticmethod
+    def _build_techsizes_with_chrtid(result):
+        result_dict = {}
+        for nm_id, tech_size, chrt_id in iter_row_fields(result, 'nmId', 'techsize', 'chrt_id'):
 
-                if nm_id not in result_dict:
-                    result_dict[nm_id] = {}
+            if nm_id is None or tech_size is None or chrt_id is None:
+                continue
 
-                result_dict[nm_id][tech_size] = chrt_id
+            if nm_id not in result_dict:
+                result_dict[nm_id] = {}
 
-            return result_dict
-        except Exception:
-            return False
-        
+            result_dict[nm_id][tech_size] = chrt_id
+
+        return result_dict
+
+    async def _execute_query_async(self, sql, params=None):
+        """
+        Запрос через AsyncDatabase, а если он не подключён - через синхронный пул в отдельном потоке.
+        В статистике запросов помечается именем вызвавшего метода, а не этого помощника.
+        """
+        with QueryInstrumentation.labelled(QueryInstrumentation.caller_label(skip=1)):
+            if self.async_db is not None:
+                return await self.async_db.execute_query(sql, params)
+            return await asyncio.to_thread(self.db.execute_query, sql, params)
+
+    def _cached_reference(self, name, loader):
+        """
+        Справочник из локального кеша, если проба версии в БД не изменилась, иначе loader() с записью в кеш.
+        """
+        version, hit, cached = self._lookup_reference(name)
+        if hit:
+            return cached
+        result = loader()
+        self._store_reference(name, version, result)
+        return result
+
+    def _lookup_reference(self, name):
+        """
+        (версия, попадание, значение). Без кеша или при ошибке пробы версия None - справочник читается из БД.
+        """
+        if self.reference_cache is None:
+            return None, False, None
+        try:
+            probe = self.db.execute_query(self._SQL_REFERENCE_VERSION_PROBES[name])
+            version = json.dumps(probe, default=str, sort_keys=True)
+        except Exception as e:
+            self.logger.warning("Проба версии справочника %s не удалась, читаем из БД: %s", name, e)
+            return None, False, None
+        hit, cached = self.reference_cache.get(name, version)
+        return version, hit, cached
+
+    def _store_reference(self, name, version, result):
+        # False - ошибка чтения, пустой справочник тоже не кешируем
+        if self.reference_cache is None or version is None or not result:
+            return
+        try:
+            self.reference_cache.put(name, version, result)
+        except Exception as e:
+            self.logger.warning("Справочник %s не сохранён в локальный кеш: %s", name, e)
 
+    async def _execute_query_rows_async(self, sql, params=None) -> TupleRows:
+        with QueryInstrumentation.labelled(QueryInstrumentation.caller_label(skip=1)):
+            if self.async_db is not None:
+                return await self.async_db.execute_query_rows(sql, params)
+            return await asyncio.to_thread(self.db.execute_query_rows, sql, params)
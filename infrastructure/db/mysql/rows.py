@@ -0,0 +1,85 @@
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+
+class TupleRows:
+    """
+    Результат запроса без словаря на каждую строку: строки - кортежи, плюс карта "колонка -> индекс".
+    Для больших выборок (остатки, продажи, chrtID), где DictCursor тратит память на повторяющиеся ключи.
+    """
+
+    __slots__ = ("columns", "index", "rows")
+
+    def __init__(self, columns: Sequence[str], rows: List[tuple]):
+        self.columns: Tuple[str, ...] = tuple(columns)
+        self.index: Dict[str, int] = {name: idx for idx, name in enumerate(self.columns)}
+        self.rows = rows
+
+    @classmethod
+    def from_cursor(cls, cursor, rows) -> "TupleRows":
+        columns = [description[0] for description in cursor.description or ()]
+        return cls(columns, list(rows))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[tuple]:
+        return iter(self.rows)
+
+    def __bool__(self) -> bool:
+        return bool(self.rows)
+
+    def __repr__(self) -> str:
+        return f"TupleRows(columns={self.columns}, rows={len(self.rows)})"
+
+    def position(self, *names: str) -> Optional[int]:
+        """
+        Индекс первой найденной колонки из names (для синонимов вроде wb_article_id / nmId).
+        """
+        for name in names:
+            if name in self.index:
+                return self.index[name]
+        return None
+
+    def getter(self, *names: str) -> Callable[[tuple], Any]:
+        position = self.position(*names)
+        if position is None:
+            return lambda row: None
+        return itemgetter(position)
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return [dict(zip(self.columns, row)) for row in self.rows]
+
+
+def iter_row_fields(rows, *columns) -> Iterator[tuple]:
+    """
+    Значения колонок columns по строкам rows - TupleRows или список словарей (DictCursor).
+    Колонка - имя или кортеж синонимов (как row.get("wb_article_id") or row.get("nmId")).
+    Строки, не являющиеся словарями, в списке словарей пропускаются.
+    """
+    if not rows:
+        return
+    names = [column if isinstance(column, tuple) else (column,) for column in columns]
+
+    if isinstance(rows, TupleRows):
+        positions = [rows.position(*synonyms) for synonyms in names]
+        if None not in positions and len(positions) > 1:
+            yield from map(itemgetter(*positions), rows.rows)
+            return
+        getters = [rows.getter(*synonyms) for synonyms in names]
+        for row in rows.rows:
+            yield tuple(getter(row) for getter in getters)
+        return
+
+    for row in rows:
+        if not isinstance(row, Mapping):
+            continue
+        values = []
+        for synonyms in names:
+            value = None
+            for name in synonyms:
+                value = row.get(name)
+                if value:
+                    break
+            values.append(value)
+        yield tuple(values)
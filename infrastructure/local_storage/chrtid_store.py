@@ -0,0 +1,87 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Set
+
+from utils.logger import get_logger
+
+
+class ChrtIdStore:
+    """
+    Локальное хранилище chrtID (sqlite): nmID + techSize -> chrtID.
+    Дополняет mp_data.a_wb_product_info_product_sizes записями, полученными из Content API.
+    Отдельно помнит nmID, которые Content API не разрешил (карточки нет или размеры не совпали с techSize),
+    чтобы не запрашивать их на каждом запуске.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.logger = get_logger("ChrtIdStore")
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS chrt_ids (
+                                  nm_id INTEGER NOT NULL,
+                                  tech_size TEXT NOT NULL,
+                                  chrt_id INTEGER NOT NULL,
+                                  updated_at REAL NOT NULL,
+                                  PRIMARY KEY (nm_id, tech_size))""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS unresolved_nm_ids (
+                                  nm_id INTEGER NOT NULL PRIMARY KEY,
+                                  checked_at REAL NOT NULL)""")
+        self._conn.commit()
+
+    def load_all(self) -> Dict[int, Dict[str, int]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT nm_id, tech_size, chrt_id FROM chrt_ids").fetchall()
+        result: Dict[int, Dict[str, int]] = {}
+        for nm_id, tech_size, chrt_id in rows:
+            result.setdefault(nm_id, {})[tech_size] = chrt_id
+        return result
+
+    def upsert_many(self, entries: Iterable[Dict[str, Any]]) -> int:
+        """
+        Записывает entries вида {'nmID', 'techSize', 'chrtID'} (формат fetch_chrtids_for_nmId_list).
+        """
+        now = time.time()
+        rows = [(int(entry["nmID"]), str(entry["techSize"]), int(entry["chrtID"]), now) for entry in entries]
+        if not rows:
+            return 0
+        with self._lock:
+            self._conn.executemany("""INSERT INTO chrt_ids (nm_id, tech_size, chrt_id, updated_at)
+                                      VALUES (?, ?, ?, ?)
+                                      ON CONFLICT(nm_id, tech_size) DO UPDATE SET
+                                          chrt_id = excluded.chrt_id,
+                                          updated_at = excluded.updated_at""", rows)
+            self._conn.executemany("DELETE FROM unresolved_nm_ids WHERE nm_id = ?", {(row[0],) for row in rows})
+            self._conn.commit()
+        self.logger.debug("В хранилище chrtID записано %s записей", len(rows))
+        return len(rows)
+
+    def recently_unresolved(self, max_age_seconds: float) -> Set[int]:
+        """
+        nmID, которые не удалось разрешить не раньше max_age_seconds назад.
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT nm_id FROM unresolved_nm_ids WHERE checked_at >= ?",
+                                      (time.time() - max_age_seconds,)).fetchall()
+        return {nm_id for nm_id, in rows}
+
+    def mark_unresolved(self, nm_ids: Iterable[int]) -> int:
+        now = time.time()
+        rows = [(int(nm_id), now) for nm_id in nm_ids]
+        if not rows:
+            return 0
+        with self._lock:
+            self._conn.executemany("""INSERT INTO unresolved_nm_ids (nm_id, checked_at) VALUES (?, ?)
+                                      ON CONFLICT(nm_id) DO UPDATE SET checked_at = excluded.checked_at""", rows)
+            self._conn.commit()
+        return len(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,112 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Tuple
+
+from utils.logger import get_logger
+
+
+class PlanCache:
+    """
+    Локальный кеш планов регулярного задания (sqlite): nmID -> отпечаток входных данных товара,
+    отпечатки его SKU и заявки, которые по нему были построены (сжатый pickle).
+    Заявки отдаются, только если отпечаток совпал и запись не старше max_age_hours.
+    """
+
+    def __init__(self, path: str, max_age_hours: float = 24):
+        self.path = path
+        self.max_age = max_age_hours * 3600
+        self.logger = get_logger("PlanCache")
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "sku_unchanged": 0, "sku_changed": 0, "stored": 0, "stored_bytes": 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS product_plans (
+                                  nm_id TEXT NOT NULL PRIMARY KEY,
+                                  fingerprint TEXT NOT NULL,
+                                  sku_fingerprints BLOB NOT NULL,
+                                  payload BLOB NOT NULL,
+                                  saved_at REAL NOT NULL)""")
+        self._conn.commit()
+
+    def lookup(self, fingerprints: Dict[Any, Tuple[str, Dict[Any, str]]]) -> Dict[Any, List[Dict[str, Any]]]:
+        """
+        fingerprints: nmID -> (отпечаток товара, {size_id: отпечаток SKU}).
+        Возвращает заявки товаров, у которых отпечаток совпал. У остальных по отпечаткам SKU считается,
+        сколько SKU изменилось с прошлого расчёта (для статистики).
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT nm_id, fingerprint, sku_fingerprints, payload, saved_at FROM product_plans").fetchall()
+        stored = {nm_id: (fingerprint, sku_fingerprints, payload, saved_at) for nm_id, fingerprint, sku_fingerprints, payload, saved_at in rows}
+
+        now = time.time()
+        hits: Dict[Any, List[Dict[str, Any]]] = {}
+        sku_unchanged = sku_changed = 0
+        for nm_id, (fingerprint, sku_fingerprints) in fingerprints.items():
+            row = stored.get(str(nm_id))
+            if row is not None and row[0] == fingerprint and now - row[3] < self.max_age:
+                try:
+                    hits[nm_id] = pickle.loads(zlib.decompress(row[2]))
+                    sku_unchanged += len(sku_fingerprints)
+                    continue
+                except Exception as e:
+                    self.logger.warning("План nmID=%s в кеше не читается, считаем заново: %s", nm_id, e)
+
+            previous = pickle.loads(row[1]) if row is not None else {}
+            for size_id, sku_fingerprint in sku_fingerprints.items():
+                if previous.get(size_id) == sku_fingerprint:
+                    sku_unchanged += 1
+                else:
+                    sku_changed += 1
+
+        with self._lock:
+            self._stats["hits"] += len(hits)
+            self._stats["misses"] += len(fingerprints) - len(hits)
+            self._stats["sku_unchanged"] += sku_unchanged
+            self._stats["sku_changed"] += sku_changed
+        return hits
+
+    def store(self, plans: Dict[Any, Tuple[str, Dict[Any, str], List[Dict[str, Any]]]]):
+        """
+        plans: nmID -> (отпечаток товара, отпечатки SKU, заявки). Заодно удаляет записи старше max_age_hours.
+        """
+        now = time.time()
+        rows = []
+        stored_bytes = 0
+        for nm_id, (fingerprint, sku_fingerprints, request_bodies) in plans.items():
+            payload = zlib.compress(pickle.dumps(request_bodies, protocol=pickle.HIGHEST_PROTOCOL))
+            stored_bytes += len(payload)
+            rows.append((str(nm_id), fingerprint, pickle.dumps(sku_fingerprints, protocol=pickle.HIGHEST_PROTOCOL), payload, now))
+
+        with self._lock:
+            self._conn.executemany("""INSERT INTO product_plans (nm_id, fingerprint, sku_fingerprints, payload, saved_at)
+                                      VALUES (?, ?, ?, ?, ?)
+                                      ON CONFLICT(nm_id) DO UPDATE SET
+                                          fingerprint = excluded.fingerprint,
+                                          sku_fingerprints = excluded.sku_fingerprints,
+                                          payload = excluded.payload,
+                                          saved_at = excluded.saved_at""", rows)
+            self._conn.execute("DELETE FROM product_plans WHERE saved_at < ?", (now - self.max_age,))
+            self._conn.commit()
+            self._stats["stored"] += len(rows)
+            self._stats["stored_bytes"] += stored_bytes
+        self.logger.debug("Планы сохранены в кеш: товаров %s, %s байт", len(rows), stored_bytes)
+
+    def invalidate(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM product_plans")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
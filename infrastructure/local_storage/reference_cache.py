@@ -0,0 +1,85 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+from utils.logger import get_logger
+
+
+class ReferenceDataCache:
+    """
+    Локальный кеш редко меняющихся справочников (sqlite): имя -> версия + сжатый pickle значения.
+    Версия - результат дешёвого запроса-пробы к исходной таблице (CHECKSUM TABLE, COUNT/MAX).
+    Значение отдаётся из кеша, только если версия совпала и запись не старше max_age_hours.
+    """
+
+    def __init__(self, path: str, max_age_hours: float = 24):
+        self.path = path
+        self.max_age = max_age_hours * 3600
+        self.logger = get_logger("ReferenceDataCache")
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stored_bytes": 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS reference_data (
+                                  name TEXT NOT NULL PRIMARY KEY,
+                                  version TEXT NOT NULL,
+                                  payload BLOB NOT NULL,
+                                  saved_at REAL NOT NULL)""")
+        self._conn.commit()
+
+    def get(self, name: str, version: str) -> Tuple[bool, Any]:
+        """
+        (True, значение), если в кеше есть свежая запись этой версии, иначе (False, None).
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT version, payload, saved_at FROM reference_data WHERE name = ?", (name,)).fetchone()
+
+        value: Optional[Any] = None
+        hit = row is not None and row[0] == version and time.time() - row[2] < self.max_age
+        if hit:
+            try:
+                value = pickle.loads(zlib.decompress(row[1]))
+            except Exception as e:
+                self.logger.warning("Запись кеша %s не читается, загружаем заново: %s", name, e)
+                hit = False
+
+        with self._lock:
+            self._stats["hits" if hit else "misses"] += 1
+        self.logger.info("Справочник %s: %s (версия %s)", name, "из локального кеша" if hit else "загружаем из БД", version)
+        return hit, value
+
+    def put(self, name: str, version: str, value: Any):
+        payload = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._conn.execute("""INSERT INTO reference_data (name, version, payload, saved_at)
+                                  VALUES (?, ?, ?, ?)
+                                  ON CONFLICT(name) DO UPDATE SET
+                                      version = excluded.version,
+                                      payload = excluded.payload,
+                                      saved_at = excluded.saved_at""", (name, version, payload, time.time()))
+            self._conn.commit()
+            self._stats["stored_bytes"] += len(payload)
+        self.logger.debug("Справочник %s сохранён в кеш: %s байт", name, len(payload))
+
+    def invalidate(self, name: Optional[str] = None):
+        with self._lock:
+            if name is None:
+                self._conn.execute("DELETE FROM reference_data")
+            else:
+                self._conn.execute("DELETE FROM reference_data WHERE name = ?", (name,))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
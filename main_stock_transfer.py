@@ -5,29 +5,53 @@ import asyncio
 import sys
 from datetime import datetime, timedelta
 from services.warehouse_processor import OneTimeTaskProcessor
-from dependencies.dependencies import (api_controller,
-                                        mysql_controller,
-                                        cookie_jar,
-                                        authorized_headers,
-                                        wb_analytics_api_key,
-                                        cookie_list,
-                                        logger)
+from dependencies.dependencies import Dependencies
 
 from services.regular_task_factory import RegularTaskFactory
 from services.delivered_supply_process import DeliveredSupplyProcessor
-from utils.logger import simple_logger
+from utils.logger import simple_logger, get_logger
 from services.wb_api_data_fetcher import WBAPIDataFetcher
 from services.db_data_fetcher import DBDataFetcher
+from services.chrtid_resolver import ChrtIdResolver
+from infrastructure.local_storage.chrtid_store import ChrtIdStore
+from infrastructure.local_storage.plan_cache import PlanCache
+from utils.config import chrtid_store_path, chrtid_resolver_settings, plan_cache_path, plan_cache_settings
 import threading
 
 START_HOUR = 9
 START_MINUTE = 0
 START_SECOND = 10
 
+# Зависимости (секреты, cookies, сессии, пулы БД) создаются в main(), а не при импорте: процессы планирования
+# (spawn) заново импортируют этот модуль как __mp_main__, и каждый из них иначе повторял бы всю инициализацию
+logger = get_logger("stock_transfer")
+
+async def fetch_quota_with_db_data(wb_api_data_fetcher, db_data_fetcher, office_id_list):
+        """
+        Квоты (aiohttp) и данные из БД грузятся одновременно на одном event loop.
+        """
+        quota_dict, _ = await asyncio.gather(wb_api_data_fetcher.fetch_quota(office_id_list=office_id_list),
+                                             db_data_fetcher.fetch_all_async())
+        return quota_dict
+
 def main():
         logger.info("Запускаем main")
 
-        db_data_fetcher = DBDataFetcher(db_controller=mysql_controller)
+        deps = Dependencies()
+        api_controller = deps.api_controller
+        mysql_controller = deps.mysql_controller
+        cookie_jar = deps.cookie_jar
+        authorized_headers = deps.authorized_headers
+        wb_analytics_api_key = deps.wb_analytics_api_key
+        cookie_list = deps.cookie_list
+        rate_limiter = deps.rate_limiter
+
+        chrtid_store = ChrtIdStore(path=chrtid_store_path)
+        plan_cache = PlanCache(path=plan_cache_path, max_age_hours=plan_cache_settings['max_age_hours']) if plan_cache_settings['enabled'] else None
+
+        db_data_fetcher = DBDataFetcher(db_controller=mysql_controller, chrtid_store=chrtid_store, autoload=False)
+        db_data_fetcher.fetch_max_stock_nmId() # Нужен для проверки cookies
+        db_data_fetcher.fetch_size_map() # Нужен процессорам до загрузки остальных данных
 
                 
         wb_api_data_fetcher = WBAPIDataFetcher(api_controller=api_controller,
@@ -35,7 +59,8 @@ def main():
                                      cookie_list=cookie_list,
                                      wb_content_api_key=wb_analytics_api_key,
                                      headers=authorized_headers,
-                                     logger=logger)
+                                     logger=logger,
+                                     rate_limiter=rate_limiter)
         
         cookie_check_result = wb_api_data_fetcher.check_cookie_list(random_present_nmid=db_data_fetcher.max_stock_nmId,
                                                                     cookie_list_original=cookie_list)
@@ -64,7 +89,15 @@ def main():
                         db_data_fetcher=db_data_fetcher,
                         cookie_jar=cookie_jar,
                         headers=authorized_headers,
-                        logger=logger)
+                        logger=logger,
+                        cookie_list=filtered_cookie_list,
+                        rate_limiter=rate_limiter)
+
+        chrtid_resolver = ChrtIdResolver(api_controller=api_controller,
+                                         wb_content_api_key=wb_analytics_api_key,
+                                         store=chrtid_store,
+                                         rate_limiter=rate_limiter,
+                                         **chrtid_resolver_settings)
 
         regular_task_factory = RegularTaskFactory(db_controller=mysql_controller, 
                                                   api_controller=api_controller,
@@ -73,7 +106,10 @@ def main():
                                                   headers=authorized_headers,
                                                   size_map=db_data_fetcher.size_map,
                                                   logger=logger,
-                                                  cookie_list=filtered_cookie_list)
+                                                  cookie_list=filtered_cookie_list,
+                                                  rate_limiter=rate_limiter,
+                                                  chrtid_resolver=chrtid_resolver,
+                                                  plan_cache=plan_cache)
         
         # office_id_list = wb_api_data_fetcher.fetch_warehouse_list(random_present_nmid=db_data_fetcher.max_stock_nmId) # Забрали список складов с сортировкой
 
@@ -88,8 +124,11 @@ def main():
         try:
                 if datetime.now().hour == START_HOUR - 1:
                         quota_dict = {office_id: {'src':1000000, 'dst':1000000} for office_id in office_id_list}
+                        asyncio.run(db_data_fetcher.fetch_all_async())
                 else:
-                        quota_dict = asyncio.run(wb_api_data_fetcher.fetch_quota(office_id_list=office_id_list))
+                        quota_dict = asyncio.run(fetch_quota_with_db_data(wb_api_data_fetcher=wb_api_data_fetcher,
+                                                                          db_data_fetcher=db_data_fetcher,
+                                                                          office_id_list=office_id_list))
 
                 regular_task_factory.quota_dict = quota_dict # Передали квоты в фабрику заданий
 
@@ -128,6 +167,12 @@ def main():
                 logger.debug('Запрашиваем квоты еще разок перед отключением скрипта')
                 quota_dict_unmocked = asyncio.run(wb_api_data_fetcher.fetch_quota(office_id_list=office_id_list)) 
                 mysql_controller.log_warehouse_state(quota_dict_unmocked) # Залогировали состояние складов по квотам
+                logger.info("Статистика пула соединений MySQL: %s", mysql_controller.db.pool.stats())
+                mysql_controller.db.instrumentation.log_summary(logger)
+                if mysql_controller.reference_cache is not None:
+                        logger.info("Локальный кеш справочников: %s", mysql_controller.reference_cache.stats())
+                if plan_cache is not None:
+                        logger.info("Кеш планов регулярного задания: %s", plan_cache.stats())
                 
 
 
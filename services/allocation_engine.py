@@ -0,0 +1,290 @@
+import math
+from collections import defaultdict
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from models.regular_tasks.regular_tasks import RegularTaskForSize, RegionStock
+from services.session_topology import SessionTopology
+from utils.logger import get_logger
+
+# Регионы задания в порядке RegularTaskForSize.region_data: столбцы матриц движка
+_REGION_TEMPLATE = RegularTaskForSize(nmId=0, size="", tech_size_id=0, total_stock_for_product=0).region_data
+REGION_IDS: Tuple[int, ...] = tuple(_REGION_TEMPLATE.keys())
+REGION_ATTRIBUTES: Tuple[str, ...] = tuple(region.attribute for region in _REGION_TEMPLATE.values())
+REGION_NAMES: Tuple[str, ...] = tuple(region.name for region in _REGION_TEMPLATE.values())
+_REGION_COLUMN: Dict[int, int] = {region_id: column for column, region_id in enumerate(REGION_IDS)}
+
+
+def _floor_share(totals: np.ndarray, share) -> np.ndarray:
+    """
+    math.floor(total * share) для всех totals сразу, с той же арифметикой, что в Python:
+    int - точно, Decimal (DECIMAL из MySQL) - точно через дробь, float - в float64, как int * float.
+    """
+    if isinstance(share, (bool, int)):
+        return totals * int(share)
+    if isinstance(share, Decimal):
+        numerator, denominator = share.as_integer_ratio()
+        return (totals * numerator) // denominator
+    if isinstance(share, float):
+        return np.floor(totals * share).astype(np.int64)
+    raise TypeError(f"Неподдерживаемый тип доли: {type(share).__name__}")
+
+
+class AllocationPlan:
+    """
+    Результат векторного прохода по всем SKU (артикул + размер): цели, минимумы, amount_to_deliver и is_below_min
+    посчитаны матрицами (SKU x регион). Последовательное жадное распределение по складам-донорам (allocate)
+    выполняется только для SKU, у которых есть регион-получатель ниже минимума и регион-донор с излишком.
+    """
+
+    def __init__(self, engine: "VectorizedAllocationEngine", products: Sequence[Dict[str, Any]],
+                 rows_by_product: Dict[int, List[Tuple[Any, Dict[str, Any], int]]],
+                 before: np.ndarray, totals: np.ndarray, present: np.ndarray,
+                 target_stock: np.ndarray, min_stock: np.ndarray, amount_to_deliver: np.ndarray,
+                 is_below_min: np.ndarray, active: np.ndarray, topology: SessionTopology):
+        self.engine = engine
+        self.products = products
+        self.rows_by_product = rows_by_product # Индекс товара -> [(size_id, size_data, строка матриц)]
+        self.before = before
+        self.totals = totals
+        self.present = present
+        self.target_stock = target_stock
+        self.min_stock = min_stock
+        self.amount_to_deliver = amount_to_deliver
+        self.is_below_min = is_below_min
+        self.active = active
+        self.topology = topology
+
+    def covers(self, product_index: int) -> bool:
+        """
+        False - товар не удалось упаковать в матрицы (нестандартные данные), его считает старый путь.
+        """
+        return product_index in self.rows_by_product
+
+    def allocate(self, product_index: int):
+        """
+        (задания по размерам с to_process, остатки складов-источников по размерам) - как _process_single_product.
+        """
+        product = self.products[product_index]
+        current_tasks_for_product = []
+        product_stocks_by_size_with_warehouse = {}
+
+        for size_id, size_data, row in self.rows_by_product[product_index]:
+            if not self.active[row]:
+                continue
+            task_for_size = self._allocate_size(product, size_id, size_data, row, product_stocks_by_size_with_warehouse)
+            if task_for_size is not None:
+                current_tasks_for_product.append(task_for_size)
+
+        return current_tasks_for_product, product_stocks_by_size_with_warehouse
+
+    def _allocate_size(self, product, size_id, size_data, row, product_stocks_by_size_with_warehouse):
+        engine = self.engine
+        nm_id = product.get("wb_article_id")
+        tech_size_id = size_data.get("size_id")
+        regions = size_data.get("regions", {})
+        present = self.present[row].tolist()
+        after = self.before[row].tolist()
+        target_stock = self.target_stock[row].tolist()
+        amount_to_deliver = self.amount_to_deliver[row].tolist()
+        is_below_min = self.is_below_min[row].tolist()
+        availability_days = size_data.get('availability_days_by_warehouse', {}) or {}
+        stock = [dict(regions[REGION_IDS[column]].get("warehouses", {}) or {}) if present[column] else {}
+                 for column in range(len(REGION_IDS))]
+        sent = [{} for _ in REGION_IDS]
+        size_name = engine.size_map_reversed.get(size_id, str(size_id))
+        topology = self.topology
+        dst_quota_by_region = topology.dst_quota_by_region
+        to_process = False
+
+        for dst_region_id in topology.region_dst_order:
+            dst_column = _REGION_COLUMN.get(dst_region_id)
+            if dst_column is None:
+                continue
+            if dst_quota_by_region.get(dst_region_id, 0) <= 0:
+                continue
+
+            amount_to_add = amount_to_deliver[dst_column]
+            if not is_below_min[dst_column] or amount_to_add <= 0:
+                continue
+
+            if not topology.can_receive(dst_region_id, nm_id, size_id):
+                continue
+
+            for src_region_id in topology.donor_regions(dst_region_id):
+                if amount_to_add <= 0:
+                    break
+                src_column = _REGION_COLUMN.get(src_region_id)
+                if src_column is None:
+                    continue
+
+                allowed = topology.src_warehouses_for_sku(src_region_id, nm_id, tech_size_id)
+                if not any(availability_days.get(office_id, 0) >= engine.min_availability_days for office_id in allowed):
+                    continue
+
+                transferrable_amount = max(0, after[src_column] - target_stock[src_column])
+                src_stock = stock[src_column]
+                total_stock_in_allowed = sum(src_stock[office_id] for office_id in allowed if office_id in src_stock)
+                amount_to_be_sent = min(total_stock_in_allowed, transferrable_amount, amount_to_add)
+                if amount_to_be_sent <= 0:
+                    continue
+
+                # Жадно по складам донора в порядке приоритета - как _distribute_to_warehouses
+                used = 0
+                for office_id in allowed:
+                    if amount_to_be_sent <= 0:
+                        break
+                    qty_in_office = src_stock.get(office_id)
+                    if not qty_in_office:
+                        continue
+                    qty_to_transfer = min(qty_in_office, amount_to_be_sent)
+                    if qty_to_transfer <= 0:
+                        continue
+
+                    if office_id not in product_stocks_by_size_with_warehouse:
+                        product_stocks_by_size_with_warehouse[office_id] = defaultdict(dict)
+                    product_stocks_by_size_with_warehouse[office_id][size_name] = qty_in_office
+
+                    sent[dst_column][office_id] = sent[dst_column].get(office_id, 0) + qty_to_transfer
+                    src_stock[office_id] -= qty_to_transfer
+                    after[src_column] -= qty_to_transfer
+                    amount_to_be_sent -= qty_to_transfer
+                    used += qty_to_transfer
+                    to_process = True
+
+                amount_to_add -= used
+
+        if not to_process:
+            return None
+        return self._build_task(product, size_id, size_data, row, stock, after, sent)
+
+    def _build_task(self, product, size_id, size_data, row, stock, after, sent) -> RegularTaskForSize:
+        """
+        RegularTaskForSize с теми же полями, что собирает _build_task_for_size + _fill_region_attributes,
+        только для размеров, по которым есть перемещения.
+        """
+        engine = self.engine
+        task_for_size = RegularTaskForSize(nmId=product.get("wb_article_id"),
+                                           size=size_data.get("size_name"),
+                                           tech_size_id=size_data.get("size_id"),
+                                           total_stock_for_product=size_data.get("total_qty", 0),
+                                           availability_days_by_warehouse=size_data.get('availability_days_by_warehouse', {}) or {},
+                                           availability_days_by_region=size_data.get('availability_days_by_region', {}) or {},
+                                           orders_by_warehouse=size_data.get('orders_by_warehouse', {}) or {},
+                                           orders_by_region=size_data.get('orders_by_region', {}) or {},
+                                           region_data={})
+        for column, region_id in enumerate(REGION_IDS):
+            region_obj = RegionStock(name=REGION_NAMES[column], id=region_id, attribute=REGION_ATTRIBUTES[column])
+            if self.present[row, column]:
+                region_obj.warehouses = list(stock[column].keys())
+                region_obj.stock_by_warehouse = [{wh: qty} for wh, qty in stock[column].items()]
+                region_obj.stock_by_region_before = int(self.before[row, column])
+                region_obj.stock_by_region_after = after[column]
+                region_obj.target_share = engine.target_shares[column]
+                region_obj.min_share = engine.min_shares[column]
+                region_obj.target_stock_by_region = int(self.target_stock[row, column])
+                region_obj.min_stock_by_region = int(self.min_stock[row, column])
+                region_obj.min_qty_fixed = engine.min_qty_fixed[column]
+                region_obj.amount_to_deliver = int(self.amount_to_deliver[row, column])
+                region_obj.is_below_min = bool(self.is_below_min[row, column])
+            region_obj.stocks_to_be_sent_to_warehouse_dict = sent[column]
+            task_for_size.region_data[region_id] = region_obj
+        task_for_size.to_process = True
+        return task_for_size
+
+
+class VectorizedAllocationEngine:
+    """
+    Расчёт перемещений регулярного задания на NumPy: остатки по регионам всех SKU упаковываются в матрицы,
+    доли из строки задания - в векторы по регионам. Даёт те же задания по размерам (а значит и те же тела заявок),
+    что _process_single_product, но без RegularTaskForSize на каждый размер и без вложенных циклов для SKU,
+    которым нечего перемещать.
+    """
+
+    def __init__(self, task_row: Dict[str, Any], size_map: Dict[str, int], min_availability_days: int = 1, logger=None):
+        self.logger = logger or get_logger("VectorizedAllocationEngine")
+        self.size_map_reversed = {v: k for k, v in (size_map or {}).items()}
+        self.min_availability_days = min_availability_days
+        self.target_shares = [task_row.get(f"target_{attribute}", 0) or 0 for attribute in REGION_ATTRIBUTES]
+        self.min_shares = [task_row.get(f"min_{attribute}", 0) or 0 for attribute in REGION_ATTRIBUTES]
+        self.min_qty_fixed = [task_row.get(f"min_qty_to_transfer_{attribute}", 0) or 0 for attribute in REGION_ATTRIBUTES]
+
+    def prepare(self, products: Sequence[Dict[str, Any]], topology: SessionTopology) -> Optional[AllocationPlan]:
+        """
+        Векторный проход по всем товарам. None - доли задания не числовые, считать надо старым путём.
+        Порядки, квоты, склады регионов и блокировки берутся из топологии сессии.
+        """
+        rows_by_product: Dict[int, List[Tuple[Any, Dict[str, Any], int]]] = {}
+        before_rows: List[List[int]] = []
+        present_rows: List[List[bool]] = []
+        totals: List[int] = []
+        region_count = len(REGION_IDS)
+
+        for product_index, product in enumerate(products):
+            try:
+                product_rows, product_before, product_present, product_totals = [], [], [], []
+                for size_id, size_data in product.get("sizes", {}).items():
+                    total = size_data.get("total_qty", 0)
+                    if type(total) is not int:
+                        raise TypeError(f"total_qty={total!r}")
+                    before = [0] * region_count
+                    present = [False] * region_count
+                    for region_id, region_data in size_data.get("regions", {}).items():
+                        column = _REGION_COLUMN.get(region_id)
+                        if column is None:
+                            continue
+                        region_total = region_data.get("total_qty", 0)
+                        if type(region_total) is not int:
+                            raise TypeError(f"region total_qty={region_total!r}")
+                        before[column] = region_total
+                        present[column] = True
+                    product_rows.append((size_id, size_data, len(totals) + len(product_totals)))
+                    product_before.append(before)
+                    product_present.append(present)
+                    product_totals.append(total)
+            except Exception as e:
+                self.logger.debug("Товар %s считается без векторизации: %s", product.get("wb_article_id") if isinstance(product, dict) else None, e)
+                continue
+            rows_by_product[product_index] = product_rows
+            before_rows.extend(product_before)
+            present_rows.extend(product_present)
+            totals.extend(product_totals)
+
+        before = np.array(before_rows, dtype=np.int64).reshape(-1, region_count)
+        present = np.array(present_rows, dtype=bool).reshape(-1, region_count)
+        total_column = np.array(totals, dtype=np.int64).reshape(-1, 1)
+
+        try:
+            target_stock = np.hstack([_floor_share(total_column, share) for share in self.target_shares]) if totals else before.copy()
+            min_stock = np.hstack([_floor_share(total_column, share) for share in self.min_shares]) if totals else before.copy()
+            min_qty_floor = np.array([math.floor(value) for value in self.min_qty_fixed], dtype=np.int64)
+        except (TypeError, ValueError, OverflowError) as e:
+            self.logger.warning("Доли задания не числовые, распределение считается без векторизации: %s", e)
+            return None
+
+        target_stock = np.where(present, target_stock, 0)
+        min_stock = np.where(present, min_stock, 0)
+        # floor(max(0, target - before, min_qty - before)) = max(0, target - before, floor(min_qty) - before)
+        amount_to_deliver = np.where(present,
+                                     np.maximum(0, np.maximum(target_stock - before, min_qty_floor - before)), 0)
+        is_below_min = present & (before <= min_stock) & (amount_to_deliver > 0)
+
+        dst_ordered = set(topology.region_dst_order)
+        src_ordered = set(topology.region_src_order)
+        dst_ok = np.array([topology.dst_quota_by_region.get(region_id, 0) > 0 and region_id in dst_ordered for region_id in REGION_IDS])
+        src_ok = np.array([topology.src_quota_by_region.get(region_id, 0) > 0 and region_id in src_ordered for region_id in REGION_IDS])
+
+        # Излишек донора не растёт по ходу распределения, поэтому SKU без получателя ниже минимума
+        # или без другого региона с излишком заведомо ничего не перемещают
+        receivers = is_below_min & dst_ok
+        donors = present & (before > target_stock) & src_ok
+        other_donors = donors.sum(axis=1, keepdims=True) - donors > 0
+        active = (receivers & other_donors).any(axis=1)
+
+        self.logger.info("Векторный расчёт: SKU %s, к распределению %s, товаров без векторизации %s",
+                         len(totals), int(active.sum()), len(products) - len(rows_by_product))
+
+        return AllocationPlan(self, products, rows_by_product, before, total_column.ravel(), present,
+                              target_stock, min_stock, amount_to_deliver, is_below_min, active, topology)
@@ -0,0 +1,103 @@
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Optional, Sequence, Set, Tuple
+
+AvailabilityKey = Tuple[int, int, int] # (wb_article_id, size_id, warehouse_id)
+
+
+class AvailabilityIndex(dict):
+    """
+    (article, size, warehouse) -> битовая маска дней наличия (int).
+    Бит i - день anchor - i дней: за 30 дней это одно машинное слово вместо множества из 30 объектов date.
+    Дни наличия ключа - mask.bit_count(), объединение по складам региона - побитовое ИЛИ масок.
+    """
+
+    def __init__(self, anchor: Optional[date] = None):
+        super().__init__()
+        self.anchor = anchor or date.today()
+
+    def days(self, key: AvailabilityKey) -> Set[date]:
+        """
+        Дни наличия ключа датами (для отладки и сверки с источником).
+        """
+        mask = self.get(key, 0)
+        return {self.anchor - timedelta(days=bit) for bit in range(mask.bit_length()) if mask >> bit & 1}
+
+
+def days_count(mask: Optional[int]) -> int:
+    return mask.bit_count() if mask else 0
+
+
+def union_days_count(masks: Iterable[Optional[int]]) -> int:
+    """
+    Число различных дней наличия по нескольким ключам (например, по складам региона).
+    """
+    union = 0
+    for mask in masks:
+        if mask:
+            union |= mask
+    return union.bit_count()
+
+
+class AvailabilityIndexBuilder:
+    """
+    Индекс дней наличия по ключу (article, size, warehouse), собираемый построчно.
+    Строки не копятся: каждый интервал сразу превращается в диапазон бит маски своего ключа,
+    поэтому память зависит только от числа ключей. Интервал позже anchor сдвигает все маски (редкий случай).
+    """
+
+    def __init__(self, anchor: Optional[date] = None):
+        self.index = AvailabilityIndex(anchor)
+        self.rows_seen = 0
+        self.rows_skipped = 0
+
+    def add(self, wb_article_id, size_id, warehouse_id, day_beg, day_end):
+        self.rows_seen += 1
+        if day_beg is None or day_end is None:
+            self.rows_skipped += 1
+            return
+        try:
+            key = (int(wb_article_id), int(size_id), int(warehouse_id))
+        except (TypeError, ValueError):
+            self.rows_skipped += 1
+            return
+
+        day_beg = self._to_date(day_beg)
+        day_end = self._to_date(day_end)
+        index = self.index
+        if day_end > index.anchor:
+            self._move_anchor(day_end)
+
+        mask = index.get(key, 0)
+        if day_end >= day_beg:
+            low = (index.anchor - day_end).days
+            mask |= ((1 << ((day_end - day_beg).days + 1)) - 1) << low
+        index[key] = mask
+
+    def add_rows(self, rows: Iterable[Sequence[Any]]) -> "AvailabilityIndexBuilder":
+        """
+        Поток кортежей (wb_article_id, size_id, warehouse_id, day_beg, day_end).
+        """
+        add = self.add
+        for row in rows:
+            add(row[0], row[1], row[2], row[3], row[4])
+        return self
+
+    def _move_anchor(self, anchor: date):
+        shift = (anchor - self.index.anchor).days
+        index = self.index
+        for key, mask in index.items():
+            index[key] = mask << shift
+        index.anchor = anchor
+
+    @staticmethod
+    def _to_date(value) -> date:
+        if isinstance(value, datetime):
+            return value.date()
+        if isinstance(value, date):
+            return value
+        return datetime.fromisoformat(str(value)).date()
+
+
+def build_availability_index(rows: Iterable[Sequence[Any]],
+                             builder: Optional[AvailabilityIndexBuilder] = None) -> Dict[AvailabilityKey, int]:
+    return (builder or AvailabilityIndexBuilder()).add_rows(rows).index
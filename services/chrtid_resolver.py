@@ -0,0 +1,209 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from infrastructure.api.rate_limiter import RateLimiter, parse_retry_after
+from infrastructure.api.sync_controller import SyncAPIController
+from infrastructure.local_storage.chrtid_store import ChrtIdStore
+from utils.config import rate_limits, wb_content_api_url
+from utils.logger import get_logger
+
+
+CONTENT_API_IDENTITY = "content_api" # Content API ходит по API-ключу, а не по cookies - одна учётка на всё
+
+
+class ChrtIdResolver:
+    """
+    Дозапрашивает недостающие chrtID в Content API (/content/v2/get/cards/list).
+    Фильтр cards/list принимает один nmID, поэтому:
+      - немного недостающих nmID - точечные запросы параллельно, под ограничителем скорости;
+      - много - обход каталога страницами по page_size карточек до тех пор, пока все не найдутся
+        (но не дольше sweep_time_budget секунд).
+    Найденное записывается в ChrtIdStore и сразу доливается в переданный словарь chrtID. nmID, по которым Content API
+    ответил, но chrtID так и не нашлись (архивные карточки, размеры с другим techSize), хранилище помнит
+    unresolved_ttl_hours часов - всё это время они не запрашиваются.
+    """
+
+    def __init__(self,
+                 api_controller: SyncAPIController,
+                 wb_content_api_key,
+                 store: Optional[ChrtIdStore] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 page_size: int = 100,
+                 max_concurrency: int = 4,
+                 catalog_sweep_threshold: int = 20,
+                 max_attempts: int = 3,
+                 max_pages: int = 1000,
+                 sweep_time_budget: float = 120.0,
+                 unresolved_ttl_hours: float = 24.0):
+        self.api_controller = api_controller
+        self.wb_content_api_key = wb_content_api_key
+        self.store = store
+        self.rate_limiter = rate_limiter or RateLimiter(endpoint_limits=rate_limits)
+        self.page_size = page_size
+        self.max_concurrency = max_concurrency
+        self.catalog_sweep_threshold = catalog_sweep_threshold
+        self.max_attempts = max_attempts
+        self.max_pages = max_pages
+        self.sweep_time_budget = sweep_time_budget
+        self.unresolved_ttl_hours = unresolved_ttl_hours
+        self.logger = get_logger("ChrtIdResolver")
+        self._identity_registered = False
+
+    def find_missing(self, wanted: Dict[int, Set[str]], chrtid_dict: Dict[int, Dict[str, int]]) -> Set[int]:
+        """
+        nmID, у которых хотя бы для одного нужного techSize нет chrtID.
+        """
+        missing = set()
+        for nm_id, tech_sizes in wanted.items():
+            known = chrtid_dict.get(nm_id, {})
+            if any(tech_size not in known for tech_size in tech_sizes):
+                missing.add(nm_id)
+        return missing
+
+    def resolve_missing(self, wanted: Dict[int, Set[str]], chrtid_dict: Dict[int, Dict[str, int]]) -> int:
+        """
+        Дозаполняет chrtid_dict (на месте) для nmID из wanted. Возвращает число добавленных chrtID.
+        """
+        missing = self.find_missing(wanted, chrtid_dict)
+        if missing and self.store is not None:
+            unresolved = missing & self.store.recently_unresolved(self.unresolved_ttl_hours * 3600)
+            if unresolved:
+                self.logger.info("Пропускаем %s nmID, не разрешённых Content API за последние %s ч",
+                                 len(unresolved), self.unresolved_ttl_hours)
+                missing -= unresolved
+        if not missing:
+            return 0
+
+        self.logger.info("Не хватает chrtID для %s nmID, дозапрашиваем в Content API", len(missing))
+        checked: Set[int] = set()
+        if len(missing) > self.catalog_sweep_threshold:
+            entries = self.sweep_catalog(missing, checked=checked)
+        else:
+            entries = self.fetch_entries(missing, checked=checked)
+
+        added = 0
+        for entry in entries:
+            sizes = chrtid_dict.setdefault(entry["nmID"], {})
+            if entry["techSize"] not in sizes:
+                added += 1
+            sizes[entry["techSize"]] = entry["chrtID"]
+
+        still_missing = self.find_missing(wanted, chrtid_dict)
+        if self.store is not None:
+            self.store.upsert_many(entries)
+            # Ошибки запроса и недоделанный обход не запоминаем - такие nmID спросим на следующем запуске
+            self.store.mark_unresolved(still_missing & checked)
+        self.logger.info("Добавлено chrtID: %s, nmID без chrtID после дозапроса: %s", added, len(still_missing))
+        return added
+
+    def fetch_entries(self, nm_id_list: Iterable[int], checked: Optional[Set[int]] = None) -> List[Dict[str, Any]]:
+        """
+        Точечные запросы по nmID параллельно. Ошибка по одному nmID не прерывает остальные.
+        В checked добавляются nmID, по которым Content API ответил.
+        """
+        nm_id_list = list(nm_id_list)
+        self._ensure_identity()
+        entries: List[Dict[str, Any]] = []
+        with ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="chrtid_resolver") as executor:
+            futures = {executor.submit(self._fetch_page, {"withPhoto": -1, "nmID": nm_id}, {"limit": 1}): nm_id
+                       for nm_id in nm_id_list}
+            for future in as_completed(futures):
+                page = future.result()
+                if page is None:
+                    self.logger.warning("Не удалось получить карточку nmID=%s", futures[future])
+                    continue
+                if checked is not None:
+                    checked.add(futures[future])
+                entries.extend(self._extract_entries(page.get("cards", [])))
+        return entries
+
+    def sweep_catalog(self, nm_ids: Set[int], checked: Optional[Set[int]] = None) -> List[Dict[str, Any]]:
+        """
+        Обход каталога страницами. Курсор следующей страницы берётся из ответа на предыдущую,
+        поэтому страницы идут последовательно; обход заканчивается, как только найдены все nm_ids,
+        или по истечении sweep_time_budget секунд. Если каталог пройден до конца, nm_ids попадают в checked.
+        """
+        remaining = set(nm_ids)
+        entries: List[Dict[str, Any]] = []
+        cursor: Dict[str, Any] = {"limit": self.page_size}
+        deadline = time.monotonic() + self.sweep_time_budget
+        completed = False
+
+        for _ in range(self.max_pages):
+            if time.monotonic() >= deadline:
+                self.logger.warning("Обход каталога остановлен по времени (%s сек), не найдено nmID: %s",
+                                    self.sweep_time_budget, len(remaining))
+                break
+            page = self._fetch_page({"withPhoto": -1}, cursor)
+            if page is None:
+                self.logger.warning("Обход каталога прерван, не найдено nmID: %s", len(remaining))
+                break
+
+            cards = page.get("cards", [])
+            for entry in self._extract_entries(cards):
+                if entry["nmID"] in nm_ids:
+                    entries.append(entry)
+                    remaining.discard(entry["nmID"])
+
+            response_cursor = page.get("cursor", {})
+            last_nm_id = response_cursor.get("nmID")
+            if not remaining or not last_nm_id or response_cursor.get("total", 0) < self.page_size:
+                completed = True
+                break
+
+            cursor = {"limit": self.page_size, "nmID": last_nm_id}
+            if "updatedAt" in response_cursor:
+                cursor["updatedAt"] = response_cursor["updatedAt"]
+
+        if completed and checked is not None:
+            checked.update(nm_ids)
+        return entries
+
+    def _fetch_page(self, card_filter: Dict[str, Any], cursor: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        identity = self._ensure_identity()
+        req_body = {"settings": {"filter": card_filter, "cursor": cursor}}
+
+        for attempt in range(1, self.max_attempts + 1):
+            self.rate_limiter.acquire(identity, 'cards')
+            response = self.api_controller.request(base_url=wb_content_api_url,
+                                                   method="POST",
+                                                   endpoint="/content/v2/get/cards/list",
+                                                   json=req_body,
+                                                   identity=identity)
+            status = getattr(response, "status_code", None)
+            headers = getattr(response, "headers", None) or {}
+            self.rate_limiter.on_response(identity, 'cards', status,
+                                          retry_after=parse_retry_after(headers.get("Retry-After")))
+
+            if status is not None and 200 <= status < 300:
+                try:
+                    return response.json()
+                except ValueError as e:
+                    self.logger.error("Некорректный JSON от cards/list: %s", e)
+                    return None
+            if status not in RateLimiter.THROTTLE_STATUSES and status is not None:
+                self.logger.error("cards/list вернул статус %s для фильтра %s", status, card_filter)
+                return None
+            self.logger.warning("cards/list: статус %s, попытка %s из %s", status, attempt, self.max_attempts)
+        return None
+
+    def _ensure_identity(self) -> str:
+        if not self._identity_registered:
+            headers = {'Authorization': self.wb_content_api_key['API key'],
+                       'Content-Type': 'application/json'}
+            self.api_controller.register_identity(CONTENT_API_IDENTITY, headers=headers)
+            self._identity_registered = True
+        return CONTENT_API_IDENTITY
+
+    @staticmethod
+    def _extract_entries(cards: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        entries = []
+        for card in cards:
+            nm_id = card.get("nmID")
+            for size in card.get("sizes", []):
+                tech_size = size.get("techSize")
+                chrt_id = size.get("chrtID")
+                if nm_id and tech_size and chrt_id:
+                    entries.append({'nmID': nm_id, 'techSize': tech_size, 'chrtID': chrt_id})
+        return entries
@@ -0,0 +1,125 @@
+import asyncio
+import time
+from collections.abc import Sized
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.logger import get_logger
+
+
+@dataclass
+class Dataset:
+    name: str
+    loader: Callable[[], Any] # Синхронная функция или корутинная функция без аргументов
+    row_count: Optional[Callable[[Any], int]] = None # Как считать строки результата (по умолчанию len())
+
+
+@dataclass
+class DatasetStats:
+    name: str
+    status: str = "pending" # ok / error
+    latency: float = 0.0
+    rows: int = 0
+    error: Optional[BaseException] = field(default=None, repr=False)
+
+
+class DatasetLoader:
+    """
+    Загружает набор независимых датасетов параллельно (не больше max_workers одновременно).
+    Ошибка одного датасета не прерывает остальные: после завершения всех поднимается первая ошибка.
+    """
+
+    def __init__(self, datasets: List[Dataset], max_workers: int = 8, logger=None):
+        self.datasets = {dataset.name: dataset for dataset in datasets}
+        if len(self.datasets) != len(datasets):
+            raise ValueError("Имена датасетов должны быть уникальными")
+        self.max_workers = max_workers
+        self.logger = logger or get_logger("DatasetLoader")
+        self.stats: Dict[str, DatasetStats] = {}
+        self.elapsed = 0.0
+
+    def run(self) -> Dict[str, DatasetStats]:
+        """
+        Синхронная загрузка в пуле потоков (корутинные загрузчики не поддерживаются - см. run_async).
+        """
+        self.stats = {name: DatasetStats(name=name) for name in self.datasets}
+        start_time = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="dataset_loader") as executor:
+            list(executor.map(self._run_sync, self.datasets))
+
+        return self._finish(start_time)
+
+    async def run_async(self) -> Dict[str, DatasetStats]:
+        """
+        Загрузка на текущем event loop: корутинные загрузчики ожидаются напрямую,
+        синхронные уходят в потоки (не больше max_workers одновременно).
+        """
+        self.stats = {name: DatasetStats(name=name) for name in self.datasets}
+        start_time = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        async def run_one(name):
+            loader = self.datasets[name].loader
+            if asyncio.iscoroutinefunction(loader):
+                await self._measure_async(name, loader)
+            else:
+                async with semaphore:
+                    await asyncio.to_thread(self._run_sync, name)
+
+        await asyncio.gather(*(run_one(name) for name in self.datasets))
+
+        return self._finish(start_time)
+
+    def _run_sync(self, name: str):
+        start_time = time.perf_counter()
+        try:
+            result = self.datasets[name].loader()
+            self._record(name, result, start_time)
+        except Exception as e:
+            self._record_error(name, e, start_time)
+
+    async def _measure_async(self, name: str, loader):
+        start_time = time.perf_counter()
+        try:
+            result = await loader()
+            self._record(name, result, start_time)
+        except Exception as e:
+            self._record_error(name, e, start_time)
+
+    def _record(self, name: str, result: Any, start_time: float):
+        stats = self.stats[name]
+        stats.latency = time.perf_counter() - start_time
+        stats.rows = self._count_rows(self.datasets[name], result)
+        stats.status = "ok"
+
+    def _record_error(self, name: str, error: Exception, start_time: float):
+        stats = self.stats[name]
+        stats.latency = time.perf_counter() - start_time
+        stats.status = "error"
+        stats.error = error
+        self.logger.error("Датасет %s не загружен: %s", name, error)
+
+    @staticmethod
+    def _count_rows(dataset: Dataset, result: Any) -> int:
+        if dataset.row_count is not None:
+            return dataset.row_count(result)
+        if isinstance(result, Sized):
+            return len(result)
+        return 0 if result is None or result is False else 1
+
+    def _finish(self, start_time: float) -> Dict[str, DatasetStats]:
+        self.elapsed = time.perf_counter() - start_time
+        total_latency = sum(stats.latency for stats in self.stats.values())
+        slowest = max(self.stats.values(), key=lambda stats: stats.latency, default=None)
+
+        for stats in sorted(self.stats.values(), key=lambda stats: stats.latency, reverse=True):
+            self.logger.info("Датасет %-28s %-7s %8.3f сек %8s строк", stats.name, stats.status, stats.latency, stats.rows)
+        self.logger.info("Загрузка %s датасетов: %.2f сек (сумма запросов %.2f сек, самый долгий - %s)",
+                         len(self.stats), self.elapsed, total_latency, slowest.name if slowest else None)
+
+        for name in self.datasets:
+            if self.stats[name].error is not None:
+                raise self.stats[name].error
+        return self.stats
@@ -1,17 +1,22 @@
 from infrastructure.db.mysql.mysql_controller import MySQLController
+from infrastructure.local_storage.chrtid_store import ChrtIdStore
 from collections import defaultdict
+from services.dataset_loader import Dataset, DatasetLoader
+from services.availability_index import AvailabilityIndexBuilder
 from utils.logger import simple_logger, get_logger
 
 
 class DBDataFetcher:
-    def __init__(self, db_controller: MySQLController):
+    def __init__(self, db_controller: MySQLController, chrtid_store: ChrtIdStore | None = None, autoload: bool = True):
         self.db_controller = db_controller
+        self.chrtid_store = chrtid_store # Локально сохранённые chrtID, дозапрошенные из Content API
         self.logger = get_logger(__name__)
         # Кешированные данные
         self.region_priority_dict = None
         self.warehouse_priority_dict = None
         self.warehouses_available_to_stock_transfer = None
-        self.stock_availability_data = None
+        self.stock_availability_data = None # Сырые интервалы наличия: бутстрап их не загружает, строит stock_availability_index
+        self.stock_availability_index = None # (article, size, warehouse) -> маска дней наличия, собирается из потока строк
         self.one_time_tasks = None
         self.max_stock_nmId = None
         self.sales_data = None
@@ -24,19 +29,59 @@ class DBDataFetcher:
         self.all_wb_offices_with_regions_dict = None
         self.all_wb_regions_with_office_list_dict = None
         self.techsize_with_chrtid_dict = None
+        self.load_stats = {} # датасет -> DatasetStats (латентность, строки) последней загрузки
+
+        pool = getattr(getattr(db_controller, "db", None), "pool", None)
+        self.max_parallel_loads = getattr(pool, "maxsize", 8) # Не больше, чем соединений в пуле
+
+        if not autoload:
+            return # Данные загрузит fetch_all_async (или отдельные fetch_*)
 
         # Забираем все данные
-        self.fetch_max_stock_nmId()
-        self.fetch_one_time_tasks()
-        self.fetch_priority_dicts()
-        self.fetch_sales_data()
-        self.fetch_regular_task()
-        self.fetch_all_product_entries_for_regular_tasks()
-        self.fetch_size_map()
-        self.fetch_blocked_warehouses_for_skus()
-        self.fetch_product_on_the_way_for_regular_task()
-        self.fetch_all_wb_offices_with_regions_dict()
-        self.fetch_techsize_with_chrtid_dict()
+        self.load_all()
+
+    def _build_datasets(self, use_async: bool = False) -> list[Dataset]:
+        """
+        Датасеты бутстрапа; друг от друга они не зависят. При use_async тяжёлые выборки идут через async-читатели.
+        """
+        def pick(sync_loader, async_loader):
+            return async_loader if use_async else sync_loader
+
+        datasets = [Dataset("one_time_tasks", self.fetch_one_time_tasks),
+                    Dataset("sort_order_dicts", self.fetch_sort_order_dicts,
+                            row_count=lambda result: sum(len(part) for part in result if part)),
+                    # Потоковое чтение только синхронное: в async-режиме уходит в поток
+                    Dataset("stock_availability", self.fetch_stock_availability_index,
+                            row_count=lambda result: len(result) if result else 0),
+                    Dataset("sales", pick(self.fetch_sales_data, self.fetch_sales_data_async)),
+                    Dataset("regular_task", self.fetch_regular_task),
+                    # Остатки читаются из снимка, уже привязанного к WB office id - карта складов не нужна.
+                    # Если снимок недоступен, контроллер сам дозапросит карту
+                    Dataset("product_entries", pick(self.fetch_all_product_entries_for_regular_tasks,
+                                                    self.fetch_all_product_entries_for_regular_tasks_async)),
+                    Dataset("blocked_warehouses", pick(self.fetch_blocked_warehouses_for_skus, self.fetch_blocked_warehouses_for_skus_async)),
+                    Dataset("product_on_the_way", pick(self.fetch_product_on_the_way_for_regular_task,
+                                                       self.fetch_product_on_the_way_for_regular_task_async)),
+                    Dataset("wb_offices", self.fetch_all_wb_offices_with_regions_dict,
+                            row_count=lambda result: len(result[0]) if result and result[0] else 0),
+                    Dataset("chrtids", pick(self.fetch_techsize_with_chrtid_dict, self.fetch_techsize_with_chrtid_dict_async))]
+
+        # Эти два обычно уже загружены до проверки cookies - повторно не тянем
+        if self.max_stock_nmId is None:
+            datasets.append(Dataset("max_stock_nmId", self.fetch_max_stock_nmId))
+        if self.size_map is None:
+            datasets.append(Dataset("size_map", self.fetch_size_map))
+        return datasets
+
+    def load_all(self):
+        """
+        Параллельная загрузка всех датасетов в пуле потоков.
+        """
+        loader = DatasetLoader(self._build_datasets(), max_workers=self.max_parallel_loads, logger=self.logger)
+        try:
+            loader.run()
+        finally:
+            self.load_stats = loader.stats
 
     @simple_logger(logger_name=__name__)
     def fetch_max_stock_nmId(self) -> int | None:
@@ -51,27 +96,31 @@ class DBDataFetcher:
         return one_time_tasks
     
     @simple_logger(logger_name=__name__)
-    def fetch_priority_dicts(self) -> tuple[dict, dict, dict, dict] | None:
-        try:
-            self.region_priority_dict = self.db_controller.get_regions_with_sort_order()
+    def fetch_sort_order_dicts(self) -> tuple[dict, dict, dict]:
+        self.region_priority_dict = self.db_controller.get_regions_with_sort_order()
 
-            self.warehouse_priority_dict = self.db_controller.get_warehouses_with_sort_order()
+        self.warehouse_priority_dict = self.db_controller.get_warehouses_with_sort_order()
 
-            self.warehouses_available_to_stock_transfer = self.db_controller.get_office_with_regions_map()
+        self.warehouses_available_to_stock_transfer = self.db_controller.get_office_with_regions_map()
 
-            self.stock_availability_data = self.db_controller.get_stock_availability_data()
-
-            data_to_return = (self.region_priority_dict,
-                self.warehouse_priority_dict,
-                self.warehouses_available_to_stock_transfer,
-                self.stock_availability_data)
-            return data_to_return
+        return self.region_priority_dict, self.warehouse_priority_dict, self.warehouses_available_to_stock_transfer
 
+    @simple_logger(logger_name=__name__)
+    def fetch_stock_availability_index(self) -> dict:
+        """
+        Строит индекс наличия прямо из серверного курсора, не материализуя историю за 30 дней.
+        При ошибке чтения индекс пустой.
+        """
+        builder = AvailabilityIndexBuilder()
+        try:
+            builder.add_rows(self.db_controller.iter_stock_availability_days())
         except Exception as e:
-            self.logger.error(f"Error fetching priority dicts: {e}")
-            raise
-            
-
+            self.logger.error(f"Error streaming stock availability: {e}")
+            builder = AvailabilityIndexBuilder()
+        self.logger.info("Индекс наличия: строк %s (пропущено %s), ключей %s",
+                         builder.rows_seen, builder.rows_skipped, len(builder.index))
+        self.stock_availability_index = builder.index
+        return self.stock_availability_index
 
     @simple_logger(logger_name=__name__)
     def fetch_sales_data(self) -> dict | None:
@@ -131,8 +180,17 @@ class DBDataFetcher:
 
     @simple_logger(logger_name=__name__)
     def fetch_techsize_with_chrtid_dict(self) -> dict | None: 
-        techsize_with_chrtid_dict = self.db_controller.get_all_techsizes_with_chrtid()
-        self.techsize_with_chrtid_dict = techsize_with_chrtid_dict
+        techsize_with_chrtid_dict = self.db_controller.get_all_techsizes_with_chrtid() or {}
+        self.techsize_with_chrtid_dict = self._merge_local_chrtids(techsize_with_chrtid_dict)
+        return self.techsize_with_chrtid_dict
+
+    def _merge_local_chrtids(self, techsize_with_chrtid_dict: dict) -> dict:
+        if self.chrtid_store is not None:
+            # Локальные записи закрывают пробелы в БД, записи из БД приоритетнее
+            for nm_id, sizes in self.chrtid_store.load_all().items():
+                db_sizes = techsize_with_chrtid_dict.setdefault(nm_id, {})
+                for tech_size, chrt_id in sizes.items():
+                    db_sizes.setdefault(tech_size, chrt_id)
         return techsize_with_chrtid_dict
 
 
@@ -152,4 +210,48 @@ class DBDataFetcher:
         return all_wb_offices_with_regions_dict, self.all_wb_regions_with_office_list_dict
 
 
-    
\ No newline at end of file
+    
+
+
+    async def fetch_all_async(self):
+        """
+        То же, что load_all, но на текущем event loop: тяжёлые выборки - через async-читатели
+        MySQLController, лёгкие справочники - синхронными fetch_* в потоках.
+        Пул AsyncDatabase закрывается по завершении, т.к. привязан к этому event loop.
+        """
+        loader = DatasetLoader(self._build_datasets(use_async=True), max_workers=self.max_parallel_loads, logger=self.logger)
+        try:
+            await loader.run_async()
+        finally:
+            self.load_stats = loader.stats
+            async_db = getattr(self.db_controller, "async_db", None)
+            if async_db is not None:
+                await async_db.close()
+
+    @simple_logger(logger_name=__name__)
+    async def fetch_sales_data_async(self):
+        self.sales_data = await self.db_controller.get_size_sales_for_warehouse_async()
+        return self.sales_data
+
+    @simple_logger(logger_name=__name__)
+    async def fetch_all_product_entries_for_regular_tasks_async(self):
+        self.all_product_entries_for_regular_task = await self.db_controller.get_all_products_with_stocks_with_region_async()
+        return self.all_product_entries_for_regular_task
+
+    @simple_logger(logger_name=__name__)
+    async def fetch_blocked_warehouses_for_skus_async(self):
+        self.blocked_warehouses_for_skus = await self.db_controller.get_blocked_warehouses_for_skus_async()
+        return self.blocked_warehouses_for_skus
+
+    @simple_logger(logger_name=__name__)
+    async def fetch_product_on_the_way_for_regular_task_async(self):
+        product_on_the_way_for_regular_task = await self.db_controller.get_products_transfers_on_the_way_with_region_async()
+        self.create_wh_banned_for_nmid_list(product_on_the_way_for_regular_task)
+        self.product_on_the_way_for_regular_task = product_on_the_way_for_regular_task
+        return product_on_the_way_for_regular_task
+
+    @simple_logger(logger_name=__name__)
+    async def fetch_techsize_with_chrtid_dict_async(self):
+        techsize_with_chrtid_dict = await self.db_controller.get_all_techsizes_with_chrtid_async() or {}
+        self.techsize_with_chrtid_dict = self._merge_local_chrtids(techsize_with_chrtid_dict)
+        return self.techsize_with_chrtid_dict
@@ -9,6 +9,7 @@ import math
 import pandas as pd
 import sys
 from utils.logger import simple_logger
+from utils.config import wb_seller_analytics_api_url
 
 class DeliveredSupplyProcessor:
     def __init__(self,
@@ -53,7 +54,7 @@ class DeliveredSupplyProcessor:
 
     def fetch_wb_supply_data(self):
 
-        base_url = "https://seller-analytics-api.wildberries.ru"
+        base_url = wb_seller_analytics_api_url
         method = "GET"
         endpoint = "/api/v1/analytics/goods-return"
         headers = {
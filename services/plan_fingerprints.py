@@ -0,0 +1,89 @@
+import hashlib
+import pickle
+from typing import Any, Dict, Tuple
+
+# Меняется вместе с логикой планирования: старые планы в кеше перестают совпадать
+PLAN_CACHE_VERSION = 1
+
+
+def _digest(value) -> str:
+    return hashlib.blake2b(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), digest_size=16).hexdigest()
+
+
+def _sign(value) -> int:
+    return (value > 0) - (value < 0)
+
+
+class PlanFingerprinter:
+    """
+    Отпечатки входных данных планирования по товару. Заявки товара - функция от его узла коллекции
+    (остатки, товары в пути, наличие, заказы по каждому SKU), блокировок его SKU, chrtID и запретов по nmID,
+    топологии сессии, долей задания и квот. Совпал отпечаток - совпадут и заявки.
+
+    Квоты берутся в том виде, в котором их видит планирование: у складов-источников товара - только знак квоты,
+    у складов-получателей - квота, урезанная до наибольшего остатка товара на складе (больше за один раз
+    не перемещается), поэтому обычное почасовое уменьшение больших квот план товара не сбрасывает.
+    """
+
+    def __init__(self, topology, task_row: Dict[str, Any], quota_dict: Dict[int, Dict[str, int]],
+                 size_map: Dict[str, int], db_data_fetcher, min_availability_days: int):
+        self.topology = topology
+        self.quota_dict = quota_dict
+        self.techsize_with_chrtid_dict = getattr(db_data_fetcher, "techsize_with_chrtid_dict", None) or {}
+        self.banned_warehouses_for_nmids = getattr(db_data_fetcher, "banned_warehouses_for_nmids", None) or {}
+
+        shares = sorted((key, value) for key, value in (task_row or {}).items() if key.startswith(("target_", "min_")))
+        self.session = _digest((PLAN_CACHE_VERSION,
+                                shares,
+                                topology.region_src_order,
+                                topology.region_dst_order,
+                                topology.warehouse_src_order,
+                                topology.warehouse_dst_order,
+                                sorted(topology.src_warehouses_by_region.items()),
+                                sorted(topology.dst_warehouses_by_region.items()),
+                                sorted(topology.donor_regions_by_dst.items()),
+                                sorted((region_id, _sign(quota)) for region_id, quota in topology.src_quota_by_region.items()),
+                                sorted((region_id, _sign(quota)) for region_id, quota in topology.dst_quota_by_region.items()),
+                                sorted((size_map or {}).items()),
+                                min_availability_days))
+
+    def sku(self, nm_id, size_id, size_data) -> str:
+        """
+        Отпечаток SKU: узел размера из коллекции и блокировки складов (по ключу размера и по size_id узла).
+        """
+        topology = self.topology
+        return _digest((size_id,
+                        size_data,
+                        sorted(topology.blocked_for(nm_id, size_id)),
+                        sorted(topology.blocked_for(nm_id, size_data.get("size_id")))))
+
+    def product(self, product: Dict[str, Any]) -> Tuple[str, Dict[Any, str]]:
+        """
+        (отпечаток товара, {size_id: отпечаток SKU}). Порядок размеров входит в отпечаток: от него зависит
+        порядок заданий и заявок товара.
+        """
+        nm_id = product.get("wb_article_id")
+        sku_fingerprints: Dict[Any, str] = {}
+        stock_warehouses = set()
+        max_qty = 1
+        for size_id, size_data in product.get("sizes", {}).items():
+            for region in size_data.get("regions", {}).values():
+                for wh_id, qty in (region.get("warehouses", {}) or {}).items():
+                    stock_warehouses.add(wh_id)
+                    max_qty = max(max_qty, qty)
+            sku_fingerprints[size_id] = self.sku(nm_id, size_id, size_data)
+
+        src_quota_signs = sorted((wh_id, _sign(self.quota_dict[wh_id]["src"]) if wh_id in self.quota_dict else None)
+                                 for wh_id in stock_warehouses)
+        dst_quotas = [min(self.quota_dict[wh_id]["dst"], max_qty) if wh_id in self.quota_dict else None
+                      for wh_id in self.topology.warehouse_dst_order]
+        chrtids = sorted((self.techsize_with_chrtid_dict.get(nm_id) or {}).items())
+
+        fingerprint = _digest((self.session,
+                               nm_id,
+                               list(sku_fingerprints.items()),
+                               chrtids,
+                               self.banned_warehouses_for_nmids.get(nm_id),
+                               src_quota_signs,
+                               dst_quotas))
+        return fingerprint, sku_fingerprints
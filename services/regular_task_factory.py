@@ -3,7 +3,9 @@ import time
 from typing import Any, Dict, Iterable, Union, Mapping, Sequence, Callable, Optional, Tuple, List
 
 from infrastructure.db.mysql.mysql_controller import MySQLController
+from infrastructure.db.mysql.rows import TupleRows, iter_row_fields
 from infrastructure.api.sync_controller import SyncAPIController
+from infrastructure.api.rate_limiter import RateLimiter, parse_retry_after
 from requests.cookies import RequestsCookieJar
 from utils.data_formating import ( _extract_min_target_map, _region_id_to_key, \
                                   _build_region_to_warehouses, _collect_destination_warehouses_for_plan, \
@@ -14,13 +16,29 @@ from models.regular_tasks.regular_tasks import RegularTaskForSize, RegionStock
 import sys
 from utils.logger import simple_logger
 from services.db_data_fetcher import DBDataFetcher
+from services.transfer_retry_queue import TransferRetryQueue
+from services.chrtid_resolver import ChrtIdResolver
+from services.availability_index import build_availability_index, days_count, union_days_count
+from services.write_behind_batcher import WriteBehindBatcher
+from services.allocation_engine import VectorizedAllocationEngine
+from services.session_topology import SessionTopology, RankOrder, sort_by_priority
+from services.sharded_planning import shard_products, build_shard_payload, plan_shard
+from services.plan_fingerprints import PlanFingerprinter
+from infrastructure.local_storage.plan_cache import PlanCache
+from utils.config import rate_limits, transfer_retry_settings, wb_seller_weekly_report_url, products_on_the_way_writer_settings, allocation_engine, \
+    planning_workers
 from datetime import datetime, timedelta
 import queue
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 Row = Union[Mapping[str, Any], Sequence[Any]]
 
 
 class RegularTaskFactory:
+    RETRY_STATUSES = (429, 500, 502, 503, 504) # Заявки с такими ответами отправляются повторно
+
     def __init__(self,
                  db_controller: MySQLController,
                  api_controller: SyncAPIController,
@@ -29,7 +47,12 @@ class RegularTaskFactory:
                  headers: Dict,
                  logger,
                  size_map: Dict[int, str],
-                 cookie_list: list):
+                 cookie_list: list,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 chrtid_resolver: Optional[ChrtIdResolver] = None,
+                 allocation_engine: str = allocation_engine,
+                 planning_workers: int = planning_workers,
+                 plan_cache: Optional[PlanCache] = None):
         self.db_controller = db_controller
         self.api_controller = api_controller
         self.db_data_fetcher = db_data_fetcher
@@ -43,14 +66,25 @@ class RegularTaskFactory:
         self.current_cookie_index = 0
         self.bad_request_count = 0
         self.bad_request_max_count = 10
-        self.cooldown_error_count = 0
-        # self.timeout_error_request_cooldown_list = [1, 3, 10, 30, 60, 120]
-        self.timeout_error_request_cooldown_list = [60, 60, 60, 60, 60]
-        self.timeout_error_cooldown_index = 0
-        self.send_transfer_request_cooldown = 0.1
+        self.server_error_max_count = 5 # Сколько ответов 5xx подряд допускаем от одной учётки до остановки её полосы
+        self._server_errors_in_row = defaultdict(int) # учётка -> ответов 5xx подряд (сбрасывается успешной заявкой)
+        self.rate_limiter = rate_limiter or RateLimiter(endpoint_limits=rate_limits) # Темп запросов по (учётка, эндпоинт)
+        self.chrtid_resolver = chrtid_resolver # Дозапрос недостающих chrtID перед планированием
+        self.allocation_engine = allocation_engine # 'numpy' - векторный расчёт распределения, 'python' - по товарам в циклах
+        self.planning_workers = planning_workers # 0 - расчёт в текущем процессе, N - товары шардами по nmId в N процессах
+        self.plan_cache = plan_cache # Заявки товаров с неизменившимися входными данными берутся из прошлого расчёта
+        self.topology = None # SessionTopology текущего расчёта (create_task_for_product)
+        self._inflight_requests = 0 # Заявки, взятые полосами и ещё не обработанные (могут вернуться в очередь повторов)
         self.all_request_bodies_to_send = []
         self.products_with_missing_chrtids = []
         self.sent_product_queue = queue.Queue()
+        self.products_on_the_way_writer = WriteBehindBatcher(source_queue=self.sent_product_queue,
+                                                             flush_func=lambda items: self.db_controller.insert_products_on_the_way(items=items),
+                                                             logger=self.logger,
+                                                             **products_on_the_way_writer_settings)
+        self._quota_lock = threading.Lock() # Защищает quota_dict и счётчики ошибок при параллельной отправке
+        self._reserved_quota = defaultdict(int) # (склад, 'src'/'dst') -> количество в заявках, отправленных и ещё без ответа
+        self._stop_sending = threading.Event() # Сигнал всем полосам отправки остановиться
 
     @simple_logger(logger_name=__name__)
     def run_calculations(self):
@@ -61,6 +95,7 @@ class RegularTaskFactory:
             warehouse_priority_dict = input_data["warehouse_priority_dict"] # карта складов {warehouse_id: {src_priority:1, dst_priority:12}}
             warehouses_available_to_stock_transfer = input_data["warehouses_available_to_stock_transfer"] # доступные склады для трансфера
             stock_availability_data = input_data["stock_availability_data"] # данные о наличии на складах
+            stock_availability_index = input_data["stock_availability_index"] # индекс наличия, уже собранный из потока строк
             sales_data = input_data["sales_data"] # данные о продажах
             blocked_warehouses_for_skus = input_data["blocked_warehouses_for_skus"] # заблокированные склады для товаров
             task_row = input_data["task_row"] # регуляпьная задача
@@ -69,9 +104,12 @@ class RegularTaskFactory:
 
             region_src_sort_order = {k: v['src_priority'] for k, v in region_priority_dict.items() if v.get('src_priority', None) is not None}
 
+            self.fill_missing_chrtids(all_product_entries=all_product_entries)
+
             indices = self.prepare_indices(sales_data=sales_data,
                                            stock_availability_data=stock_availability_data,
-                                           last_n_days=30)
+                                           last_n_days=30,
+                                           stock_availability_index=stock_availability_index)
 
             stock_availability_df = indices["stock_availability_df"]
             orders_index = indices["orders_index"]
@@ -111,6 +149,43 @@ class RegularTaskFactory:
             
             
 
+    def fill_missing_chrtids(self, all_product_entries: Union[TupleRows, Iterable[Row]]) -> int:
+        """
+        До планирования дозапрашивает chrtID для размеров из остатков, которых нет в techsize_with_chrtid_dict,
+        чтобы такие SKU не выпадали из заявок в _build_product_stocks. Спрашиваются только SKU, которые могут туда
+        попасть: есть остаток на складе с квотой на отправку (если квоты уже известны), регион известен, склад не заблокирован.
+        """
+        if self.chrtid_resolver is None or not all_product_entries:
+            return 0
+
+        quota_dict = self.quota_dict
+        banned_warehouses_for_nmids = self.db_data_fetcher.banned_warehouses_for_nmids or {}
+        wanted = defaultdict(set)
+        for wb_article_id, warehouse_id, qty, size_name, region_id in iter_row_fields(all_product_entries, ("wb_article_id", "nmId"),
+                                                                                      "warehouse_id", "qty", "size", ("region_id", "region")):
+            if wb_article_id is None or size_name is None or region_id is None:
+                continue
+            try:
+                wb_article_id = int(wb_article_id)
+                warehouse_id = int(warehouse_id)
+                if int(qty or 0) <= 0:
+                    continue
+            except (TypeError, ValueError):
+                continue
+            if quota_dict and quota_dict.get(warehouse_id, {}).get("src", 0) == 0:
+                continue
+            if warehouse_id in banned_warehouses_for_nmids.get(wb_article_id, ()):
+                continue
+            wanted[wb_article_id].add(str(size_name))
+
+        if self.db_data_fetcher.techsize_with_chrtid_dict is None:
+            self.db_data_fetcher.techsize_with_chrtid_dict = {}
+        try:
+            return self.chrtid_resolver.resolve_missing(wanted, self.db_data_fetcher.techsize_with_chrtid_dict)
+        except Exception as e:
+            self.logger.exception("Ошибка при дозапросе chrtID: %s", e)
+            return 0
+
     def load_input_data(self) -> Dict[str, Any]:
         """
         Загружает все необходимые данные из DBDataFetcher для дальнейших расчётов.
@@ -121,6 +196,7 @@ class RegularTaskFactory:
             "warehouse_priority_dict": self.db_data_fetcher.warehouse_priority_dict,
             "warehouses_available_to_stock_transfer": self.db_data_fetcher.warehouses_available_to_stock_transfer,
             "stock_availability_data": self.db_data_fetcher.stock_availability_data,
+            "stock_availability_index": getattr(self.db_data_fetcher, "stock_availability_index", None),
             "sales_data": self.db_data_fetcher.sales_data,
             "blocked_warehouses_for_skus": self.db_data_fetcher.blocked_warehouses_for_skus,
             "task_row": self.db_data_fetcher.regular_task_row,
@@ -130,20 +206,26 @@ class RegularTaskFactory:
         return result
 
     def prepare_indices(self,
-                        sales_data: Iterable[Mapping[str, Any]],
+                        sales_data: Union[TupleRows, Iterable[Mapping[str, Any]]],
                         stock_availability_data: Union[Sequence[Mapping], Sequence[tuple]],
-                        last_n_days: int = 30) -> Dict[str, Any]:
+                        last_n_days: int = 30,
+                        stock_availability_index: Optional[Dict[Tuple[int, int, int], int]] = None) -> Dict[str, Any]:
         """
         Строит индексы для быстрых расчётов:
         - stock_availability_df: дни наличия товара по артикулу/размеру/складу
+          (если индекс уже собран DBDataFetcher из потока строк - берём его)
         - orders_index: количество заказов по (nmId, techSize_id, office_id)
         """
-        stock_availability_df = self.build_article_days(stock_time_data=stock_availability_data,
-                                                        last_n_days=last_n_days)
+        if stock_availability_index is not None:
+            stock_availability_df = stock_availability_index
+        else:
+            stock_availability_df = self.build_article_days(stock_time_data=stock_availability_data,
+                                                            last_n_days=last_n_days)
                                         
 
-        orders_index = {(row["nmId"], row["techSize_id"], row["office_id"]): row["order_count"]
-                        for row in sales_data}
+        orders_index = {(nm_id, tech_size_id, office_id): order_count
+                        for nm_id, tech_size_id, office_id, order_count
+                        in iter_row_fields(sales_data, "nmId", "techSize_id", "office_id", "order_count")}
 
         result = {"stock_availability_df": stock_availability_df,
             "orders_index": orders_index}
@@ -154,77 +236,26 @@ class RegularTaskFactory:
     
     def build_article_days(self,
                            stock_time_data: Union[Sequence[Mapping], Sequence[tuple]],
-                           last_n_days: Optional[int] = 30) -> Dict[Tuple[int, int, int], Dict[str, Any]]:
+                           last_n_days: Optional[int] = 30) -> Dict[Tuple[int, int, int], int]:
         """
-        Строит индекс доступности по артикулам/размерам/складам:
-        - нормализует входные данные
-        - парсит даты
-        - фильтрует по последним N дням
-        - агрегирует по ключу (article, size, warehouse)
+        Строит индекс доступности по артикулам/размерам/складам за один проход:
+        каждая строка нормализуется, парсится, фильтруется по последним N дням
+        и сразу агрегируется по ключу (article, size, warehouse).
         """
-        normalized_data = self._normalize_stock_time_data(stock_time_data)
-        normalized_data = self._parse_dates(normalized_data)
-        normalized_data = self._filter_recent_days(normalized_data, last_n_days)
-        avail_index = self._build_availability_index(normalized_data)
-        return avail_index
-
-    def _normalize_stock_time_data(self,
-                                   stock_time_data: Union[Sequence[Mapping], Sequence[tuple]]
-                                    ) -> List[Dict[str, Any]]:
-        """Приводим входные данные к единому виду: список словарей."""
-        normalized = []
-        if isinstance(stock_time_data, list) and stock_time_data:
-            first = stock_time_data[0]
-            if isinstance(first, dict):
-                normalized = stock_time_data
-            else:
-                for t in stock_time_data:
-                    normalized.append({
-                        "wb_article_id": t[0],
-                        "size_id": t[1],
-                        "warehouse_id": t[2],
-                        "time_beg": t[3],
-                        "time_end": t[4],
-                    })
-        return normalized
-
-    def _parse_dates(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Преобразуем time_beg и time_end в datetime."""
-        for row in rows:
-            if not isinstance(row["time_beg"], datetime):
-                row["time_beg"] = datetime.fromisoformat(str(row["time_beg"]))
-            if not isinstance(row["time_end"], datetime):
-                row["time_end"] = datetime.fromisoformat(str(row["time_end"]))
-        return rows
-
-    def _filter_recent_days(self,
-                            rows: List[Dict[str, Any]],
-                            last_n_days: Optional[int]
-                            ) -> List[Dict[str, Any]]:
-        """Фильтруем записи по последним N дням."""
-        if last_n_days is None:
-            return rows
-        cutoff = datetime.now() - timedelta(days=last_n_days)
-        return [r for r in rows if r["time_end"] >= cutoff]
-    
+        if not stock_time_data:
+            return {}
+        cutoff = datetime.now() - timedelta(days=last_n_days) if last_n_days is not None else None
+
+        def recent_rows():
+            for row in stock_time_data:
+                if isinstance(row, Mapping):
+                    row = (row["wb_article_id"], row["size_id"], row["warehouse_id"], row["time_beg"], row["time_end"])
+                time_end = row[4] if isinstance(row[4], datetime) else datetime.fromisoformat(str(row[4]))
+                if cutoff is not None and time_end < cutoff:
+                    continue
+                yield row[0], row[1], row[2], row[3], time_end
 
-    def _build_availability_index(self,
-                                  rows: List[Dict[str, Any]]
-                                  ) -> Dict[Tuple[int, int, int], Dict[str, Any]]:
-        """Строим индекс доступности по ключу (article, size, warehouse)."""
-        avail_index: Dict[Tuple[int, int, int], Dict[str, Any]] = {}
-        for row in rows:
-            key = (int(row["wb_article_id"]), int(row["size_id"]), int(row["warehouse_id"]))
-            start = row["time_beg"].date()
-            end = row["time_end"].date()
-            days_set = {start + timedelta(days=i) for i in range((end - start).days + 1)}
-
-            if key in avail_index:
-                avail_index[key]["days"].update(days_set)
-                avail_index[key]["days_count"] = len(avail_index[key]["days"])
-            else:
-                avail_index[key] = {"days": days_set, "days_count": len(days_set)}
-        return avail_index
+        return build_availability_index(recent_rows())
 
     @simple_logger(logger_name=__name__)
     def remove_unavailable_warehouses_from_current_session(self, quota_dict,
@@ -275,109 +306,185 @@ class RegularTaskFactory:
         """
         Создаёт задачи перемещения по товарам/размерам.
         """
-        # 1. Сортировки
-        region_src_sort_order, region_dst_sort_order, \
-        warehouse_src_sort_order, warehouse_dst_sort_order = self._prepare_sort_orders(region_priority_dict, 
-                                                                                       warehouse_priority_dict
-)
-        self.warehouse_dst_sort_order = warehouse_dst_sort_order
-
-        # 2. Квоты
-        src_quota_by_region, dst_quota_by_region, \
-        src_warehouses_with_quota_dict, dst_warehouses_with_quota_dict, \
-        warehouses_with_regions = self._prepare_quota_maps(quota_dict, warehouse_src_sort_order, 
-                                                           warehouse_dst_sort_order, warehouses_available_to_stock_transfer)
-
-        # 3. Обработка продуктов
-        for product in product_collection.values():
+        # 1. Топология сессии: сортировки, квоты по регионам, склады регионов, доноры, блокировки
+        topology = SessionTopology(region_priority_dict=region_priority_dict,
+                                   warehouse_priority_dict=warehouse_priority_dict,
+                                   warehouses_available_to_stock_transfer=warehouses_available_to_stock_transfer,
+                                   quota_dict=quota_dict,
+                                   blocked_warehouses_for_skus=blocked_warehouses_for_skus,
+                                   size_map=self.size_map)
+        self.topology = topology
+        self.warehouse_dst_sort_order = topology.warehouse_dst_order
+
+        # 2. Обработка продуктов: товары с прежним отпечатком входных данных берутся из кеша планов,
+        # остальные - цели и минимумы по всем SKU сразу, дальше распределение по товарам
+        products = list(product_collection.values())
+        fingerprints, cached_request_bodies = self._lookup_cached_plans(products, task_row, topology, quota_dict)
+        pending = [product_index for product_index in range(len(products)) if product_index not in cached_request_bodies]
+
+        planned = None
+        if self.planning_workers > 0 and pending:
+            planned = self._plan_products_in_processes(products, pending, task_row, topology, quota_dict, size_map)
+        if planned is None:
+            planned = self._plan_products_in_process(products, pending, task_row, topology, quota_dict, size_map)
+
+        for product_index in range(len(products)):
+            request_bodies = cached_request_bodies.get(product_index)
+            self.all_request_bodies_to_send.extend(planned.get(product_index, ()) if request_bodies is None else request_bodies)
+        self._store_planned(products, fingerprints, planned)
+
+        # 3. Сортировка запросов
+        self._sort_request_bodies_by_destination_priority(topology)
+
+
+    def _lookup_cached_plans(self, products, task_row, topology, quota_dict):
+        """
+        (индекс товара -> (nmID, отпечаток, отпечатки SKU), индекс товара -> заявки из кеша). Без кеша - пустые словари.
+        Товар, отпечаток которого не посчитался, просто планируется заново.
+        """
+        if self.plan_cache is None:
+            return {}, {}
+        start_time = time.perf_counter()
+        fingerprinter = PlanFingerprinter(topology=topology,
+                                          task_row=task_row,
+                                          quota_dict=quota_dict,
+                                          size_map=self.size_map,
+                                          db_data_fetcher=self.db_data_fetcher,
+                                          min_availability_days=self.MIN_AVAILABILITY_DAY_COUNT_FOR_TRANSFER)
+        fingerprints = {}
+        for product_index, product in enumerate(products):
             try:
-                current_tasks_for_product, product_stocks_by_size_with_warehouse = self._process_single_product(product,
-                                                                                                                task_row,
-                                                                                                                size_map,
-                                                                                                                blocked_warehouses_for_skus,
-                                                                                                                region_src_sort_order,
-                                                                                                                region_dst_sort_order,
-                                                                                                                warehouse_src_sort_order,
-                                                                                                                warehouses_available_to_stock_transfer,
-                                                                                                                src_quota_by_region,
-                                                                                                                dst_quota_by_region,
-                                                                                                                src_warehouses_with_quota_dict,
-                                                                                                                dst_warehouses_with_quota_dict)
-
-                if current_tasks_for_product:
-                    self.create_stock_transfer_task_for_product(
-                        current_tasks_for_product,
-                        warehouses_available_to_stock_transfer,
-                        quota_dict=quota_dict,
-                        warehouse_src_sort_order=warehouse_src_sort_order,
-                        warehouse_dst_sort_order=warehouse_dst_sort_order,
-                        size_map=size_map,
-                        product_stocks_by_size_with_warehouse=product_stocks_by_size_with_warehouse)
-
+                fingerprints[product_index] = (product.get("wb_article_id"), *fingerprinter.product(product))
             except Exception as e:
-                self.logger.debug(f"Ошибка при обработке продукта {product.get('wb_article_id')}: {e}")
+                self.logger.debug("Отпечаток товара %s не посчитан, планируем заново: %s", product.get("wb_article_id"), e)
 
-        # 4. Сортировка запросов
-        self._sort_request_bodies_by_destination_priority(warehouse_dst_sort_order)
+        stats_before = self.plan_cache.stats()
+        try:
+            hits = self.plan_cache.lookup({nm_id: (fingerprint, sku_fingerprints)
+                                           for nm_id, fingerprint, sku_fingerprints in fingerprints.values()})
+        except Exception as e:
+            self.logger.warning("Кеш планов недоступен, планируем все товары: %s", e)
+            return {}, {}
+        cached_request_bodies = {product_index: hits[nm_id] for product_index, (nm_id, _, _) in fingerprints.items() if nm_id in hits}
+
+        stats = self.plan_cache.stats()
+        self.logger.info("Кеш планов: из кеша %s товаров, пересчёт %s (SKU без изменений %s, изменилось %s), %.3f сек",
+                         len(cached_request_bodies), len(products) - len(cached_request_bodies),
+                         stats["sku_unchanged"] - stats_before["sku_unchanged"], stats["sku_changed"] - stats_before["sku_changed"],
+                         time.perf_counter() - start_time)
+        return fingerprints, cached_request_bodies
+
+    def _store_planned(self, products, fingerprints, planned):
+        if self.plan_cache is None or not planned:
+            return
+        plans = {fingerprints[product_index][0]: (fingerprints[product_index][1], fingerprints[product_index][2], request_bodies)
+                 for product_index, request_bodies in planned.items() if product_index in fingerprints}
+        try:
+            self.plan_cache.store(plans)
+        except Exception as e:
+            self.logger.warning("Планы не сохранены в кеш: %s", e)
 
+    def _plan_products_in_process(self, products, product_indices, task_row, topology, quota_dict, size_map):
+        """
+        Планирует товары product_indices в текущем процессе: индекс товара -> его заявки (в порядке появления).
+        """
+        shard = [products[product_index] for product_index in product_indices]
+        allocation_plan = self._prepare_allocation_plan(shard, task_row, topology)
+        planned = {}
+        start = len(self.all_request_bodies_to_send)
+        for local_index, product_index in enumerate(product_indices):
+            before = len(self.all_request_bodies_to_send)
+            self._plan_product(local_index, products[product_index], allocation_plan, task_row, topology, quota_dict, size_map)
+            planned[product_index] = self.all_request_bodies_to_send[before:]
+        del self.all_request_bodies_to_send[start:]
+        return planned
+
+
+    def _plan_product(self, product_index, product, allocation_plan, task_row, topology, quota_dict, size_map):
+        """
+        Задания по размерам товара и заявки по ним (в all_request_bodies_to_send).
+        """
+        try:
+            if allocation_plan is not None and allocation_plan.covers(product_index):
+                current_tasks_for_product, product_stocks_by_size_with_warehouse = allocation_plan.allocate(product_index)
+            else:
+                current_tasks_for_product, product_stocks_by_size_with_warehouse = self._process_single_product(product,
+                                                                                                                task_row,
+                                                                                                                topology)
 
-    def _prepare_sort_orders(self, region_priority_dict, warehouse_priority_dict):
-        region_src_sort_order = self.sort_destinations_by_key(region_priority_dict, key='src_priority')
-        region_dst_sort_order = self.sort_destinations_by_key(region_priority_dict, key='dst_priority')
-        warehouse_src_sort_order = self.sort_destinations_by_key(warehouse_priority_dict, key='src_priority')
-        warehouse_dst_sort_order = self.sort_destinations_by_key(warehouse_priority_dict, key='dst_priority')
-        return region_src_sort_order, region_dst_sort_order, warehouse_src_sort_order, warehouse_dst_sort_order
+            if current_tasks_for_product:
+                self.create_stock_transfer_task_for_product(
+                    current_tasks_for_product,
+                    topology=topology,
+                    quota_dict=quota_dict,
+                    size_map=size_map,
+                    product_stocks_by_size_with_warehouse=product_stocks_by_size_with_warehouse)
 
-    def _prepare_quota_maps(self, quota_dict, warehouse_src_sort_order, warehouse_dst_sort_order, warehouses_available_to_stock_transfer):
-        warehouses_with_regions = {val: k for k, vals in warehouses_available_to_stock_transfer.items() for val in vals}
+        except Exception as e:
+            self.logger.debug(f"Ошибка при обработке продукта {product.get('wb_article_id')}: {e}")
 
-        src_warehouses_with_quota_dict = {wh_id: quota_dict.get(wh_id, {}).get('src', 0) for wh_id in warehouse_src_sort_order}
-        dst_warehouses_with_quota_dict = {wh_id: quota_dict.get(wh_id, {}).get('dst', 0) for wh_id in warehouse_dst_sort_order}
+    def _plan_products_in_processes(self, products, product_indices, task_row, topology, quota_dict, size_map):
+        """
+        Планирует товары product_indices в пуле процессов: шарды по nmId, у каждого воркера копия топологии
+        и снимка квот. Индекс товара -> его заявки, как у _plan_products_in_process; None - пул недоступен.
+        """
+        shards = shard_products(products, self.planning_workers, product_indices)
+        payloads = [build_shard_payload(products, product_indices, task_row, topology, quota_dict, size_map,
+                                        self.db_data_fetcher, self.allocation_engine, self.logger.name)
+                    for product_indices in shards]
+        start_time = time.perf_counter()
+        try:
+            # spawn, а не fork: к моменту расчёта в процессе уже работают потоки (отправка, запись товаров в пути)
+            with ProcessPoolExecutor(max_workers=len(payloads), mp_context=multiprocessing.get_context("spawn")) as pool:
+                shard_results = list(pool.map(plan_shard, payloads))
+        except Exception as e:
+            self.logger.warning("Пул процессов планирования недоступен, считаем в одном процессе: %s", e)
+            return None
 
-        src_quota_by_region = defaultdict(int)
-        dst_quota_by_region = defaultdict(int)
+        planned = {}
+        for result in shard_results:
+            planned.update(result["request_bodies"])
+            self.products_with_missing_chrtids.extend(result["products_with_missing_chrtids"])
 
-        for wh_id, region_id in warehouses_with_regions.items():
-            src_quota_by_region[region_id] += quota_dict.get(wh_id, {}).get('src', 0) or 0
-            dst_quota_by_region[region_id] += quota_dict.get(wh_id, {}).get('dst', 0) or 0
+        self.logger.info("Планирование в %s процессах: товаров %s, заявок %s, %.3f сек",
+                         len(payloads), len(product_indices), sum(len(request_bodies) for request_bodies in planned.values()),
+                         time.perf_counter() - start_time)
+        return planned
 
-        return src_quota_by_region, dst_quota_by_region, src_warehouses_with_quota_dict, dst_warehouses_with_quota_dict, warehouses_with_regions
+    def _prepare_allocation_plan(self, products, task_row, topology):
+        """
+        AllocationPlan векторного движка или None - тогда все товары считаются _process_single_product.
+        """
+        if self.allocation_engine != "numpy":
+            return None
+        start_time = time.perf_counter()
+        try:
+            engine = VectorizedAllocationEngine(task_row=task_row,
+                                                size_map=self.size_map,
+                                                min_availability_days=self.MIN_AVAILABILITY_DAY_COUNT_FOR_TRANSFER,
+                                                logger=self.logger)
+            allocation_plan = engine.prepare(products, topology)
+        except Exception as e:
+            self.logger.warning("Векторный расчёт недоступен, считаем по товарам: %s", e)
+            return None
+        self.logger.info("Векторный расчёт целей по %s товарам: %.3f сек", len(products), time.perf_counter() - start_time)
+        return allocation_plan
 
 
-    def _process_single_product(self,
-                                product,
-                                task_row,
-                                size_map,
-                                blocked_warehouses_for_skus,
-                                region_src_sort_order,
-                                region_dst_sort_order,
-                                warehouse_src_sort_order,
-                                warehouses_available_to_stock_transfer,
-                                src_quota_by_region,
-                                dst_quota_by_region,
-                                src_warehouses_with_quota_dict,
-                                dst_warehouses_with_quota_dict):
+    def _process_single_product(self, product, task_row, topology):
         current_tasks_for_product = []
         source_warehouse_used_in_transfer = []
         product_stocks_by_size_with_warehouse = {}
 
         for size_id, size_data in product.get("sizes", {}).items():
             task_for_size = self._build_task_for_size(product, size_id, size_data)
-            self._fill_region_attributes(task_for_size, size_data, task_row, dst_quota_by_region)
+            self._fill_region_attributes(task_for_size, size_data, task_row, topology.dst_quota_by_region)
 
             self._distribute_to_regions(
                 task_for_size,
                 size_id,
                 size_data,
-                blocked_warehouses_for_skus,
-                region_src_sort_order,
-                region_dst_sort_order,
-                warehouse_src_sort_order,
-                warehouses_available_to_stock_transfer,
-                src_quota_by_region,
-                dst_quota_by_region,
-                src_warehouses_with_quota_dict,
-                dst_warehouses_with_quota_dict,
+                topology,
                 product_stocks_by_size_with_warehouse,
                 source_warehouse_used_in_transfer)
 
@@ -435,31 +542,24 @@ class RegularTaskFactory:
                 region_obj.can_receive = False
                 region_obj.skip_reason = 'no_dst_quota'
 
+
     def _distribute_to_regions(self,
                                 task_for_size,
                                 size_id,
                                 size_data,
-                                blocked_warehouses_for_skus,
-                                region_src_sort_order,
-                                region_dst_sort_order,
-                                warehouse_src_sort_order,
-                                warehouses_available_to_stock_transfer,
-                                src_quota_by_region,
-                                dst_quota_by_region,
-                                src_warehouses_with_quota_dict,
-                                dst_warehouses_with_quota_dict,
+                                topology,
                                 product_stocks_by_size_with_warehouse,
                                 source_warehouse_used_in_transfer):
         """
         Распределяет недостающие товары по регионам.
         """
-        for dst_region_id in region_dst_sort_order:
+        for dst_region_id in topology.region_dst_order:
             dst_region_data_entry = task_for_size.region_data.get(dst_region_id)
             if not dst_region_data_entry:
                 continue
 
             # нет квот на приём
-            if dst_quota_by_region.get(dst_region_id, 0) <= 0:
+            if topology.dst_quota_by_region.get(dst_region_id, 0) <= 0:
                 continue
 
             amount_to_add = dst_region_data_entry.amount_to_deliver
@@ -467,31 +567,19 @@ class RegularTaskFactory:
                 continue
 
             # доступные склады-приёмщики
-            dst_warehouses_for_region = [wh_id
-                                        for wh_id, quota in dst_warehouses_with_quota_dict.items()
-                                        if quota > 0
-                                        and wh_id in (warehouses_available_to_stock_transfer.get(dst_region_id, []) or [])
-                                        and wh_id not in blocked_warehouses_for_skus.get(f"{task_for_size.nmId}_{size_id}", [])]
-
-            if not dst_warehouses_for_region:
+            if not topology.can_receive(dst_region_id, task_for_size.nmId, size_id):
                 dst_region_data_entry.can_receive = False
                 dst_region_data_entry.skip_reason = "no_dst_warehouses_in_sort_order"
                 continue
 
-            # ищем доноров
-            for src_region_id in region_src_sort_order:
-                if src_region_id == dst_region_id:
-                    continue
-                if src_quota_by_region.get(src_region_id, 0) <= 0:
-                    continue
+            # ищем доноров (в src-порядке, с квотой на отгрузку, без самого получателя)
+            for src_region_id in topology.donor_regions(dst_region_id):
                 if amount_to_add <= 0:
                     break
 
                 donor_ok, src_region_data_entry, current_src_entry_warehouse_sort = self._find_valid_donor_region(task_for_size,
                                                                                                                 src_region_id,
-                                                                                                                warehouse_src_sort_order,
-                                                                                                                warehouses_available_to_stock_transfer,
-                                                                                                                blocked_warehouses_for_skus)
+                                                                                                                topology)
 
                 if not donor_ok:
                     continue
@@ -501,9 +589,10 @@ class RegularTaskFactory:
                     0,
                     src_region_data_entry.stock_by_region_after - src_region_data_entry.target_stock_by_region)
 
+                allowed_warehouses = set(current_src_entry_warehouse_sort)
                 total_stock_in_allowed = sum(qty for stock_entry in src_region_data_entry.stock_by_warehouse
                                                 for office_id, qty in stock_entry.items()
-                                                if office_id in current_src_entry_warehouse_sort)
+                                                if office_id in allowed_warehouses)
                 
                 amount_available = min(total_stock_in_allowed, transferrable_amount)
                 amount_to_be_sent = min(amount_available, amount_to_add)
@@ -512,8 +601,7 @@ class RegularTaskFactory:
                     continue
 
                 # раскладываем по складам
-                size_map_reversed = {v: k for k, v in self.size_map.items()}
-                size_name = size_map_reversed.get(size_id, str(size_id))
+                size_name = topology.size_map_reversed.get(size_id, str(size_id))
 
                 used = self._distribute_to_warehouses(src_region_data_entry,
                                                     current_src_entry_warehouse_sort,
@@ -530,9 +618,7 @@ class RegularTaskFactory:
     def _find_valid_donor_region(self,
                                 task_for_size,
                                 src_region_id,
-                                warehouse_src_sort_order,
-                                warehouses_available_to_stock_transfer,
-                                blocked_warehouses_for_skus):
+                                topology):
         """
         Проверяет, может ли регион быть донором.
         """
@@ -541,11 +627,9 @@ class RegularTaskFactory:
 
         src_region_data_entry = task_for_size.region_data[src_region_id]
 
-        blocked_for_sku = blocked_warehouses_for_skus.get(f"{task_for_size.nmId}_{task_for_size.tech_size_id}", [])
-        current_src_entry_warehouse_sort = [office_id
-                                            for office_id in warehouse_src_sort_order
-                                            if office_id in (warehouses_available_to_stock_transfer.get(src_region_id, []) or [])
-                                            and office_id not in blocked_for_sku]
+        current_src_entry_warehouse_sort = topology.src_warehouses_for_sku(src_region_id,
+                                                                           task_for_size.nmId,
+                                                                           task_for_size.tech_size_id)
 
 
         # проверка по availability и заказам
@@ -576,17 +660,20 @@ class RegularTaskFactory:
         Распределяет количество по складам в порядке приоритета.
         """
         sent_total = 0
+        # записи остатков по складу: один проход вместо перебора всех записей для каждого склада донора
+        stock_entries_by_office = defaultdict(list)
+        for wh_stock_entry in src_region_data_entry.stock_by_warehouse:
+            for office_id in wh_stock_entry:
+                stock_entries_by_office[office_id].append(wh_stock_entry)
+
         for office_id in current_src_entry_warehouse_sort:
             if amount_to_be_sent <= 0:
                 break
 
-            for wh_stock_entry in src_region_data_entry.stock_by_warehouse:
+            for wh_stock_entry in stock_entries_by_office.get(office_id, ()):
                 if amount_to_be_sent <= 0:
                     break
 
-                if office_id not in wh_stock_entry:
-                    continue
-
                 qty_in_office = wh_stock_entry[office_id]
                 if not qty_in_office:
                     continue
@@ -617,40 +704,25 @@ class RegularTaskFactory:
 
         return sent_total
 
-    def _sort_request_bodies_by_destination_priority(self, warehouse_dst_sort_order):
-        # Сортируем массив тел заявок по приоритету склада-получателя
-        def sort_key(req_data):
-            dst_warehouse_id = req_data.get("dst_warehouse_id")
-            if dst_warehouse_id in warehouse_dst_sort_order:
-                return warehouse_dst_sort_order.index(dst_warehouse_id)
-            else:
-                return float("inf")  # Если склада нет в списке приоритетов, ставим его в конец
-
-        self.all_request_bodies_to_send.sort(key=sort_key)
+    def _sort_request_bodies_by_destination_priority(self, topology):
+        # Сортируем массив тел заявок по приоритету склада-получателя (склады без приоритета - в конец)
+        self.all_request_bodies_to_send.sort(key=lambda req_data: topology.dst_rank(req_data.get("dst_warehouse_id")))
 
 
 
     @simple_logger(logger_name=__name__)
-    def create_product_collection_with_regions(self, all_product_entries: Iterable[Row],
+    def create_product_collection_with_regions(self, all_product_entries: Union[TupleRows, Iterable[Row]],
                                                warehouses_available_to_stock_transfer: Dict,
                                                region_src_sort_order: Dict,
-                                               availability_index: Optional[Dict[Tuple[int, int, int], Dict[str, Any]]] = None,
+                                               availability_index: Optional[Dict[Tuple[int, int, int], int]] = None,
                                                orders_index: Optional[Dict[Tuple[int, int, int], int]] = None) -> Dict[int, Dict[str, Any]]:
         
         self.logger.debug("Старт create_product_collection_with_regions() для %s продуктовых записей", len(all_product_entries) if all_product_entries else 0)
         products: Dict[int, Dict[str, Any]] = {}
-        for row in all_product_entries:
-            if isinstance(row, Mapping):
-                wb_article_id = row.get("wb_article_id") or row.get("nmId")
-                warehouse_id  = row.get("warehouse_id")
-                size_id = row.get("size_id")
-                qty = row.get("qty")
-                size_name = row.get("size")
-                region_id = row.get("region_id") or row.get("region")
-                
-            else:
-                self.logger.debug("Пропускаем строку с неверным форматом: %s", row)
-                continue
+        # Строки - TupleRows из контроллера или словари (DictCursor); поля достаём по карте колонок
+        for row in iter_row_fields(all_product_entries, ("wb_article_id", "nmId"), "warehouse_id", "size_id",
+                                   "qty", "size", ("region_id", "region")):
+            wb_article_id, warehouse_id, size_id, qty, size_name, region_id = row
 
             try:
                 wb_article_id = int(wb_article_id)
@@ -692,14 +764,15 @@ class RegularTaskFactory:
             size_node["total_qty"] += qty
             art["total_qty"] += qty
 
-            # доступность по складу
+            # доступность по складу (маска дней наличия)
             if availability_index is not None:
-                info = availability_index.get((wb_article_id, size_id, warehouse_id))
-                if info:
+                days_mask = availability_index.get((wb_article_id, size_id, warehouse_id))
+                if days_mask:
+                    warehouse_days = days_count(days_mask)
                     prev = size_node["availability_days_by_warehouse"].get(warehouse_id, 0)
                     # на случай повторов берём максимум
-                    if info["days_count"] > prev:
-                        size_node["availability_days_by_warehouse"][warehouse_id] = int(info["days_count"])
+                    if warehouse_days > prev:
+                        size_node["availability_days_by_warehouse"][warehouse_id] = warehouse_days
 
             # заказы 
             if orders_index is not None:
@@ -714,12 +787,9 @@ class RegularTaskFactory:
                 aid = art["wb_article_id"]
                 for sid, size_node in art["sizes"].items():
                     for rid, rnode in size_node["regions"].items():
-                        union_days = set()
-                        for wh in rnode["warehouses"].keys():
-                            info = availability_index.get((aid, sid, wh))
-                            if info:
-                                union_days |= info["days"]
-                        size_node["availability_days_by_region"][rid] = len(union_days)
+                        # дни наличия хотя бы на одном складе региона: ИЛИ масок складов
+                        size_node["availability_days_by_region"][rid] = union_days_count(availability_index.get((aid, sid, wh))
+                                                                                         for wh in rnode["warehouses"])
 
         self.logger.debug("Заполняем отсутствующие регионы для продуктов")
         self.fill_empty_regions_for_products_in_product_collection(products=products, 
@@ -737,19 +807,17 @@ class RegularTaskFactory:
 
                     size['orders_by_region'][region['region_id']] = total_orders_for_region
 
+        region_order = RankOrder(region_src_sort_order)
         for product in products.values():
             for size in product['sizes'].values():
-                sorted_regions = self.sort_regions(size.get('regions', {}), region_src_sort_order)
-                size['regions'] = sorted_regions
+                size['regions'] = region_order.sort_dict(size.get('regions', {}))
 
 
         return products
 
     def sort_regions(self, regions: dict, sort_order: dict) -> dict:
         # Сортируем регионы по приоритету, отсутствующие в sort_order идут в конец
-        sorted_regions = dict(sorted(regions.items(),
-                                     key=lambda item: sort_order.get(item[0], float("inf"))))
-        return sorted_regions
+        return RankOrder(sort_order).sort_dict(regions)
 
     @simple_logger(logger_name=__name__)
     def fill_empty_regions_for_products_in_product_collection(self, products, warehouses_available_to_stock_transfer):
@@ -863,22 +931,13 @@ class RegularTaskFactory:
         # filtered = {k: v for k, v in some_tuple.items() if v.get(key) is not None}
         # keys_sorted = sorted(filtered, key=lambda k: filtered[k][key])
         # return keys_sorted
-        # Сортирует все значения, присваивая значениям None предварительно 999999, чтобы они оказались в конце отсортированного списка, 
-        # но тоже учитывались при перераспределении остатков
-        def sort_key(item):
-            value = some_tuple[item].get(key)
-            if value is None:
-                return (1, 999999)  # None значения идут после
-            else:
-                return (0, value)   # Обычные значения идут сначала
-    
-        return sorted(some_tuple.keys(), key=sort_key)
+        # Сортирует все значения, значения None идут в конец отсортированного списка, 
+        # но тоже учитываются при перераспределении остатков
+        return sort_by_priority(some_tuple, key)
 
     @simple_logger(logger_name=__name__)
     def create_stock_transfer_task_for_product(self, task_collection, 
-                                               warehouses_available_to_stock_transfer, 
-                                               warehouse_src_sort_order,
-                                               warehouse_dst_sort_order,
+                                               topology,
                                                quota_dict, 
                                                size_map,
                                                product_stocks_by_size_with_warehouse):
@@ -909,9 +968,7 @@ class RegularTaskFactory:
 
             region_id_to_transfer_task = entry['region_id']
 
-            warehouses_for_region_list = warehouses_available_to_stock_transfer.get(region_id_to_transfer_task, [])
-
-            warehouse_to_ids = [wh_id for wh_id  in warehouse_dst_sort_order if wh_id in warehouses_for_region_list] 
+            warehouse_to_ids = list(topology.dst_warehouses_by_region.get(region_id_to_transfer_task, ()))
 
             product_size_array = []
 
@@ -949,8 +1006,7 @@ class RegularTaskFactory:
                                                quota_dict=quota_dict, 
                                                size_map=size_map, 
                                                product_stocks_by_size_with_warehouse=product_stocks_by_size_with_warehouse,
-                                               warehouse_src_sort_order=warehouse_src_sort_order,
-                                               warehouse_dst_sort_order=warehouse_dst_sort_order)
+                                               topology=topology)
         
 
     @simple_logger(logger_name=__name__)
@@ -959,8 +1015,7 @@ class RegularTaskFactory:
                                     quota_dict,
                                     size_map,
                                     product_stocks_by_size_with_warehouse,
-                                    warehouse_src_sort_order,
-                                    warehouse_dst_sort_order):
+                                    topology):
         """
         Создаёт заявки на трансфер по списку задач.
         """
@@ -969,8 +1024,8 @@ class RegularTaskFactory:
 
             unsorted_available_from, unsorted_available_to = self._check_quota_for_task(task, quota_dict)
 
-            available_from = [wid for wid in warehouse_src_sort_order if wid in unsorted_available_from]
-            available_to = [wid for wid in warehouse_dst_sort_order if wid in unsorted_available_to]
+            available_from = topology.order_src(unsorted_available_from)
+            available_to = topology.order_dst(unsorted_available_to)
 
             if not available_from or not available_to:
                 self.logger.warning("Нет доступных складов по квотам для задания #%s. Пропуск.", task_idx)
@@ -1011,8 +1066,9 @@ class RegularTaskFactory:
     def _get_available_warehouses_by_quota(self, quota_dict: Dict[int, Dict[str, int]], task: TaskWithProducts) -> Tuple[List[int], List[int]]:
         self.logger.debug("Расчёт доступных складов по квотам")
         try:
-            available_warehouses_from_ids = [wid for wid, q in quota_dict.items() if q.get('src', 0) != 0 and wid in task.warehouses_from_ids]
-            available_warehouses_to_ids = [wid for wid, q in quota_dict.items() if q.get('dst', 0) != 0 and wid in task.warehouses_to_ids]
+            # Идём по складам задания, а не по всем квотам: порядок потом задаёт топология (order_src/order_dst)
+            available_warehouses_from_ids = [wid for wid in dict.fromkeys(task.warehouses_from_ids) if quota_dict.get(wid, {}).get('src', 0) != 0]
+            available_warehouses_to_ids = [wid for wid in dict.fromkeys(task.warehouses_to_ids) if quota_dict.get(wid, {}).get('dst', 0) != 0]
             self.logger.info("Доступно from: %s; to: %s",
                              len(available_warehouses_from_ids), len(available_warehouses_to_ids))
             return available_warehouses_from_ids, available_warehouses_to_ids
@@ -1115,42 +1171,178 @@ class RegularTaskFactory:
     def send_all_requests(self, quota_dict, size_map):
         """
         Отправляет все накопленные заявки на трансфер.
+        На каждую cookie-учётку запускается своя полоса (поток), полосы параллельно
+        забирают заявки из общей очереди в порядке приоритета.
         """
+        if not self.cookie_list:
+            self.logger.error("Список cookies пуст. Отправка заявок невозможна.")
+            return
+
+        request_queue = queue.Queue()
         for idx, req_data in enumerate(self.all_request_bodies_to_send, start=1):
-            try:
-                if self._should_skip_request(req_data, quota_dict):
-                    continue
+            request_queue.put((idx, req_data))
+
+        retry_queue = TransferRetryQueue(**transfer_retry_settings)
+        self._inflight_requests = 0
+        self._reserved_quota.clear()
+        self._server_errors_in_row.clear()
+
+        lane_count = len(self.cookie_list)
+        self._stop_sending.clear()
+        self.logger.info("Старт отправки %s заявок в %s полос(ы)", request_queue.qsize(), lane_count)
+        start_time = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=lane_count, thread_name_prefix="transfer_lane") as executor:
+            futures = [executor.submit(self._send_lane, lane_idx, cookie_data, request_queue, retry_queue, quota_dict, size_map)
+                       for lane_idx, cookie_data in enumerate(self.cookie_list)]
+            sent_by_lane = [future.result() for future in futures]
+
+        elapsed_time = time.perf_counter() - start_time
+        self.logger.info("Отправка заявок завершена за %.2f секунд. Ответов по полосам: %s", elapsed_time, sent_by_lane)
+        self.logger.info("Повторов поставлено: %s, заявок потеряно после %s попыток: %s, осталось в очереди повторов: %s",
+                         retry_queue.scheduled_count, retry_queue.max_attempts, len(retry_queue.dropped), len(retry_queue))
+        self.logger.info("Состояние ограничителей скорости: %s", self.rate_limiter.stats())
+
+        self.all_request_bodies_to_send.clear()
+        self.logger.info("Завершение обработки заявок на трансфер.")
 
-                response = self._execute_request(req_data)
+    def _send_lane(self, lane_idx, cookie_data, request_queue, retry_queue, quota_dict, size_map) -> int:
+        """
+        Полоса отправки для одной cookie-учётки. Возвращает количество полученных ответов.
+        """
+        responses_count = 0
+        identity = self.api_controller.register_cookie_identity(cookie_data, self.headers)
+
+        while not self._stop_sending.is_set():
+            next_request = self._next_request_for_lane(request_queue, retry_queue)
+            if next_request is None:
+                break
+            idx, req_data, attempt = next_request
 
-                if response is None:
-                    self.logger.error("Ответ от API пустой. Пропуск заявки.")
+            reserved = False
+            try:
+                reserved = self._reserve_quota(req_data, quota_dict) # Для повторов квоты проверяются заново
+                if not reserved:
                     continue
-                self.logger.debug("Ответ от API получен, ожидаем %s секунд", self.send_transfer_request_cooldown)
-                time.sleep(self.send_transfer_request_cooldown)
-                self.logger.debug("Ожидание завершено.")
-                result = self._handle_response(response, req_data, quota_dict, size_map)
-                if result is False:
-                    self.logger.info("Прекращаем отправку заявок.")
-                    break
 
-                        # time.sleep(self.send_transfer_request_cooldown)
+                response = self._execute_request(req_data, cookie_data=cookie_data)
+                status = self._response_status(response)
+
+                if status is None:
+                    if isinstance(response, dict) and response.get("connect_failed"):
+                        self.logger.error("Соединение с API не установлено. Заявка #%s уходит на повтор.", idx)
+                        self._schedule_retry(retry_queue, idx, req_data, attempt, identity, response)
+                    else:
+                        # POST /order не идемпотентен: ВБ мог принять заявку до обрыва, повтор создал бы дубль
+                        self.logger.error("Нет ответа от API на заявку #%s (src=%s dst=%s), она могла быть принята. Повтор не отправляется.",
+                                          idx, req_data.get("src_warehouse_id"), req_data.get("dst_warehouse_id"))
+                    continue
+                responses_count += 1
+                result = self._handle_response(response, req_data, quota_dict, size_map, cookie_data=cookie_data, identity=identity)
+                if status in self.RETRY_STATUSES:
+                    # 429 гасят ограничитель скорости и очередь повторов; заявку заберёт любая полоса
+                    self._schedule_retry(retry_queue, idx, req_data, attempt, identity, response)
+                    if result is False:
+                        self.logger.error("Полоса #%s: %s ответов 5xx подряд, учётка выходит из отправки.",
+                                          lane_idx, self.server_error_max_count)
+                        break
+                elif result is False:
+                    self.logger.info("Полоса #%s: прекращаем отправку заявок.", lane_idx)
+                    self._stop_sending.set()
+                elif status in [200, 201, 202, 204]:
+                    retry_queue.on_identity_success(identity)
+                    with self._quota_lock:
+                        self._server_errors_in_row[identity] = 0
 
             except Exception as e:
                 self.logger.exception(
                     "Ошибка при обработке заявки #%s (src=%s dst=%s): %s",
                     idx, req_data.get("src_warehouse_id"), req_data.get("dst_warehouse_id"), e)
+            finally:
+                with self._quota_lock:
+                    if reserved:
+                        self._release_quota(req_data)
+                    self._inflight_requests -= 1
 
+        return responses_count
 
-        self.all_request_bodies_to_send.clear()
-        self.logger.info("Завершение обработки заявок на трансфер.")
+    def _next_request_for_lane(self, request_queue, retry_queue):
+        """
+        Берёт следующую заявку: сначала созревший повтор, затем новую.
+        Пока есть заявки в полёте или отложенные повторы, полоса ждёт, а не завершается.
+        """
+        while not self._stop_sending.is_set():
+            retry_item = retry_queue.pop_due()
+            if retry_item is not None:
+                with self._quota_lock:
+                    self._inflight_requests += 1
+                return retry_item.idx, retry_item.req_data, retry_item.attempt
+
+            try:
+                idx, req_data = request_queue.get_nowait()
+                with self._quota_lock:
+                    self._inflight_requests += 1
+                return idx, req_data, 0
+            except queue.Empty:
+                pass
+
+            with self._quota_lock:
+                inflight = self._inflight_requests
+            next_due_in = retry_queue.next_due_in()
+            if next_due_in is None and inflight == 0:
+                return None
+            time.sleep(min(next_due_in if next_due_in is not None else 0.1, 0.5))
+        return None
+
+    def _schedule_retry(self, retry_queue, idx, req_data, attempt, identity, response):
+        headers = getattr(response, "headers", None) or {}
+        delay = retry_queue.schedule(idx, req_data, attempt + 1, identity,
+                                     retry_after=parse_retry_after(headers.get("Retry-After")))
+        if delay is None:
+            self.logger.error("Заявка #%s (src=%s dst=%s) исчерпала %s попыток и не будет отправлена.",
+                              idx, req_data.get("src_warehouse_id"), req_data.get("dst_warehouse_id"), retry_queue.max_attempts)
+        else:
+            self.logger.warning("Заявка #%s: повтор #%s через %.1f секунд", idx, attempt + 1, delay)
+
+    @staticmethod
+    def _response_status(response):
+        # SyncAPIController при сетевой ошибке возвращает словарь вместо Response
+        if response is None:
+            return None
+        if isinstance(response, dict):
+            return None
+        return getattr(response, "status_code", None)
+
+
+    def _reserve_quota(self, req_data, quota_dict) -> bool:
+        """
+        Проверяет квоты с учётом заявок других полос, которые уже отправлены и ждут ответа, и резервирует под заявку
+        её количество на src и dst. Резерв снимается после ответа (_release_quota): при успехе квота к этому
+        моменту уже списана в _on_successful_request, при ошибке - возвращается.
+        """
+        with self._quota_lock:
+            if self._should_skip_request(req_data, quota_dict):
+                return False
+            qty = self._request_qty(req_data)
+            self._reserved_quota[(req_data.get("src_warehouse_id"), "src")] += qty
+            self._reserved_quota[(req_data.get("dst_warehouse_id"), "dst")] += qty
+            return True
+
+    def _release_quota(self, req_data):
+        # Вызывается под _quota_lock
+        qty = self._request_qty(req_data)
+        self._reserved_quota[(req_data.get("src_warehouse_id"), "src")] -= qty
+        self._reserved_quota[(req_data.get("dst_warehouse_id"), "dst")] -= qty
 
+    @staticmethod
+    def _request_qty(req_data) -> int:
+        return sum(entry["count"] for entry in (req_data.get("warehouse_entries") or {}).values())
 
     def _should_skip_request(self, req_data, quota_dict):
         src_id = req_data.get("src_warehouse_id")
         dst_id = req_data.get("dst_warehouse_id")
-        src_quota = quota_dict.get(src_id, {}).get("src", 0)
-        dst_quota = quota_dict.get(dst_id, {}).get("dst", 0)
+        src_quota = quota_dict.get(src_id, {}).get("src", 0) - self._reserved_quota.get((src_id, "src"), 0)
+        dst_quota = quota_dict.get(dst_id, {}).get("dst", 0) - self._reserved_quota.get((dst_id, "dst"), 0)
 
         if src_quota < 1 or dst_quota < 1:
             self.logger.debug(
@@ -1160,7 +1352,7 @@ class RegularTaskFactory:
             return True
         return False
 
-    def _execute_request(self, req_data):
+    def _execute_request(self, req_data, cookie_data=None):
         """
         Отправляет запрос в API.
         """
@@ -1168,13 +1360,13 @@ class RegularTaskFactory:
         self.logger.debug("Отправка заявки: %s", body)
 
         try:
-            response = self.send_transfer_request(body)
+            response = self.send_transfer_request(body, cookie_data=cookie_data)
             return response
         except Exception as e:
             self.logger.exception("Ошибка при отправке запроса: %s", e)
             return None
 
-    def _handle_response(self, response, req_data, quota_dict, size_map):
+    def _handle_response(self, response, req_data, quota_dict, size_map, cookie_data=None, identity=None):
         src_id = req_data["src_warehouse_id"]
         dst_id = req_data["dst_warehouse_id"]
         product = req_data["product"]
@@ -1185,15 +1377,13 @@ class RegularTaskFactory:
         if status in [200, 201, 202, 204]:
             result = self._on_successful_request(src_id, dst_id, product, warehouse_entries, quota_dict, size_map)
             return result
-        elif status in [429, 500, 502, 503, 504]:
-            if self.cooldown_error_count < len(self.timeout_error_request_cooldown_list):
-                result = self._on_server_error()
-                return result
-            else:
-                self.logger.error("Превышено количество ошибок сервера. Прерываем отправку.")
-                return False
+        elif status == 429:
+            self.logger.warning("429 от API: учётка уходит на паузу ограничителя скорости, заявка - в очередь повторов.")
+            return True
+        elif status in self.RETRY_STATUSES:
+            return self._on_server_error(identity)
         elif status in [400, 403]:
-            result = self._on_bad_request(src_id, dst_id, quota_dict)
+            result = self._on_bad_request(src_id, dst_id, quota_dict, cookie_data=cookie_data)
         else:
             result = self._on_fatal_error(status)
 
@@ -1203,17 +1393,18 @@ class RegularTaskFactory:
             if total_qty_sent <= 0:
                 self.logger.warning("Получено успешное подтверждение, но количество для nmID=%s равно 0. Пропуск.", getattr(product, "product_wb_id", None))
                 return
-            self.bad_request_count = 0
-            self.timeout_error_cooldown_index = 0
             self.logger.info("Заявка успешно отправлена: src=%s -> dst=%s nmID=%s", src_id, dst_id, product.product_wb_id)
 
-            for size in getattr(product, "sizes", []):
-                if size.size_id in warehouse_entries:
-                    qty = warehouse_entries[size.size_id]["count"]
-                    quota_dict[src_id]["src"] -= qty
-                    quota_dict[dst_id]["dst"] -= qty
-                    entry = (product.product_wb_id, qty, size_map[size.size_id], src_id, dst_id)
-                    self.sent_product_queue.put(entry)
+            with self._quota_lock:
+                self.bad_request_count = 0
+
+                for size in getattr(product, "sizes", []):
+                    if size.size_id in warehouse_entries:
+                        qty = warehouse_entries[size.size_id]["count"]
+                        quota_dict[src_id]["src"] -= qty
+                        quota_dict[dst_id]["dst"] -= qty
+                        entry = (product.product_wb_id, qty, size_map[size.size_id], src_id, dst_id)
+                        self.sent_product_queue.put(entry)
 
             return True
 
@@ -1222,44 +1413,31 @@ class RegularTaskFactory:
             return False
 
 
-    def _on_server_error(self):
-        if self.bad_request_count >= self.bad_request_max_count:
-            self.logger.error("Превышено количество ошибок сервера. Прерываем отправку.")
-            return False
-        
-
+    def _on_server_error(self, identity):
+        # Паузу после 5xx выдерживает ограничитель скорости учётки, остальные полосы продолжают отправку.
+        # False - учётка получила server_error_max_count ответов 5xx подряд и выходит из отправки
+        with self._quota_lock:
+            self._server_errors_in_row[identity] += 1
+            errors_in_row = self._server_errors_in_row[identity]
 
-        if self.cooldown_error_count == len(self.timeout_error_request_cooldown_list):
+        if errors_in_row >= self.server_error_max_count:
             return False
-
-        if self.send_transfer_request_cooldown < 1:
-            self.logger.debug("Установку кулдауна между запросами на 1 секунду")
-            self.send_transfer_request_cooldown = 1
-
-        cooldown = self.timeout_error_request_cooldown_list[self.timeout_error_cooldown_index]
-
-        self.logger.warning("Ошибка сервера. Кулдаун %s секунд перед повтором.", cooldown)
-        time.sleep(cooldown)
-        self.bad_request_count += 1
-        self.cooldown_error_count += 1
-        self.timeout_error_cooldown_index = (self.timeout_error_cooldown_index + 1) % len(self.timeout_error_request_cooldown_list)
+        self.logger.warning("Ошибка сервера (%s подряд для учётки). Учётка уходит на кулдаун ограничителя скорости.", errors_in_row)
         return True
 
-    def _on_bad_request(self, src_id, dst_id, quota_dict):
-        if self.bad_request_count >= self.bad_request_max_count:
-            self.logger.error("Превышено количество 4xx ошибок. Прерываем.")
-            return False
-        
-        if self.send_transfer_request_cooldown < 1:
-            self.logger.debug("Установку кулдауна между запросами на 1 секунду")
-            self.send_transfer_request_cooldown = 1
+    def _on_bad_request(self, src_id, dst_id, quota_dict, cookie_data=None):
+        with self._quota_lock:
+            if self.bad_request_count >= self.bad_request_max_count:
+                self.logger.error("Превышено количество 4xx ошибок. Прерываем.")
+                return False
 
-        self.bad_request_count += 1
+            self.bad_request_count += 1
         self.logger.error("Ошибка 4xx. Пробуем обновить квоты.")
 
         for mode, wid in [("dst", dst_id), ("src", src_id)]:
-            new_quota = self.fetch_quota_for_single_warehouse(office_id=wid, mode=mode)
-            quota_dict[wid][mode] = new_quota
+            new_quota = self.fetch_quota_for_single_warehouse(office_id=wid, mode=mode, cookie_data=cookie_data)
+            with self._quota_lock:
+                quota_dict[wid][mode] = new_quota
 
         return True
 
@@ -1346,14 +1524,13 @@ class RegularTaskFactory:
             self.logger.exception("Ошибка в create_single_size_entries: %s", e)
 
     @simple_logger(logger_name=__name__)
-    def send_transfer_request(self, request_body: dict):
+    def send_transfer_request(self, request_body: dict, cookie_data=None):
         self.logger.debug("Отправка transfer request: %s", request_body)
         try:
-            cookies = self.cookie_list[self.current_cookie_index]['cookies']
-            tokenv3 = self.cookie_list[self.current_cookie_index]['tokenV3']
-            headers = self.headers.copy()
-            headers['AuthorizeV3'] = tokenv3
-            self.current_cookie_index = (self.current_cookie_index + 1) % len(self.cookie_list) 
+            if cookie_data is None:
+                cookie_data = self._next_cookie_data()
+            identity = self.api_controller.register_cookie_identity(cookie_data, self.headers)
+            self.rate_limiter.acquire(identity, 'order')
 
             # --- МОК для отладки ---
             # class MockResponse:
@@ -1367,14 +1544,14 @@ class RegularTaskFactory:
             # ------------------------
 
             response = self.api_controller.request(
-                base_url="https://seller-weekly-report.wildberries.ru",
+                base_url=wb_seller_weekly_report_url,
                 method="POST",
                 endpoint="/ns/shifts/analytics-back/api/v1/order",
                 json=request_body,
-                cookies=cookies,
-                headers=headers)
+                identity=identity)
             
             self.logger.info("Ответ на transfer request: status=%s", getattr(response, "status_code", None))
+            self._register_response_in_rate_limiter(identity, 'order', response)
             return response
 
         except Exception as e:
@@ -1383,35 +1560,35 @@ class RegularTaskFactory:
 
 
     @simple_logger(logger_name=__name__)
-    def fetch_quota_for_single_warehouse(self,office_id, mode):
+    def fetch_quota_for_single_warehouse(self, office_id, mode, cookie_data=None):
         try:
-            cookies = self.cookie_list[self.current_cookie_index]['cookies']
-            tokenv3 = self.cookie_list[self.current_cookie_index]['tokenV3']
-            headers = self.headers.copy()
-            headers['AuthorizeV3'] = tokenv3
+            if cookie_data is None:
+                cookie_data = self.cookie_list[self.current_cookie_index]
+            identity = self.api_controller.register_cookie_identity(cookie_data, self.headers)
 
+            self.rate_limiter.acquire(identity, 'quota')
             response_opt = self.api_controller.request(
-                base_url="https://seller-weekly-report.wildberries.ru",
+                base_url=wb_seller_weekly_report_url,
                 method="OPTIONS",
                 endpoint="/ns/shifts/analytics-back/api/v1/quota",
                 params={"officeID": office_id, "type": mode},
-                cookies=cookies,
-                headers=headers)
+                identity=identity)
                             
             self.logger.debug("OPTIONS квоты отправлен office_id=%s mode=%s", office_id, mode)
 
             if response_opt.status_code not in [200, 201, 202, 204]:
                 raise RuntimeError(f"Unexpected status code on OPTIONS quota request: {response_opt.status_code}")
 
-            response = self.api_controller.request(base_url="https://seller-weekly-report.wildberries.ru",
+            self.rate_limiter.acquire(identity, 'quota')
+            response = self.api_controller.request(base_url=wb_seller_weekly_report_url,
                                                     method="GET",
                                                     endpoint="/ns/shifts/analytics-back/api/v1/quota",
                                                     params={"officeID": office_id, "type": mode},
-                                                    cookies=cookies,
-                                                    headers=headers)
+                                                    identity=identity)
             
             self.logger.debug("GET квоты получен office_id=%s mode=%s status=%s",
                                 office_id, mode, getattr(response, "status_code", None))
+            self._register_response_in_rate_limiter(identity, 'quota', response)
 
             response_json = response.json()
             response_data = response_json.get("data", {})
@@ -1421,29 +1598,35 @@ class RegularTaskFactory:
         
         except:
             self.logger.exception("Ошибка при запросе квоты для office_id=%s mode=%s", office_id, mode)
-            self.bad_request_count +=1
+            with self._quota_lock:
+                self.bad_request_count +=1
             return 0
 
+    def _register_response_in_rate_limiter(self, identity, endpoint, response):
+        """
+        Передаёт статус ответа (и Retry-After) в ограничитель скорости учётки.
+        """
+        status_code = getattr(response, "status_code", None)
+        headers = getattr(response, "headers", None) or {}
+        self.rate_limiter.on_response(identity, endpoint, status_code,
+                                      retry_after=parse_retry_after(headers.get("Retry-After")))
+
+    def _next_cookie_data(self):
+        """
+        Возвращает следующую cookie-учётку по кругу (для вызовов вне полос отправки).
+        """
+        with self._quota_lock:
+            cookie_data = self.cookie_list[self.current_cookie_index]
+            self.current_cookie_index = (self.current_cookie_index + 1) % len(self.cookie_list)
+        return cookie_data
+
 
     def product_on_the_way_consumer(self):
         """
-        Функция-потребитель для обработки очереди отправленных продуктов.
+        Функция-потребитель для обработки очереди отправленных продуктов: пишет в БД пакетами
+        (по размеру, по времени ожидания и при остановке), не задерживая отправку заявок.
         """
-        while True:
-            try:
-                item = self.sent_product_queue.get(timeout=600)  # Ждем элемент с таймаутом
-                if item is None:  # Проверка на сигнал завершения
-                    self.sent_product_queue.task_done()
-                    break
-                self.logger.debug(f"Запись отправленного продукта в БД: {item}")
-                items = [item]
-                self.db_controller.insert_products_on_the_way(items=items)
-                self.sent_product_queue.task_done()
-                self.logger.info(f"Продукт успешно добавлен в БД: {item}")
-            except queue.Empty:
-                continue
-            except Exception as e:
-                self.logger.exception("Ошибка при обработке элемента очереди: %s", e)
+        self.products_on_the_way_writer.run()
 
 
 
@@ -0,0 +1,152 @@
+from collections import defaultdict
+from collections.abc import Mapping
+from typing import Any, Dict, FrozenSet, Hashable, Iterable, List, Optional, Tuple
+
+_NO_BLOCKS: FrozenSet[int] = frozenset()
+
+
+def sort_by_priority(priority_dict: Dict[Any, Dict[str, Any]], key: str) -> List[Any]:
+    """
+    id из priority_dict по возрастанию priority_dict[id][key]. id с None не отбрасываются, а идут в конец:
+    они тоже участвуют в перераспределении остатков.
+    """
+    def sort_key(item):
+        value = priority_dict[item].get(key)
+        if value is None:
+            return (1, 999999)  # None значения идут после
+        return (0, value)       # Обычные значения идут сначала
+
+    return sorted(priority_dict.keys(), key=sort_key)
+
+
+def rank_map(order: Iterable[Hashable]) -> Dict[Hashable, int]:
+    """
+    id -> позиция в order (первое вхождение, как list.index).
+    """
+    ranks: Dict[Hashable, int] = {}
+    for position, item in enumerate(order):
+        ranks.setdefault(item, position)
+    return ranks
+
+
+class RankOrder:
+    """
+    Стабильная сортировка ключей словаря по рангу, ключи без ранга - в конце.
+    Порядок запоминается по набору ключей: у размеров одного каталога набор регионов почти всегда один и тот же,
+    и сортируется он один раз, а не для каждого размера.
+    """
+
+    def __init__(self, ranks: Dict[Hashable, Any]):
+        self.ranks = ranks
+        self._orders: Dict[Tuple[Hashable, ...], Tuple[Hashable, ...]] = {}
+
+    def sort_dict(self, items: Dict[Hashable, Any]) -> Dict[Hashable, Any]:
+        keys = tuple(items)
+        order = self._orders.get(keys)
+        if order is None:
+            order = tuple(sorted(keys, key=lambda item: self.ranks.get(item, float("inf"))))
+            self._orders[keys] = order
+        return {item: items[item] for item in order}
+
+
+class SessionTopology:
+    """
+    Топология сессии планирования: порядки и ранги регионов и складов, склады регионов в порядке приоритета,
+    регионы-доноры для каждого региона-получателя, квоты по регионам и блокировки складов по SKU.
+    Собирается один раз в create_task_for_product после фильтрации складов по квотам
+    (remove_unavailable_warehouses_from_current_session) и дальше только читается всеми стадиями расчёта.
+    """
+
+    def __init__(self,
+                 region_priority_dict: Dict[int, Dict[str, Any]],
+                 warehouse_priority_dict: Dict[int, Dict[str, Any]],
+                 warehouses_available_to_stock_transfer: Dict[int, List[int]],
+                 quota_dict: Dict[int, Dict[str, int]],
+                 blocked_warehouses_for_skus: Optional[Dict[str, List[int]]],
+                 size_map: Optional[Dict[str, int]] = None):
+        # Порядки и ранги
+        self.region_src_order = sort_by_priority(region_priority_dict, 'src_priority')
+        self.region_dst_order = sort_by_priority(region_priority_dict, 'dst_priority')
+        self.warehouse_src_order = sort_by_priority(warehouse_priority_dict, 'src_priority')
+        self.warehouse_dst_order = sort_by_priority(warehouse_priority_dict, 'dst_priority')
+        self.warehouse_src_rank = rank_map(self.warehouse_src_order)
+        self.warehouse_dst_rank = rank_map(self.warehouse_dst_order)
+
+        # Квоты
+        self.warehouse_region = {wh_id: region_id
+                                 for region_id, wh_ids in warehouses_available_to_stock_transfer.items()
+                                 for wh_id in wh_ids}
+        self.src_warehouses_with_quota = {wh_id: quota_dict.get(wh_id, {}).get('src', 0) for wh_id in self.warehouse_src_order}
+        self.dst_warehouses_with_quota = {wh_id: quota_dict.get(wh_id, {}).get('dst', 0) for wh_id in self.warehouse_dst_order}
+        self.src_quota_by_region: Dict[int, int] = defaultdict(int)
+        self.dst_quota_by_region: Dict[int, int] = defaultdict(int)
+        for wh_id, region_id in self.warehouse_region.items():
+            self.src_quota_by_region[region_id] += quota_dict.get(wh_id, {}).get('src', 0) or 0
+            self.dst_quota_by_region[region_id] += quota_dict.get(wh_id, {}).get('dst', 0) or 0
+
+        # Склады регионов в порядке приоритета
+        region_warehouses = {region_id: set(wh_ids or [])
+                             for region_id, wh_ids in warehouses_available_to_stock_transfer.items()}
+        self.src_warehouses_by_region = {region_id: tuple(wh_id for wh_id in self.warehouse_src_order if wh_id in wh_ids)
+                                         for region_id, wh_ids in region_warehouses.items()}
+        self.dst_warehouses_by_region = {region_id: tuple(wh_id for wh_id in self.warehouse_dst_order if wh_id in wh_ids)
+                                         for region_id, wh_ids in region_warehouses.items()}
+        # Склады-приёмщики с квотой > 0 (в порядке dst-приоритета)
+        self.receiving_warehouses_by_region = {region_id: tuple(wh_id for wh_id, quota in self.dst_warehouses_with_quota.items()
+                                                                if (quota or 0) > 0 and wh_id in wh_ids)
+                                               for region_id, wh_ids in region_warehouses.items()}
+
+        # Регионы-доноры для региона-получателя: src-порядок без самого получателя и без регионов без квоты на отгрузку
+        donors = [region_id for region_id in self.region_src_order if self.src_quota_by_region.get(region_id, 0) > 0]
+        self.donor_regions_by_dst = {region_id: tuple(src_region_id for src_region_id in donors if src_region_id != region_id)
+                                     for region_id in self.region_dst_order}
+
+        # Блокировки по SKU ("nmId_sizeId") - множества. Не словарь - ошибка при обращении, как раньше на каждом товаре
+        if isinstance(blocked_warehouses_for_skus, Mapping):
+            self.blocked_by_sku: Optional[Dict[str, FrozenSet[int]]] = {sku: frozenset(wh_ids or ())
+                                                                        for sku, wh_ids in blocked_warehouses_for_skus.items()}
+        else:
+            self.blocked_by_sku = None
+
+        self.size_map_reversed = {v: k for k, v in (size_map or {}).items()}
+
+    def blocked_for(self, nm_id, size_id) -> FrozenSet[int]:
+        return self.blocked_by_sku.get(f"{nm_id}_{size_id}", _NO_BLOCKS)
+
+    def donor_regions(self, dst_region_id) -> Tuple[int, ...]:
+        return self.donor_regions_by_dst.get(dst_region_id, ())
+
+    def src_warehouses_for_sku(self, region_id, nm_id, size_id) -> Tuple[int, ...]:
+        """
+        Склады региона-донора в порядке src-приоритета без заблокированных для SKU.
+        """
+        allowed = self.src_warehouses_by_region.get(region_id, ())
+        blocked = self.blocked_for(nm_id, size_id)
+        if blocked:
+            return tuple(wh_id for wh_id in allowed if wh_id not in blocked)
+        return allowed
+
+    def can_receive(self, region_id, nm_id, size_id) -> bool:
+        """
+        Есть ли в регионе склад-приёмщик с квотой, не заблокированный для SKU.
+        """
+        receiving = self.receiving_warehouses_by_region.get(region_id, ())
+        if not receiving:
+            return False
+        blocked = self.blocked_for(nm_id, size_id)
+        return any(wh_id not in blocked for wh_id in receiving)
+
+    def order_src(self, wh_ids: Iterable[int]) -> List[int]:
+        """
+        Склады из wh_ids, которые есть в src-порядке, в этом порядке.
+        """
+        return sorted({wh_id for wh_id in wh_ids if wh_id in self.warehouse_src_rank}, key=self.warehouse_src_rank.__getitem__)
+
+    def order_dst(self, wh_ids: Iterable[int]) -> List[int]:
+        return sorted({wh_id for wh_id in wh_ids if wh_id in self.warehouse_dst_rank}, key=self.warehouse_dst_rank.__getitem__)
+
+    def dst_rank(self, wh_id) -> float:
+        """
+        Позиция склада в dst-порядке; склады без приоритета - в конец.
+        """
+        return self.warehouse_dst_rank.get(wh_id, float("inf"))
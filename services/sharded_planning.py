@@ -0,0 +1,91 @@
+import zlib
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+class ShardDataFetcher:
+    """
+    Часть DBDataFetcher, которая нужна планированию в процессе-воркере: chrtID и запреты складов только по nmID шарда.
+    Сам DBDataFetcher (соединения с БД) в воркер не передаётся.
+    """
+
+    def __init__(self, techsize_with_chrtid_dict: Dict[int, Dict[str, int]], banned_warehouses_for_nmids: Dict[int, List[int]]):
+        self.techsize_with_chrtid_dict = techsize_with_chrtid_dict
+        self.banned_warehouses_for_nmids = banned_warehouses_for_nmids
+
+
+def shard_of(nm_id, workers: int) -> int:
+    """
+    Номер шарда по nmId, одинаковый во всех процессах и запусках (без hash() со случайной солью).
+    """
+    if isinstance(nm_id, int):
+        return nm_id % workers
+    return zlib.crc32(str(nm_id).encode()) % workers
+
+
+def shard_products(products: Sequence[Dict[str, Any]], workers: int,
+                   product_indices: Optional[Sequence[int]] = None) -> List[List[int]]:
+    """
+    Индексы товаров (всех или product_indices) по шардам; внутри шарда - в исходном порядке. Пустые шарды отбрасываются.
+    """
+    shards: List[List[int]] = [[] for _ in range(workers)]
+    for product_index in (range(len(products)) if product_indices is None else product_indices):
+        product = products[product_index]
+        nm_id = product.get("wb_article_id") if isinstance(product, dict) else None
+        shards[shard_of(nm_id, workers)].append(product_index)
+    return [shard for shard in shards if shard]
+
+
+def build_shard_payload(products: Sequence[Dict[str, Any]], product_indices: List[int], task_row, topology,
+                        quota_dict, size_map, db_data_fetcher, allocation_engine: str, logger_name: str) -> Dict[str, Any]:
+    """
+    Всё, что нужно plan_shard: товары шарда с глобальными индексами и снимки топологии, квот и справочников.
+    """
+    shard = [(product_index, products[product_index]) for product_index in product_indices]
+    nm_ids = {product.get("wb_article_id") for _, product in shard if isinstance(product, dict)}
+    chrtids = db_data_fetcher.techsize_with_chrtid_dict or {}
+    banned = db_data_fetcher.banned_warehouses_for_nmids or {}
+    return {"products": shard,
+            "task_row": task_row,
+            "topology": topology,
+            "quota_dict": quota_dict,
+            "size_map": size_map,
+            "techsize_with_chrtid_dict": {nm_id: chrtids[nm_id] for nm_id in nm_ids if nm_id in chrtids},
+            "banned_warehouses_for_nmids": {nm_id: banned[nm_id] for nm_id in nm_ids if nm_id in banned},
+            "allocation_engine": allocation_engine,
+            "logger_name": logger_name}
+
+
+def plan_shard(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Точка входа воркера: планирует товары шарда тем же кодом, что и последовательный расчёт,
+    и возвращает заявки по глобальному индексу каждого товара (в том числе пустые - они тоже попадают в кеш планов),
+    родитель сливает их в исходном порядке.
+    """
+    import logging
+
+    from services.regular_task_factory import RegularTaskFactory
+
+    factory = RegularTaskFactory(db_controller=None,
+                                 api_controller=None,
+                                 db_data_fetcher=ShardDataFetcher(payload["techsize_with_chrtid_dict"],
+                                                                  payload["banned_warehouses_for_nmids"]),
+                                 cookie_jar=None,
+                                 headers={},
+                                 logger=logging.getLogger(payload["logger_name"]),
+                                 size_map=payload["size_map"],
+                                 cookie_list=[],
+                                 allocation_engine=payload["allocation_engine"],
+                                 planning_workers=0)
+    topology = payload["topology"]
+    factory.topology = topology
+    shard = payload["products"]
+    allocation_plan = factory._prepare_allocation_plan([product for _, product in shard], payload["task_row"], topology)
+
+    request_bodies: List[Tuple[int, List[Dict[str, Any]]]] = []
+    for local_index, (product_index, product) in enumerate(shard):
+        start = len(factory.all_request_bodies_to_send)
+        factory._plan_product(local_index, product, allocation_plan, payload["task_row"], topology,
+                              payload["quota_dict"], payload["size_map"])
+        request_bodies.append((product_index, factory.all_request_bodies_to_send[start:]))
+
+    return {"request_bodies": request_bodies, "products_with_missing_chrtids": factory.products_with_missing_chrtids}
@@ -0,0 +1,86 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, Hashable, List, Optional
+
+
+@dataclass(order=True)
+class RetryItem:
+    due_at: float # Момент (monotonic), раньше которого заявку не отправляем
+    seq: int # Порядок постановки - для стабильной сортировки при равном due_at
+    idx: int = field(compare=False) # Номер заявки в исходном списке
+    req_data: Dict[str, Any] = field(compare=False)
+    attempt: int = field(compare=False) # Сколько попыток уже сделано
+
+
+class TransferRetryQueue:
+    """
+    Отложенная очередь повторов заявок на трансфер.
+    Задержка - экспоненциальный бэкофф с полным джиттером по учётке, но не меньше Retry-After.
+    """
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._heap: List[RetryItem] = []
+        self._seq = itertools.count()
+        self._identity_failures: Dict[Hashable, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+        self.scheduled_count = 0
+        self.dropped: List[Dict[str, Any]] = [] # Заявки, исчерпавшие попытки
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._heap)
+
+    def compute_delay(self, identity: Hashable, retry_after: Optional[float] = None) -> float:
+        with self._lock:
+            failures = self._identity_failures[identity]
+        backoff = min(self.max_delay, self.base_delay * (2 ** failures))
+        delay = random.uniform(0, backoff)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def schedule(self, idx: int, req_data: Dict[str, Any], attempt: int, identity: Hashable,
+                 retry_after: Optional[float] = None) -> Optional[float]:
+        """
+        Ставит заявку на повтор. Возвращает задержку или None, если попытки исчерпаны.
+        """
+        if attempt >= self.max_attempts:
+            with self._lock:
+                self.dropped.append(req_data)
+            return None
+
+        delay = self.compute_delay(identity, retry_after)
+        with self._lock:
+            self._identity_failures[identity] += 1
+            heapq.heappush(self._heap, RetryItem(due_at=time.monotonic() + delay,
+                                                 seq=next(self._seq),
+                                                 idx=idx,
+                                                 req_data=req_data,
+                                                 attempt=attempt))
+            self.scheduled_count += 1
+        return delay
+
+    def on_identity_success(self, identity: Hashable):
+        with self._lock:
+            self._identity_failures[identity] = 0
+
+    def pop_due(self) -> Optional[RetryItem]:
+        with self._lock:
+            if self._heap and self._heap[0].due_at <= time.monotonic():
+                return heapq.heappop(self._heap)
+            return None
+
+    def next_due_in(self) -> Optional[float]:
+        with self._lock:
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0].due_at - time.monotonic())
@@ -1,4 +1,6 @@
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import time
 from requests.cookies import RequestsCookieJar
 from typing import Dict, Union, List, Optional, Tuple
@@ -10,8 +12,10 @@ from models.tasks import ProductToTask, TaskWithProducts, ProductSizeInfo
 
 # Зависимости
 from infrastructure.api.sync_controller import SyncAPIController
+from infrastructure.api.rate_limiter import RateLimiter, parse_retry_after
 from infrastructure.db.mysql.mysql_controller import MySQLController
 from services.db_data_fetcher import DBDataFetcher
+from utils.config import wb_seller_weekly_report_url, rate_limits
 
 
 class OneTimeTaskProcessor:
@@ -21,7 +25,10 @@ class OneTimeTaskProcessor:
                  db_data_fetcher: DBDataFetcher,
                  cookie_jar: RequestsCookieJar,
                  headers: Dict,
-                 logger):
+                 logger,
+                 cookie_list: Optional[list] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 stock_prefetch_concurrency: int = 8):
         self.api_controller = api_controller
         self.db_controller = db_controller
         self.db_data_fetcher = db_data_fetcher
@@ -29,6 +36,11 @@ class OneTimeTaskProcessor:
         self.headers = headers
         self.logger = logger
         self.bad_request_count = 0
+        self.cookie_list = cookie_list or []
+        self.rate_limiter = rate_limiter or RateLimiter(endpoint_limits=rate_limits) # Темп запросов по (учётка, эндпоинт)
+        self.stock_prefetch_concurrency = stock_prefetch_concurrency
+        self._stocks_cache = {} # nmID -> {officeID: inStock} на время прогона
+        self._stocks_cache_lock = threading.Lock()
 
 
     def process_one_time_tasks(self, quota_dict, office_id_list):
@@ -50,138 +62,151 @@ class OneTimeTaskProcessor:
 
             self.logger.info("Квоты складов получены: %s записей", len(quota_dict))
 
+            self.prefetch_stocks(tasks)
+
         except Exception as e:
             self.logger.exception("Ошибка обработке разовых заданий: %s", e)
 
         # Пошли обрабатывать задания
-        for task_idx, task in enumerate(tasks.values(), start=1):
-            self.logger.info("Обработка задания #%s", task_idx)
-
-            try:
-                # Проверяем, есть ли для задания квоты на перемещение
-                available_warehouses_from_ids, available_warehouses_to_ids = self.get_available_warehouses_by_quota(quota_dict=quota_dict, task=task)
-                self.logger.debug("Доступные склады-источники: %s; склады-получатели: %s",
-                                  available_warehouses_from_ids, available_warehouses_to_ids)
-                if not available_warehouses_from_ids or not available_warehouses_to_ids:
-                    self.logger.warning("Нет доступных складов по квотам. Пропускаю задание.")
-                    continue
+        # Прогресс заданий и отправленные позиции пишутся в БД одной транзакцией в конце прогона
+        # (в finally - чтобы уже отправленные заявки не потерялись при ошибке посередине)
+        processed_tasks = []
+        run_products_on_the_way = []
+        try:
+            for task_idx, task in enumerate(tasks.values(), start=1):
+                self.logger.info("Обработка задания #%s", task_idx)
 
-            except Exception as e:
-                self.logger.exception("Ошибка при определении доступных складов: %s", e)
-                continue
+                try:
+                    # Проверяем, есть ли для задания квоты на перемещение
+                    available_warehouses_from_ids, available_warehouses_to_ids = self.get_available_warehouses_by_quota(quota_dict=quota_dict, task=task)
+                    self.logger.debug("Доступные склады-источники: %s; склады-получатели: %s",
+                                      available_warehouses_from_ids, available_warehouses_to_ids)
+                    if not available_warehouses_from_ids or not available_warehouses_to_ids:
+                        self.logger.warning("Нет доступных складов по квотам. Пропускаю задание.")
+                        continue
 
-            # По каждому продукту в задании проводим итерацию
-            for product_idx, product in enumerate(getattr(task, "products", []) , start=1):
-                self.logger.info("Задание #%s: обработка продукта #%s (nmID=%s)", task_idx, product_idx, getattr(product, "product_wb_id", None))
-                
+                except Exception as e:
+                    self.logger.exception("Ошибка при определении доступных складов: %s", e)
+                    continue
+
+                # Отправленные позиции всего задания (по всем продуктам)
                 products_on_the_way_array = []
 
-                try:
-                    # Cмотрим остатки по всем складам
-                    product_stocks = self.fetch_stocks_by_nmid(nmid=product.product_wb_id,
-                                                               warehouses_in_task_list=available_warehouses_from_ids)
-                    
-                    self.logger.debug("Стоки для nmID=%s: %s", getattr(product, "product_wb_id", None), product_stocks)
+                # По каждому продукту в задании проводим итерацию
+                for product_idx, product in enumerate(getattr(task, "products", []) , start=1):
+                    self.logger.info("Задание #%s: обработка продукта #%s (nmID=%s)", task_idx, product_idx, getattr(product, "product_wb_id", None))
 
-                except Exception as e:
-                    self.logger.exception("Ошибка при получении стоков для продукта nmID=%s: %s", getattr(product, "product_wb_id", None), e)
-                    product_stocks = None
+                    try:
+                        # Cмотрим остатки по всем складам
+                        product_stocks = self.fetch_stocks_by_nmid(nmid=product.product_wb_id,
+                                                                   warehouses_in_task_list=available_warehouses_from_ids)
+                    
+                        self.logger.debug("Стоки для nmID=%s: %s", getattr(product, "product_wb_id", None), product_stocks)
 
-                # Если нет остатков
-                if not product_stocks:
-                    self.logger.info("Остатков нет для nmID=%s. Пропуск.", getattr(product, "product_wb_id", None))
-                    continue
+                    except Exception as e:
+                        self.logger.exception("Ошибка при получении стоков для продукта nmID=%s: %s", getattr(product, "product_wb_id", None), e)
+                        product_stocks = None
 
-                # Для каждого склада донора из доступных
-                for src_warehouse_id in available_warehouses_from_ids:
-                    warehouse_quota_src = quota_dict[src_warehouse_id]['src']  # Если квота на нуле, пропускаем
-                    if warehouse_quota_src < 1:
-                        self.logger.debug(f"Недостаточно квоты на складе-доноре. src: {src_warehouse_id} - {src_warehouse_quota}")
+                    # Если нет остатков
+                    if not product_stocks:
+                        self.logger.info("Остатков нет для nmID=%s. Пропуск.", getattr(product, "product_wb_id", None))
                         continue
 
-                    self.logger.debug("Обработка склада-донора src_warehouse_id=%s", src_warehouse_id)
-                    current_warehouse_transfer_request_bodies = defaultdict(dict)  # Записи трансфера по донору на каждое наставление
+                    # Для каждого склада донора из доступных
+                    for src_warehouse_id in available_warehouses_from_ids:
+                        warehouse_quota_src = quota_dict[src_warehouse_id]['src']  # Если квота на нуле, пропускаем
+                        if warehouse_quota_src < 1:
+                            self.logger.debug(f"Недостаточно квоты на складе-доноре. src: {src_warehouse_id} - {src_warehouse_quota}")
+                            continue
 
-                    for size in getattr(product, "sizes", []):
-                        try:
-                            if size.transfer_qty_left_virtual <= 0:
-                                self.logger.debug("Размер %s: transfer_qty_left_virtual<=0, пропуск", getattr(size, "size_id", None))
-                                continue
+                        self.logger.debug("Обработка склада-донора src_warehouse_id=%s", src_warehouse_id)
+                        current_warehouse_transfer_request_bodies = defaultdict(dict)  # Записи трансфера по донору на каждое наставление
 
-                            self.logger.debug("Создание позиций для size_id=%s (осталось виртуально=%s)",
-                                              getattr(size, "size_id", None), getattr(size, "transfer_qty_left_virtual", None))
-
-                            # Заполняем записи под размер
-                            self.create_single_size_entries(
-                                src_warehouse_id=src_warehouse_id,
-                                size=size,
-                                product_stocks=product_stocks,
-                                available_warehouses_to_ids=available_warehouses_to_ids,
-                                quota_dict=quota_dict,
-                                task=task,
-                                current_warehouse_transfer_request_bodies=current_warehouse_transfer_request_bodies)
+                        for size in getattr(product, "sizes", []):
+                            try:
+                                if size.transfer_qty_left_virtual <= 0:
+                                    self.logger.debug("Размер %s: transfer_qty_left_virtual<=0, пропуск", getattr(size, "size_id", None))
+                                    continue
+
+                                self.logger.debug("Создание позиций для size_id=%s (осталось виртуально=%s)",
+                                                  getattr(size, "size_id", None), getattr(size, "transfer_qty_left_virtual", None))
+
+                                # Заполняем записи под размер
+                                self.create_single_size_entries(
+                                    src_warehouse_id=src_warehouse_id,
+                                    size=size,
+                                    product_stocks=product_stocks,
+                                    available_warehouses_to_ids=available_warehouses_to_ids,
+                                    quota_dict=quota_dict,
+                                    task=task,
+                                    current_warehouse_transfer_request_bodies=current_warehouse_transfer_request_bodies)
                             
-                        except Exception as e:
-                            self.logger.exception("Ошибка при создании записей для size_id=%s: %s", getattr(size, "size_id", None), e)
-
-                    for dst_warehouse_id, warehouse_entries in current_warehouse_transfer_request_bodies.items():
-
-                        dst_warehouse_quota = quota_dict[dst_warehouse_id]['dst'] # Если квота на нуле, пропускаем
-                        src_warehouse_quota = quota_dict[src_warehouse_id]['src']
+                            except Exception as e:
+                                self.logger.exception("Ошибка при создании записей для size_id=%s: %s", getattr(size, "size_id", None), e)
 
-                        if dst_warehouse_quota < 1 or src_warehouse_quota < 1:
-                            self.logger.debug(f"На одном из складов. src: {src_warehouse_id} - {src_warehouse_quota} | dst: {dst_warehouse_id} - {dst_warehouse_quota}")
+                        for dst_warehouse_id, warehouse_entries in current_warehouse_transfer_request_bodies.items():
 
-                            continue
+                            dst_warehouse_quota = quota_dict[dst_warehouse_id]['dst'] # Если квота на нуле, пропускаем
+                            src_warehouse_quota = quota_dict[src_warehouse_id]['src']
 
-                        try:
-                            self.logger.debug("Формирование тела заявки: src=%s -> dst=%s; entries=%s",
-                                              src_warehouse_id, dst_warehouse_id, warehouse_entries)
+                            if dst_warehouse_quota < 1 or src_warehouse_quota < 1:
+                                self.logger.debug(f"На одном из складов. src: {src_warehouse_id} - {src_warehouse_quota} | dst: {dst_warehouse_id} - {dst_warehouse_quota}")
 
-                            warehouse_req_body = self.create_transfer_request_body(
-                                src_warehouse_id=src_warehouse_id,
-                                dst_wrh_id=dst_warehouse_id,
-                                product=product,
-                                warehouse_entries=warehouse_entries)
+                                continue
 
-                            self.logger.info("Готово тело заявки для отправки: %s", warehouse_req_body)
                             try:
-                                self.logger.debug(f"POST: {warehouse_req_body}")
-                                self.logger.debug("Отправка заявки: %s", warehouse_req_body)
-
-                                response = self.send_transfer_request(warehouse_req_body)
-                                if response.status_code in [200, 201, 202, 204]:
-                                # mock_true = True
-                                # if mock_true:
-                                    for size in getattr(product, "sizes", []):
-                                        if size.size_id in warehouse_entries:
-                                            size.transfer_qty_left_real -= warehouse_entries[size.size_id]['count']
-                                            self.logger.debug(
-                                                "Обновлен transfer_qty_left_real для size_id=%s: -%s",
-                                                size.size_id, warehouse_entries[size.size_id]['count'])
-                                            quota_dict[src_warehouse_id]['src'] -= warehouse_entries[size.size_id]['count']
-                                            quota_dict[dst_warehouse_id]['dst'] -= warehouse_entries[size.size_id]['count']
-
-                                            product_on_the_way_entry = (product.product_wb_id, warehouse_entries[size.size_id]['count'], size.size_id, src_warehouse_id, dst_warehouse_id)
+                                self.logger.debug("Формирование тела заявки: src=%s -> dst=%s; entries=%s",
+                                                  src_warehouse_id, dst_warehouse_id, warehouse_entries)
+
+                                warehouse_req_body = self.create_transfer_request_body(
+                                    src_warehouse_id=src_warehouse_id,
+                                    dst_wrh_id=dst_warehouse_id,
+                                    product=product,
+                                    warehouse_entries=warehouse_entries)
+
+                                self.logger.info("Готово тело заявки для отправки: %s", warehouse_req_body)
+                                try:
+                                    self.logger.debug(f"POST: {warehouse_req_body}")
+                                    self.logger.debug("Отправка заявки: %s", warehouse_req_body)
+
+                                    response = self.send_transfer_request(warehouse_req_body)
+                                    if response.status_code in [200, 201, 202, 204]:
+                                    # mock_true = True
+                                    # if mock_true:
+                                        for size in getattr(product, "sizes", []):
+                                            if size.size_id in warehouse_entries:
+                                                size.transfer_qty_left_real -= warehouse_entries[size.size_id]['count']
+                                                self.logger.debug(
+                                                    "Обновлен transfer_qty_left_real для size_id=%s: -%s",
+                                                    size.size_id, warehouse_entries[size.size_id]['count'])
+                                                quota_dict[src_warehouse_id]['src'] -= warehouse_entries[size.size_id]['count']
+                                                quota_dict[dst_warehouse_id]['dst'] -= warehouse_entries[size.size_id]['count']
+
+                                                product_on_the_way_entry = (product.product_wb_id, warehouse_entries[size.size_id]['count'], size.size_id, src_warehouse_id, dst_warehouse_id)
                                             
-                                            products_on_the_way_array.append(product_on_the_way_entry)
-                                else:
-                                    self.bad_request_count += 1
+                                                products_on_the_way_array.append(product_on_the_way_entry)
+                                        self.invalidate_stocks(product.product_wb_id) # Остатки по nmID изменились - в следующем задании запросим заново
+                                    else:
+                                        self.bad_request_count += 1
                                             
-                            except Exception as e:
-                                self.logger.exception("Ошибка при отправке запроса: %s", e)
+                                except Exception as e:
+                                    self.logger.exception("Ошибка при отправке запроса: %s", e)
 
-                        except Exception as e:
-                            self.logger.exception("Ошибка при подготовке/отправке заявки src=%s dst=%s: %s",
-                                                  src_warehouse_id, dst_warehouse_id, e)
-
-            try:
-                if products_on_the_way_array:
-                    self.db_controller.insert_products_on_the_way(items=products_on_the_way_array)
-                self.db_controller.update_transfer_qty_from_task(task)  # Тут в БД несем задания
-                self.logger.info("Задание #%s: обновлены количества трансферов в БД", task_idx)
-            except Exception as e:
-                self.logger.exception("Ошибка при обновлении задания #%s в БД: %s", task_idx, e)
+                            except Exception as e:
+                                self.logger.exception("Ошибка при подготовке/отправке заявки src=%s dst=%s: %s",
+                                                      src_warehouse_id, dst_warehouse_id, e)
+
+                processed_tasks.append(task)
+                run_products_on_the_way.extend(products_on_the_way_array)
+                self.logger.info("Задание #%s обработано, отправлено позиций: %s", task_idx, len(products_on_the_way_array))
+        finally:
+            if processed_tasks:
+                saved = self.db_controller.save_one_time_task_progress(tasks=processed_tasks,
+                                                                       products_on_the_way_items=run_products_on_the_way)
+                if saved:
+                    self.logger.info("В БД записан прогресс %s заданий и %s позиций в пути", len(processed_tasks), len(run_products_on_the_way))
+                else:
+                    self.logger.error("Не удалось записать в БД прогресс %s заданий", len(processed_tasks))
 
         self.logger.info("Завершение process_one_time_tasks()")
 
@@ -209,7 +234,7 @@ class OneTimeTaskProcessor:
         self.logger.debug("Запрос списка складов по nmID=%s", random_present_nmid)
         try:
             response = self.api_controller.request(
-                base_url="https://seller-weekly-report.wildberries.ru",
+                base_url=wb_seller_weekly_report_url,
                 method="GET",
                 endpoint="/ns/shifts/analytics-back/api/v1/stocks",
                 params={"nmID": str(random_present_nmid)},
@@ -238,7 +263,7 @@ class OneTimeTaskProcessor:
                 try:
                     time.sleep(0.5)
                     self.api_controller.request(
-                        base_url="https://seller-weekly-report.wildberries.ru",
+                        base_url=wb_seller_weekly_report_url,
                         method="OPTIONS",
                         endpoint="/ns/shifts/analytics-back/api/v1/quota",
                         params={"officeID": office_id, "type": mode},
@@ -249,7 +274,7 @@ class OneTimeTaskProcessor:
 
                     time.sleep(0.5)
                     response = self.api_controller.request(
-                        base_url="https://seller-weekly-report.wildberries.ru",
+                        base_url=wb_seller_weekly_report_url,
                         method="GET",
                         endpoint="/ns/shifts/analytics-back/api/v1/quota",
                         params={"officeID": office_id, "type": mode},
@@ -355,44 +380,120 @@ class OneTimeTaskProcessor:
         except Exception as e:
             self.logger.exception("Ошибка при формировании тела заявки: %s", e)
 
+    def prefetch_stocks(self, tasks) -> int:
+        """
+        Заранее забирает остатки по всем различным nmID из разовых заданий.
+        Запросы распределяются по cookie-учёткам и идут параллельно; результат кешируется на прогон.
+        """
+        nmid_list = []
+        for task in (tasks or {}).values():
+            for product in getattr(task, "products", []):
+                nmid = product.product_wb_id
+                if nmid not in nmid_list and nmid not in self._stocks_cache:
+                    nmid_list.append(nmid)
+
+        if not nmid_list:
+            return 0
+
+        identities = [self.api_controller.register_cookie_identity(cookie_data, self.headers) for cookie_data in self.cookie_list] or [None]
+        self.logger.info("Предзагрузка стоков: %s nmID через %s учёток", len(nmid_list), len(identities))
+        start_time = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=min(self.stock_prefetch_concurrency, len(nmid_list)),
+                                thread_name_prefix="stock_prefetch") as executor:
+            futures = [executor.submit(self._load_stocks_to_cache, nmid, identities[idx % len(identities)])
+                       for idx, nmid in enumerate(nmid_list)]
+            loaded = sum(1 for future in futures if future.result())
+
+        self.logger.info("Предзагружены стоки по %s из %s nmID за %.2f секунд",
+                         loaded, len(nmid_list), time.perf_counter() - start_time)
+        return loaded
+
+    def invalidate_stocks(self, nmid: int):
+        with self._stocks_cache_lock:
+            self._stocks_cache.pop(nmid, None)
+
     def fetch_stocks_by_nmid(self, nmid: int, warehouses_in_task_list: list):
         self.logger.debug("Запрос стоков по nmID=%s для складов: %s", nmid, warehouses_in_task_list)
         try:
-            response = self.api_controller.request(
-                base_url="https://seller-weekly-report.wildberries.ru",
-                method="GET",
-                endpoint="/ns/shifts/analytics-back/api/v1/stocks",
-                params={"nmID": str(nmid)},
-                cookies=self.cookie_jar,
-                headers=self.headers)
-            
-            self.logger.debug("Ответ по стокам: status=%s", getattr(response, "status_code", None))
+            with self._stocks_cache_lock:
+                stocks_by_office = self._stocks_cache.get(nmid)
+
+            if stocks_by_office is None:
+                identity = None
+                if self.cookie_list:
+                    identity = self.api_controller.register_cookie_identity(self.cookie_list[0], self.headers)
+                if not self._load_stocks_to_cache(nmid, identity):
+                    return None
+                with self._stocks_cache_lock:
+                    stocks_by_office = self._stocks_cache.get(nmid, {})
+
+            stock_by_warehouse_dict = {office_id: in_stock for office_id, in_stock in stocks_by_office.items()
+                                       if office_id in warehouses_in_task_list}
 
-            stock_by_warehouse_dict = {}
+            self.logger.info("Получены стоки по nmID=%s: %s складов", nmid, len(stock_by_warehouse_dict))
+            return stock_by_warehouse_dict
+
+        except Exception as e:
+            self.logger.exception("Ошибка в fetch_stocks_by_nmid nmID=%s: %s", nmid, e)
+            return None
+
+    def _load_stocks_to_cache(self, nmid: int, identity=None) -> bool:
+        """
+        Один GET /stocks по nmID. Без учётки запрос идёт с cookie_jar и заголовками процессора.
+        """
+        try:
+            if identity is not None:
+                self.rate_limiter.acquire(identity, 'stocks')
+                response = self.api_controller.request(
+                    base_url=wb_seller_weekly_report_url,
+                    method="GET",
+                    endpoint="/ns/shifts/analytics-back/api/v1/stocks",
+                    params={"nmID": str(nmid)},
+                    identity=identity)
+                headers = getattr(response, "headers", None) or {}
+                self.rate_limiter.on_response(identity, 'stocks', getattr(response, "status_code", None),
+                                              retry_after=parse_retry_after(headers.get("Retry-After")))
+            else:
+                response = self.api_controller.request(
+                    base_url=wb_seller_weekly_report_url,
+                    method="GET",
+                    endpoint="/ns/shifts/analytics-back/api/v1/stocks",
+                    params={"nmID": str(nmid)},
+                    cookies=self.cookie_jar,
+                    headers=self.headers)
+
+            status = getattr(response, "status_code", None)
+            self.logger.debug("Ответ по стокам nmID=%s: status=%s", nmid, status)
+            if status not in (200, 201):
+                # Неудачный ответ не кешируем, иначе nmID до конца прогона будет считаться пустым
+                self.logger.warning("Стоки по nmID=%s не получены: status=%s", nmid, status)
+                return False
+
+            stocks_by_office = {}
             response_json = response.json()
             stock_data = response_json.get("data", {})
             src_data = stock_data.get("src", [])
             for warehouse in src_data:
                 try:
-                    office_id = warehouse["officeID"]
-                    if office_id in warehouses_in_task_list:
-                        stock_by_warehouse_dict[office_id] = warehouse["inStock"]
+                    stocks_by_office[warehouse["officeID"]] = warehouse["inStock"]
                 except Exception as inner_e:
                     self.logger.exception("Ошибка парсинга склада в стоках: %s", inner_e)
                     continue
 
-            self.logger.info("Получены стоки по nmID=%s: %s складов", nmid, len(stock_by_warehouse_dict))
-            return stock_by_warehouse_dict
+            with self._stocks_cache_lock:
+                self._stocks_cache[nmid] = stocks_by_office
+            return True
 
         except Exception as e:
-            self.logger.exception("Ошибка в fetch_stocks_by_nmid nmID=%s: %s", nmid, e)
-            return None
+            self.logger.exception("Ошибка при загрузке стоков nmID=%s: %s", nmid, e)
+            return False
 
     def send_transfer_request(self, request_body: dict):
         self.logger.debug("Отправка transfer request: %s", request_body)
         try:
             response = self.api_controller.request(
-                base_url="https://seller-weekly-report.wildberries.ru",
+                base_url=wb_seller_weekly_report_url,
                 method="POST",
                 endpoint="/ns/shifts/analytics-back/api/v1/order",
                 json=request_body,
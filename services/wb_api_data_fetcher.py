@@ -1,8 +1,12 @@
 import asyncio
 import aiohttp
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from infrastructure.api.sync_controller import SyncAPIController
 from infrastructure.db.mysql.mysql_controller import MySQLController
+from infrastructure.api.rate_limiter import RateLimiter, parse_retry_after
+from services.chrtid_resolver import ChrtIdResolver
+from utils.config import rate_limits, wb_seller_weekly_report_url, wb_content_api_url, chrtid_resolver_settings
 
 class WBAPIDataFetcher:
     def __init__(self, api_controller: SyncAPIController,
@@ -11,7 +15,9 @@ class WBAPIDataFetcher:
                  wb_content_api_key,
                  headers,
                  logger,
-                 cooldown: float = 0.5):
+                 rate_limiter: RateLimiter | None = None,
+                 quota_max_concurrency: int = 16,
+                 quota_window_per_identity: int = 4):
         self.api_controller = api_controller
         self.mysql_controller = mysql_controller
         self.cookie_list = cookie_list
@@ -19,113 +25,105 @@ class WBAPIDataFetcher:
         self.headers = headers
         self.logger = logger
         self.quota_dict = None
-        self.cooldown = cooldown
-        
-        # Локи и время последнего запроса на каждый cookie
-        self._cookie_locks = [asyncio.Lock() for _ in self.cookie_list]
-        self._cookie_last_time = [0.0 for _ in self.cookie_list]
-        self.session = None
-
-
-    async def fetch_quota(self, office_id_list):
+        self.rate_limiter = rate_limiter or RateLimiter(endpoint_limits=rate_limits) # Темп запросов по (учётка, эндпоинт)
+        self.quota_max_concurrency = quota_max_concurrency # Всего запросов квот в полёте
+        self.quota_window_per_identity = quota_window_per_identity # Запросов квот в полёте на одну учётку
+        self.last_quota_fetch_elapsed = None
+        self.preflight_default_max_age = 600.0 # Сколько секунд считаем preflight действительным, если ВБ не прислал Access-Control-Max-Age
+        self._preflight_cache = {} # учётка -> момент (monotonic), до которого preflight действителен
+        self._preflight_locks = {}
+        self.identity_health = {} # учётка -> {'status', 'latency', 'score'} по результатам check_cookie_list
+        self.min_identity_weight = 0.25 # Нижняя граница веса здоровой, но медленной учётки
+
+
+    async def fetch_quota(self, office_id_list, quota_dict=None):
+        """
+        Параллельно получает квоты src/dst по всем складам.
+        Общее число запросов в полёте ограничено quota_max_concurrency, на каждую учётку - quota_window_per_identity.
+        Результаты складываются в quota_dict по мере получения (можно передать свой словарь).
+        """
         if self.quota_dict is not None:
             return self.quota_dict
 
-        tasks = []
-        modes = ['dst', 'src']
-
-        cookie_index = 0
-        cookie_count = len(self.cookie_list)
+        if not self.cookie_list:
+            self.logger.error("Список cookies пуст. Невозможно выполнить запрос квоты.")
+            return 0
 
-        # self.cookie_list.pop(-1)
-
-        async with aiohttp.ClientSession() as session:
-
-            results = []
+        modes = ['dst', 'src']
+        quota_dict = {} if quota_dict is None else quota_dict
 
-            start_time = time.perf_counter()
+        identities = [self.api_controller.register_cookie_identity(cookie_data, self.headers)
+                      for cookie_data in self.cookie_list]
 
-            self.logger.info(f"Начинаем получение лимитов по складам")
+        # Задания раскладываем по учёткам по кругу
+        jobs = [(office_id, mode, identities[job_idx % len(identities)])
+                for job_idx, (office_id, mode) in enumerate((office_id, mode) for office_id in office_id_list for mode in modes)]
 
-            for office_id in office_id_list:
-                for mode in modes:
+        self._preflight_locks = {} # asyncio-примитивы привязаны к event loop, каждый запуск создаёт свои
+        global_window = asyncio.Semaphore(self.quota_max_concurrency)
+        identity_windows = {identity: asyncio.Semaphore(self.quota_window_per_identity) for identity in identities}
 
-                    cookie_count = len(self.cookie_list)
+        async def fetch_in_window(office_id, mode, identity, session):
+            async with global_window, identity_windows[identity]:
+                return await self._fetch_single_quota(office_id, mode, identity=identity, session=session)
 
-                    for _ in range(cookie_count):
-                        if cookie_count == 0:
-                            self.logger.error("Список cookies пуст. Невозможно выполнить запрос квоты.")
-                            return 0
-                        
-                        if cookie_index >= cookie_count:
-                            cookie_index = 0
+        start_time = time.perf_counter()
+        self.logger.info("Начинаем получение лимитов по %s складам (%s запросов, %s учёток)",
+                         len(office_id_list), len(jobs), len(identities))
 
-                            
+        async with self.api_controller.async_sessions(identities) as sessions:
+            tasks = [asyncio.create_task(fetch_in_window(office_id, mode, identity, sessions.get(identity)))
+                     for office_id, mode, identity in jobs]
 
-                    cur_cookie_data = self.cookie_list[cookie_index]
-                    cur_cookies = cur_cookie_data['cookies']
-                    cur_tokenv3 = cur_cookie_data['tokenV3']
-                    tasks.append(
-                        self._fetch_single_quota(
-                            office_id, mode, cookies=cur_cookies, tokenv3=cur_tokenv3, session=session))
-                    cookie_index = (cookie_index + 1) % cookie_count
-                    
-                    current_batch_result = await asyncio.gather(*tasks)
-                    results.extend(current_batch_result)
-                    tasks = []
-
-                    if cookie_count > 0:
-                        await asyncio.sleep(self.cooldown/cookie_count)
-
-                    # if len(tasks) == cookie_count:
-                    #     current_batch_result = await asyncio.gather(*tasks)
-                    #     results.extend(current_batch_result)
-                    #     tasks = []
-                    #     await asyncio.sleep(self.cooldown)
-            
-            if tasks:
-                last_batch_results = await asyncio.gather(*tasks)
-                results.extend(last_batch_results)
+            for finished in asyncio.as_completed(tasks):
+                office_id, mode, quota = await finished
+                quota_dict.setdefault(office_id, {})[mode] = quota
 
-            # results = await asyncio.gather(*tasks)
-            end_time = time.perf_counter()
-            elapsed_time = end_time - start_time
-            self.logger.info(f"Лимиты получены за: {elapsed_time:.2f} секунд")
-
-        quota_dict = {}
-        for office_id, mode, quota in results:
-            if office_id not in quota_dict:
-                quota_dict[office_id] = {}
-            quota_dict[office_id][mode] = quota
+        self.last_quota_fetch_elapsed = time.perf_counter() - start_time
+        self.logger.info("Лимиты получены за: %.2f секунд", self.last_quota_fetch_elapsed)
 
         self.quota_dict = quota_dict
         return quota_dict
-    
-
-    async def _fetch_single_quota(self, office_id, mode, cookies, tokenv3, session:aiohttp.ClientSession):
-            
-        try:
-
-            headers = self.headers.copy()
-            headers['AuthorizeV3'] = tokenv3
 
-            session.headers.update(headers)
-            session.cookie_jar.update_cookies(cookies)
+    async def _ensure_quota_preflight(self, office_id, mode, identity, session:aiohttp.ClientSession) -> bool:
+        """
+        CORS preflight (OPTIONS) отправляется один раз на учётку и кешируется на Access-Control-Max-Age.
+        """
+        async with self._preflight_locks.setdefault(identity, asyncio.Lock()):
+            if self._preflight_cache.get(identity, 0.0) > time.monotonic():
+                return True
 
+            await self.rate_limiter.acquire_async(identity, 'quota')
             async with session.options(
-                "https://seller-weekly-report.wildberries.ru/ns/shifts/analytics-back/api/v1/quota",
+                f"{wb_seller_weekly_report_url}/ns/shifts/analytics-back/api/v1/quota",
                 params={"officeID": office_id, "type": mode}) as resp:
+                self._register_response_in_rate_limiter(identity, resp.status, resp.headers)
                 if resp.status not in (200, 201, 202, 203, 204):
-                    self.logger.error(
-                        "Ответ OPTIONS от ВБ не соответствует ожиданию, office_id=%s mode=%s",
-                        office_id, mode)
-                    return office_id, mode, -1
-                
-            await asyncio.sleep(0.1)  # Небольшая пауза между запросами
+                    return False
+                try:
+                    max_age = float(resp.headers.get("Access-Control-Max-Age", self.preflight_default_max_age))
+                except ValueError:
+                    max_age = self.preflight_default_max_age
+
+            self._preflight_cache[identity] = time.monotonic() + max_age
+            return True
+
+    async def _fetch_single_quota(self, office_id, mode, identity, session:aiohttp.ClientSession):
+        # Cookies и AuthorizeV3 уже привязаны к сессии учётки
+        quota = -1
+        try:
+
+            if not await self._ensure_quota_preflight(office_id, mode, identity, session):
+                self.logger.error(
+                    "Ответ OPTIONS от ВБ не соответствует ожиданию, office_id=%s mode=%s",
+                    office_id, mode)
+                return office_id, mode, -1
 
+            await self.rate_limiter.acquire_async(identity, 'quota')
             async with session.get(
-                "https://seller-weekly-report.wildberries.ru/ns/shifts/analytics-back/api/v1/quota",
+                f"{wb_seller_weekly_report_url}/ns/shifts/analytics-back/api/v1/quota",
                 params={"officeID": office_id, "type": mode}) as resp:
+                self._register_response_in_rate_limiter(identity, resp.status, resp.headers)
                 if resp.status not in (200, 201, 202, 203, 204):
                     self.logger.error(
                         "Ответ GET от ВБ не соответствует ожиданию, office_id=%s mode=%s",
@@ -143,6 +141,10 @@ class WBAPIDataFetcher:
                         office_id, mode)
             return office_id, mode, quota
 
+    def _register_response_in_rate_limiter(self, identity, status_code, headers, endpoint='quota'):
+        self.rate_limiter.on_response(identity, endpoint, status_code,
+                                      retry_after=parse_retry_after(headers.get("Retry-After")))
+
 
     def fetch_warehouse_list(self, random_present_nmid) -> list[int] | None:
         try:
@@ -156,20 +158,14 @@ class WBAPIDataFetcher:
                 if self.current_cookie_index >= cookie_count:
                     self.current_cookie_index = 0
 
-                cookies = self.cookie_list[self.current_cookie_index]['cookies']
-                tokenV3 = self.cookie_list[self.current_cookie_index]['tokenV3']
-
-                headers = self.headers.copy()
-                headers['AuthorizeV3'] = tokenV3
-
+                identity = self.api_controller.register_cookie_identity(self.cookie_list[self.current_cookie_index], self.headers)
 
                 response = self.api_controller.request(
-                    base_url="https://seller-weekly-report.wildberries.ru",
+                    base_url=wb_seller_weekly_report_url,
                     method="GET",
                     endpoint="/ns/shifts/analytics-back/api/v1/stocks",
                     params={"nmID": str(random_present_nmid)},
-                    cookies=cookies,
-                    headers=headers)
+                    identity=identity)
                 
                 self.logger.debug("Ответ получен: status=%s", getattr(response, "status_code", None))
 
@@ -218,7 +214,7 @@ class WBAPIDataFetcher:
 
 
                     response = self.api_controller.request(
-                        base_url="https://content-api.wildberries.ru",
+                        base_url=wb_content_api_url,
                         method="POST",
                         endpoint="/content/v2/get/cards/list",
                         json=req_body,
@@ -258,108 +254,105 @@ class WBAPIDataFetcher:
 
 
 
-    def fetch_chrtids_for_nmId_list(self, nmId_list) -> dict | None:
-        
-        chrtid_entries = []
-
-        req_attempts = 0
-
-        api_key = self.wb_content_api_key['API key']
-
-        headers = {'Authorization': api_key,
-                        'Content-Type': 'application/json'}
-
-        response_card_limit = 1
-        
-        request_cursor = {'limit':response_card_limit}
-
-        for nm_id in nmId_list:
-
-            try:
-
-                
-                req_body = {"settings": {"filter": {"withPhoto": -1,
-                                                    "nmID": nm_id},
-                                        "cursor": request_cursor}}
-
-
-                response = self.api_controller.request(
-                    base_url="https://content-api.wildberries.ru",
-                    method="POST",
-                    endpoint="/content/v2/get/cards/list",
-                    json=req_body,
-                    headers=headers)
-                
-                self.logger.debug("Ответ получен: status=%s", getattr(response, "status_code", None))
-
-                response_json = response.json()
-                cards = response_json.get("cards", [])
-                for card in cards:
-                    sizes = card.get("sizes", [])
-                    for size in sizes:
-                        tech_size = size.get("techSize", None)
-                        chrt_id = size.get("chrtID", None)
-                        nmID = card.get("nmID", None)
-                        if tech_size and chrt_id and nmID:
-                            chrt_ir_entry = {'nmID': nmID,
-                                            'techSize': tech_size,
-                                            'chrtID': chrt_id}
-                            chrtid_entries.append(chrt_ir_entry)
-
-            except Exception as e:
-                self.logger.exception("Ошибка в fetch_warehouse_list: %s", e)
-                return None
-
-        return chrtid_entries
+    def fetch_chrtids_for_nmId_list(self, nmId_list) -> list | None:
+        """
+        chrtID по списку nmID в формате [{'nmID', 'techSize', 'chrtID'}]. Запросы идут параллельно;
+        nmID, по которым запрос не удался, пропускаются, а не обрывают весь список.
+        """
+        try:
+            resolver = ChrtIdResolver(api_controller=self.api_controller,
+                                      wb_content_api_key=self.wb_content_api_key,
+                                      rate_limiter=self.rate_limiter,
+                                      **chrtid_resolver_settings)
+            return resolver.fetch_entries(nmId_list)
+        except Exception as e:
+            self.logger.exception("Ошибка в fetch_chrtids_for_nmId_list: %s", e)
+            return None
 
 
     def check_cookie_list(self, cookie_list_original, random_present_nmid):
-
+        """
+        Проверяет все cookie-учётки параллельно одним GET /stocks на каждую.
+        По задержке ответа считается health score (1.0 - самая быстрая учётка), он же становится
+        весом учётки в общем ограничителе скорости. Список складов берётся из первого успешного ответа.
+        """
         self.logger.info('Проверяем кукис на работоспособность')
 
-        cookie_list_filtered = []
-
-        all_office_id_list = []
-
-        for cookie_data in cookie_list_original:
-
-            cookies = cookie_data['cookies']
-            tokenV3 = cookie_data['tokenV3']
-
-            headers = self.headers.copy()
-            headers['AuthorizeV3'] = tokenV3
-
-
-            response = self.api_controller.request(
-                base_url="https://seller-weekly-report.wildberries.ru",
-                method="GET",
-                endpoint="/ns/shifts/analytics-back/api/v1/stocks",
-                params={"nmID": str(random_present_nmid)},
-                cookies=cookies,
-                headers=headers)
-            
-            self.logger.debug("Ответ получен: status=%s", getattr(response, "status_code", None))
-
-            time.sleep(1)
-
-            if response.status_code in (200, 201):
+        if not cookie_list_original:
+            self.cookie_list = []
+            return {'cookies': [], 'office_id_list': [], 'health': {}}
+
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(cookie_list_original), thread_name_prefix="cookie_probe") as executor:
+            futures = {executor.submit(self._probe_cookie, cookie_data, random_present_nmid): idx
+                       for idx, cookie_data in enumerate(cookie_list_original)}
+            probes = {}
+            all_office_id_list = []
+            for future in as_completed(futures):
+                try:
+                    probe = future.result()
+                except Exception as e:
+                    self.logger.exception("Ошибка проверки учётки #%s: %s", futures[future], e)
+                    continue
+                probes[futures[future]] = probe
+                if not all_office_id_list and probe['office_id_list']:
+                    all_office_id_list = probe['office_id_list']
+                    self.logger.info("Получено офисов (dst): %s", len(all_office_id_list))
 
-                cookie_list_filtered.append(cookie_data)
+        healthy = [probes[idx] for idx in sorted(probes) if probes[idx]['ok']]
+        best_latency = min((probe['latency'] for probe in healthy), default=None)
 
-                if all_office_id_list == []:
+        self.identity_health = {}
+        for idx in sorted(probes):
+            probe = probes[idx]
+            score = 0.0
+            if probe['ok']:
+                score = round(best_latency / max(probe['latency'], 1e-3), 3)
+                self.rate_limiter.set_identity_weight(probe['identity'], max(self.min_identity_weight, score))
+            else:
+                self.logger.error('Полученный ответ не соответсвует ожиданиям: учётка %s, status=%s', probe['identity'], probe['status'])
+            self.identity_health[probe['identity']] = {'status': probe['status'],
+                                                       'latency': round(probe['latency'], 3),
+                                                       'score': score}
 
-                    response_json = response.json()
-                    dst_data = response_json.get("data", {}).get("dst", [])
-                    all_office_id_list = [w.get("officeID") for w in dst_data if "officeID" in w]
-                    self.logger.info("Получено офисов (dst): %s", len(all_office_id_list))
+        # Самые здоровые учётки - первыми: по ним пойдут первые полосы отправки
+        healthy.sort(key=lambda probe: self.identity_health[probe['identity']]['score'], reverse=True)
+        cookie_list_filtered = [probe['cookie_data'] for probe in healthy]
 
-            else:
-                self.logger.error('Полученный ответ не соответсвует ожиданиям')
+        self.logger.info("Проверка %s учёток заняла %.2f секунд. Здоровье учёток: %s",
+                         len(cookie_list_original), time.perf_counter() - start_time, self.identity_health)
 
         self.cookie_list = cookie_list_filtered
-        result = {'cookies':cookie_list_filtered, 'office_id_list':all_office_id_list}
-
-        return result   
+        result = {'cookies':cookie_list_filtered, 'office_id_list':all_office_id_list, 'health': self.identity_health}
+
+        return result
+
+    def _probe_cookie(self, cookie_data, random_present_nmid) -> dict:
+        identity = self.api_controller.register_cookie_identity(cookie_data, self.headers)
+        probe = {'identity': identity, 'cookie_data': cookie_data, 'ok': False,
+                 'status': None, 'latency': 0.0, 'office_id_list': []}
+
+        self.rate_limiter.acquire(identity, 'stocks')
+        start_time = time.perf_counter()
+        response = self.api_controller.request(
+            base_url=wb_seller_weekly_report_url,
+            method="GET",
+            endpoint="/ns/shifts/analytics-back/api/v1/stocks",
+            params={"nmID": str(random_present_nmid)},
+            identity=identity)
+        probe['latency'] = time.perf_counter() - start_time
+        probe['status'] = getattr(response, "status_code", None)
+
+        self.logger.debug("Ответ получен: учётка %s, status=%s за %.3f сек", identity, probe['status'], probe['latency'])
+        self._register_response_in_rate_limiter(identity, probe['status'],
+                                                getattr(response, "headers", None) or {}, endpoint='stocks')
+
+        if probe['status'] in (200, 201):
+            probe['ok'] = True
+            try:
+                dst_data = response.json().get("data", {}).get("dst", [])
+                probe['office_id_list'] = [w.get("officeID") for w in dst_data if "officeID" in w]
+            except Exception as e:
+                self.logger.exception("Не удалось разобрать ответ /stocks для учётки %s: %s", identity, e)
 
-                
-                
\ No newline at end of file
+        return probe
@@ -0,0 +1,123 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.logger import get_logger
+
+
+class WriteBehindBatcher:
+    """
+    Отложенная пакетная запись из очереди в БД: элементы копятся и сбрасываются одним многострочным INSERT,
+    когда набрался max_batch_size, когда самый старый элемент ждёт дольше max_latency, и при остановке (None в очереди).
+    task_done() вызывается только после сброса, поэтому queue.join() по-прежнему означает "всё записано".
+    Если пакет не записался, строки повторяются по одной, чтобы одна плохая строка не потеряла остальные.
+    """
+
+    _LATENCY_EXPIRED = object() # Самый старый элемент буфера дождался max_latency
+
+    def __init__(self,
+                 source_queue: queue.Queue,
+                 flush_func: Callable[[List[Any]], bool], # Пишет пакет; False или исключение - пакет не записан
+                 max_batch_size: int = 200,
+                 max_latency: float = 2.0,
+                 logger=None):
+        self.source_queue = source_queue
+        self.flush_func = flush_func
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.logger = logger or get_logger("WriteBehindBatcher")
+        self._lock = threading.Lock()
+        self._stats = {"flushes": 0, "rows": 0, "failed_rows": 0, "row_fallbacks": 0,
+                       "total_flush_time": 0.0, "max_flush_time": 0.0, "max_backlog": 0, "max_wait": 0.0}
+
+    def run(self):
+        """
+        Цикл потребителя (цель потока). Завершается на None, предварительно сбросив накопленное.
+        """
+        batch: List[Any] = []
+        oldest_at: Optional[float] = None
+
+        while True:
+            timeout = None if oldest_at is None else max(0.0, oldest_at + self.max_latency - time.monotonic())
+            try:
+                item = self.source_queue.get(timeout=timeout)
+            except queue.Empty:
+                item = self._LATENCY_EXPIRED
+
+            if item is self._LATENCY_EXPIRED:
+                self._flush(batch, oldest_at)
+                batch, oldest_at = [], None
+                continue
+
+            if item is None:
+                self._flush(batch, oldest_at)
+                self.source_queue.task_done()
+                self.logger.info("Запись в БД остановлена: %s", self.stats())
+                return
+
+            batch.append(item)
+            if oldest_at is None:
+                oldest_at = time.monotonic()
+            if len(batch) >= self.max_batch_size:
+                self._flush(batch, oldest_at)
+                batch, oldest_at = [], None
+
+    def _flush(self, batch: List[Any], oldest_at: Optional[float]):
+        if not batch:
+            return
+        backlog = self.source_queue.qsize()
+        start_time = time.monotonic()
+        try:
+            written = self._write(batch)
+        finally:
+            for _ in batch:
+                self.source_queue.task_done()
+
+        flush_time = time.monotonic() - start_time
+        waited = start_time - oldest_at if oldest_at is not None else 0.0
+        with self._lock:
+            self._stats["flushes"] += 1
+            self._stats["rows"] += written
+            self._stats["failed_rows"] += len(batch) - written
+            self._stats["total_flush_time"] += flush_time
+            self._stats["max_flush_time"] = max(self._stats["max_flush_time"], flush_time)
+            self._stats["max_backlog"] = max(self._stats["max_backlog"], backlog)
+            self._stats["max_wait"] = max(self._stats["max_wait"], waited)
+        self.logger.info("Записано в БД %s из %s строк за %.3f сек (ждали %.2f сек, в очереди ещё %s)",
+                         written, len(batch), flush_time, waited, backlog)
+
+    def _write(self, batch: List[Any]) -> int:
+        if self._try_flush(batch):
+            return len(batch)
+        if len(batch) == 1:
+            self.logger.error("Не удалось записать строку: %s", batch[0])
+            return 0
+
+        with self._lock:
+            self._stats["row_fallbacks"] += 1
+        self.logger.warning("Пакет из %s строк не записан, пишем по одной", len(batch))
+        written = 0
+        for item in batch:
+            if self._try_flush([item]):
+                written += 1
+            else:
+                self.logger.error("Не удалось записать строку: %s", item)
+        return written
+
+    def _try_flush(self, items: List[Any]) -> bool:
+        try:
+            return self.flush_func(items) is not False
+        except Exception as e:
+            self.logger.exception("Ошибка записи пакета: %s", e)
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["backlog"] = self.source_queue.qsize()
+        stats["avg_flush_time"] = round(stats["total_flush_time"] / stats["flushes"], 4) if stats["flushes"] else 0.0
+        stats["total_flush_time"] = round(stats["total_flush_time"], 3)
+        stats["max_flush_time"] = round(stats["max_flush_time"], 3)
+        stats["max_wait"] = round(stats["max_wait"], 3)
+        return stats
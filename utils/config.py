@@ -1,3 +1,5 @@
+import os
+
 default_headers = {"Accept": "*/*",
                         "Accept-Encoding": "gzip, deflate, br, zstd",
                         "Accept-Language": "en-GB,en-US;q=0.9,en;q=0.8",
@@ -16,4 +18,68 @@ cookies_decrypt_key = 'l5JCQ4mwlIeRmTQ55wODcl1QmcgEXMfpSk9s5aHFqiY='
 cookie_access_name_array = ['Wildberries Seller ЛК Cookies с доступом Поставки',
                              'Wildberries Seller ЛК Cookies с доступом Поставки. Дополнительный 1',
                             'Wildberries Seller ЛК Cookies с доступом Поставки. Дополнительный 2',
-                            'Wildberries Seller ЛК Cookies с доступом Поставки. Дополнительный 3']
\ No newline at end of file
+                            'Wildberries Seller ЛК Cookies с доступом Поставки. Дополнительный 3']
+
+# Размеры пулов keep-alive соединений для сессий requests (на каждую cookie-учётку)
+http_pool_connections = 4
+http_pool_maxsize = 16
+
+# Стартовые параметры токен-бакетов на (cookie-учётка, эндпоинт); скорость дальше подстраивается по AIMD
+rate_limits = {'order': {'rate': 10.0, 'capacity': 1, 'min_rate': 0.2, 'max_rate': 25.0, 'throttle_cooldown': 10.0},
+               'quota': {'rate': 2.0, 'capacity': 2, 'min_rate': 0.2, 'max_rate': 10.0, 'throttle_cooldown': 5.0},
+               'stocks': {'rate': 2.0, 'capacity': 2, 'min_rate': 0.2, 'max_rate': 10.0, 'throttle_cooldown': 5.0},
+               'cards': {'rate': 1.5, 'capacity': 1, 'min_rate': 0.2, 'max_rate': 5.0, 'throttle_cooldown': 10.0}}
+
+# Повторная отправка заявок после 429/5xx: попытки и экспоненциальный бэкофф с джиттером (секунды)
+transfer_retry_settings = {'max_attempts': 4, 'base_delay': 1.0, 'max_delay': 60.0}
+
+# Базовые адреса API ВБ. Переопределяются переменными окружения, например для прогона против локального стенда (benchmarks/wb_stand_in_server.py)
+wb_seller_weekly_report_url = os.getenv('WB_SELLER_WEEKLY_REPORT_URL', 'https://seller-weekly-report.wildberries.ru')
+wb_content_api_url = os.getenv('WB_CONTENT_API_URL', 'https://content-api.wildberries.ru')
+wb_seller_analytics_api_url = os.getenv('WB_SELLER_ANALYTICS_API_URL', 'https://seller-analytics-api.wildberries.ru')
+
+# Пул соединений MySQL: стартовый и максимальный размер, через сколько секунд простоя пинговать соединение перед выдачей
+# и через сколько закрывать лишние (сверх minsize)
+mysql_pool_settings = {'minsize': 1, 'maxsize': 10, 'idle_ping_after': 30.0, 'max_idle_time': 300.0}
+
+# Учёт запросов SyncDatabase и AsyncDatabase (общий): порог медленного запроса (сек), EXPLAIN для медленных SELECT (включается MYSQL_EXPLAIN_SLOW_QUERIES=1),
+# сколько последних медленных запросов хранить
+mysql_instrumentation_settings = {'enabled': True,
+                                  'slow_query_threshold': 1.0,
+                                  'explain_slow_queries': os.getenv('MYSQL_EXPLAIN_SLOW_QUERIES', '0') == '1',
+                                  'slow_log_size': 50}
+
+# Пул aiomysql для асинхронных читателей (создаётся на время одного event loop)
+async_mysql_pool_settings = {'minsize': 1, 'maxsize': 8}
+
+# Локальные хранилища (sqlite) рядом с проектом; каталог переопределяется LOCAL_STORAGE_DIR
+local_storage_dir = os.getenv('LOCAL_STORAGE_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.local_storage'))
+chrtid_store_path = os.path.join(local_storage_dir, 'chrtid_store.sqlite3')
+reference_cache_path = os.path.join(local_storage_dir, 'reference_cache.sqlite3')
+plan_cache_path = os.path.join(local_storage_dir, 'plan_cache.sqlite3')
+
+# Кеш справочников (размеры, офисы/регионы, направления поставок, chrtID): перечитываются из БД, когда меняется
+# проба версии таблицы, и не реже чем раз в max_age_hours. REFERENCE_CACHE_ENABLED=0 отключает кеш
+reference_cache_settings = {'enabled': os.getenv('REFERENCE_CACHE_ENABLED', '1') == '1', 'max_age_hours': 24}
+
+# Дозапрос недостающих chrtID: карточек на страницу, параллельных запросов, порог перехода на обход каталога страницами
+# (точечный запрос - один nmID, страница обхода - page_size карточек, поэтому обход выгоднее уже с пары десятков nmID),
+# предел времени обхода (сек) и сколько часов не переспрашивать nmID, которые Content API не разрешил
+chrtid_resolver_settings = {'page_size': 100, 'max_concurrency': 4, 'catalog_sweep_threshold': 20, 'max_attempts': 3,
+                            'sweep_time_budget': 120.0, 'unresolved_ttl_hours': 24.0}
+
+# Расчёт распределения регулярного задания: 'numpy' - векторный движок (services/allocation_engine.py),
+# 'python' - прежний расчёт по товарам в циклах. Тела заявок у обоих одинаковые
+allocation_engine = os.getenv('ALLOCATION_ENGINE', 'numpy')
+
+# Процессов планирования регулярного задания: N > 0 - товары шардируются по nmId между N процессами, заявки
+# сливаются в исходном порядке товаров (результат тот же, что в одном процессе). 0 - расчёт в текущем процессе, как раньше
+planning_workers = int(os.getenv('PLANNING_WORKERS', '0'))
+
+# Кеш планов регулярного задания: заявки товара переиспользуются, пока не изменился отпечаток его входных данных
+# (остатки, товары в пути, блокировки, доли задания, квоты). Выключен по умолчанию, включается PLAN_CACHE_ENABLED=1
+plan_cache_settings = {'enabled': os.getenv('PLAN_CACHE_ENABLED', '0') == '1', 'max_age_hours': 24}
+
+# Запись отправленных товаров в a_wb_stock_transfer_products_on_the_way: строк в одном INSERT
+# и сколько секунд строка может ждать в буфере до сброса
+products_on_the_way_writer_settings = {'max_batch_size': 200, 'max_latency': 2.0}